@@ -0,0 +1,39 @@
+_base_ = "div2k.py"
+
+train_lq_folder = "data/shard/div2k_lq/bpg/qp37/train.shard"
+train_gt_folder = "data/shard/div2k/train.shard"
+
+train_pipeline = [
+    dict(
+        type="LoadImageFromShard",
+        shard_path=train_lq_folder,
+        key="lq",
+        channel_order="rgb",
+    ),
+    dict(
+        type="LoadImageFromShard",
+        shard_path=train_gt_folder,
+        key="gt",
+        channel_order="rgb",
+    ),
+    # crop before rescaling to read only the patches
+    dict(type="PairedRandomCrop", gt_patch_size=128),  # keys must be 'lq' and 'gt'
+    dict(type="RescaleToZeroOne", keys=["lq", "gt"]),
+    dict(type="Flip", keys=["lq", "gt"], flip_ratio=0.5, direction="horizontal"),
+    dict(type="Flip", keys=["lq", "gt"], flip_ratio=0.5, direction="vertical"),
+    dict(type="RandomTransposeHW", keys=["lq", "gt"], transpose_ratio=0.5),
+    dict(type="ImageToTensor", keys=["lq", "gt"]),
+    dict(type="Collect", keys=["lq", "gt"], meta_keys=["lq_path", "gt_path"]),
+]
+
+data = dict(
+    train=dict(
+        dataset=dict(
+            type="PairedImageShardDataset",
+            lq_folder=train_lq_folder,
+            gt_folder=train_gt_folder,
+            pipeline=train_pipeline,
+            scale=1,
+        )
+    )
+)
@@ -0,0 +1,37 @@
+_base_ = "vimeo90k_septuplet.py"
+
+train_lq_folder = "data/lmdb/vimeo_septuplet_lq/hm18.0/ldp/qp37/sequences.lmdb"
+train_gt_folder = "data/lmdb/vimeo_septuplet/sequences.lmdb"
+
+train_pipeline = [
+    dict(
+        type="LoadFramesFromLmdb",
+        db_path=train_lq_folder,
+        key="lq",
+        channel_order="rgb",
+    ),
+    dict(
+        type="LoadFramesFromLmdb",
+        db_path=train_gt_folder,
+        key="gt",
+        channel_order="rgb",
+    ),
+    dict(type="RescaleToZeroOne", keys=["lq", "gt"]),
+    dict(type="PairedRandomCrop", gt_patch_size=256),  # keys must be 'lq' and 'gt'
+    dict(type="Flip", keys=["lq", "gt"], flip_ratio=0.5, direction="horizontal"),
+    dict(type="Flip", keys=["lq", "gt"], flip_ratio=0.5, direction="vertical"),
+    dict(type="RandomTransposeHW", keys=["lq", "gt"], transpose_ratio=0.5),
+    dict(type="FramesToTensor", keys=["lq", "gt"]),
+    dict(type="Collect", keys=["lq", "gt"], meta_keys=["lq_path", "gt_path"]),
+]
+
+data = dict(
+    train=dict(
+        dataset=dict(
+            lq_folder=train_lq_folder,
+            gt_folder=train_gt_folder,
+            pipeline=train_pipeline,
+            io_backend="lmdb",
+        )
+    )
+)
@@ -1,15 +1,32 @@
 from .builder import build_dataset
+from .image_shard import PairedImageShardDataset
 from .paired_video_dataset import (
     PairedVideoDataset,
     PairedVideoKeyFramesAnnotationDataset,
     PairedVideoKeyFramesDataset,
 )
-from .registry import DATASETS
+from .pipelines import (
+    FlipWithFlow,
+    LoadFlowFromFile,
+    LoadFramesFromLmdb,
+    LoadImageFromShard,
+    PairedRandomCropWithFlow,
+    RandomTransposeHWWithFlow,
+)
+from .registry import DATASETS, PIPELINES
 
 __all__ = [
     "DATASETS",
+    "PIPELINES",
     "build_dataset",
     "PairedVideoDataset",
     "PairedVideoKeyFramesDataset",
     "PairedVideoKeyFramesAnnotationDataset",
+    "PairedImageShardDataset",
+    "LoadFlowFromFile",
+    "LoadFramesFromLmdb",
+    "LoadImageFromShard",
+    "PairedRandomCropWithFlow",
+    "FlipWithFlow",
+    "RandomTransposeHWWithFlow",
 ]
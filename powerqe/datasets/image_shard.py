@@ -0,0 +1,143 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import os.path as osp
+
+import numpy as np
+from mmedit.datasets.base_sr_dataset import BaseSRDataset
+
+from .registry import DATASETS
+
+
+def read_shard_meta(shard_path):
+    """Read the images recorded in an image shard.
+
+    A shard is a folder ending with ".shard":
+
+    example.shard
+    ├── data.bin
+    ├── meta_info.txt
+
+    data.bin stores decoded uint8 images in HWC and BGR order contiguously.
+    Each line of meta_info.txt records the image name, the shape and the byte
+    offset in data.bin, separated by a white space, e.g.,
+    `0001_s001.png (480,480,3) 0`. See tools/data/prepare_image_shard.py.
+
+    Args:
+        shard_path (str): Path to the shard.
+
+    Returns:
+        dict: (offset, shape) of each image name.
+    """
+    imgs = dict()
+    with open(osp.join(shard_path, "meta_info.txt"), "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            name, shape, offset = line.split(" ")
+            shape = tuple(int(x) for x in shape.strip("()").split(","))
+            imgs[name] = (int(offset), shape)
+    return imgs
+
+
+class ImageShard:
+    """Memory-mapped image shard.
+
+    The shard is mapped in each process at the first access, so that
+    dataloader workers share the OS page cache rather than copies.
+
+    Args:
+        shard_path (str): Path to the shard. See read_shard_meta.
+    """
+
+    def __init__(self, shard_path):
+        self.shard_path = shard_path
+        self._imgs = None
+        self._data = None
+        self._pid = None
+
+    def get(self, name):
+        """Get an image as a read-only view with the shape of (H, W, C).
+
+        No pixel is read until the view is accessed; cropping the view reads
+        only the rows of the patch.
+        """
+        if self._data is None or self._pid != os.getpid():
+            self._imgs = read_shard_meta(self.shard_path)
+            self._data = np.memmap(
+                osp.join(self.shard_path, "data.bin"), dtype=np.uint8, mode="r"
+            )
+            self._pid = os.getpid()
+        if name not in self._imgs:
+            raise KeyError(f'Cannot find "{name}" in "{self.shard_path}".')
+        offset, shape = self._imgs[name]
+        return self._data[offset : offset + int(np.prod(shape))].reshape(shape)
+
+    def __getstate__(self):
+        # Do not pickle the mapped data
+        return dict(shard_path=self.shard_path, _imgs=None, _data=None, _pid=None)
+
+
+@DATASETS.register_module()
+class PairedImageShardDataset(BaseSRDataset):
+    """Paired image dataset stored in image shards.
+
+    Differences to SRLmdbDataset:
+        Images are decoded in advance and memory-mapped. Load them by
+            LoadImageFromShard, and crop them by PairedRandomCrop before any
+            other transformation, so that only the patches are read.
+
+    Args:
+        lq_folder (str): LQ shard.
+        gt_folder (str): GT shard.
+        pipeline (List[dict | callable]): A list of data transformations.
+        scale (int): Upsampling scale ratio.
+        test_mode (bool): Store True when building test dataset.
+            Default: False.
+    """
+
+    def __init__(self, lq_folder, gt_folder, pipeline, scale, test_mode=False):
+        super().__init__(pipeline, scale, test_mode)
+        self.lq_folder = str(lq_folder)
+        self.gt_folder = str(gt_folder)
+        self.data_infos = self.load_annotations()
+
+    def load_annotations(self):
+        """Load images recorded in the meta_info.txt of the shards.
+
+        The paths are "{lq_folder}/{name}" and "{gt_folder}/{name}".
+
+        Returns:
+            list[dict]: A list of dicts for paired paths of LQ and GT.
+        """
+        for folder in [self.lq_folder, self.gt_folder]:
+            if not folder.endswith(".shard"):
+                raise ValueError(f'Shard "{folder}" should end with ".shard".')
+
+        lq_names = read_shard_meta(self.lq_folder)
+        gt_names = read_shard_meta(self.gt_folder)
+        missing = set(lq_names) - set(gt_names)
+        assert not missing, f'Cannot find "{missing.pop()}" in "{self.gt_folder}".'
+
+        data_infos = []
+        for name in lq_names:
+            data_infos.append(
+                dict(
+                    lq_path=osp.join(self.lq_folder, name),
+                    gt_path=osp.join(self.gt_folder, name),
+                )
+            )
+        return data_infos
@@ -16,9 +16,12 @@ import os
 import os.path as osp
 from glob import glob
 
+import numpy as np
 from mmedit.datasets import SRAnnotationDataset
 
 from .registry import DATASETS
+from .sample_table import SampleTable
+from .seq_index import load_lmdb_seq_index, load_seq_index, read_lmdb_meta
 
 
 @DATASETS.register_module()
@@ -83,6 +86,18 @@ class PairedVideoDataset(SRAnnotationDataset):
         center_gt (bool): If True, only the center frame is recorded in GT.
             The samp_len is required to be odd.
             Note that gt_path is always a list. Default: False.
+        flow_folder (str | :obj:Path | None): Folder of pre-computed flows.
+            The flows of a sequence are stored in "{flow_folder}/{key}.npz".
+            See LoadFlowFromFile. Default: None.
+        index_cache (str | None): Folder of the persistent index of
+            sequences. The scan of folders is skipped if the index is valid.
+            See load_seq_index. None to scan every time. Default: None.
+        scan_workers (int): Number of threads for scanning folders.
+            Default: 8.
+        io_backend (str): "disk" or "lmdb". For "lmdb", lq_folder and
+            gt_folder are LMDB files made by tools/data/prepare_video_lmdb.py,
+            and sequences are read from their meta_info.txt instead of
+            scanning. Load frames by LoadFramesFromLmdb. Default: "disk".
     """
 
     def __init__(
@@ -97,11 +112,23 @@ class PairedVideoDataset(SRAnnotationDataset):
         stride=1,
         padding=False,
         center_gt=False,
+        flow_folder=None,
+        index_cache=None,
+        scan_workers=8,
+        io_backend="disk",
     ):
         self.samp_len = samp_len
         self.stride = stride
         self.padding = padding
         self.center_gt = center_gt
+        self.flow_folder = flow_folder
+        self.index_cache = index_cache
+        self.scan_workers = scan_workers
+        if io_backend not in ["disk", "lmdb"]:
+            raise ValueError(
+                f'"io_backend" should be "disk" or "lmdb"; received "{io_backend}".'
+            )
+        self.io_backend = io_backend
 
         super().__init__(
             lq_folder=lq_folder,
@@ -117,6 +144,27 @@ class PairedVideoDataset(SRAnnotationDataset):
         idxs = [max(min(x, seq_len - 1), 0) for x in idxs]  # clip
         return idxs
 
+    def load_keys(self):
+        """Load sequence keys from the annotation file.
+
+        If the annotation file is not given, collect all sequences in the GT
+        folder, or in the GT LMDB file for the "lmdb" backend.
+
+        Returns:
+            list[str]: Sequence keys.
+        """
+        if self.ann_file:
+            with open(self.ann_file, "r") as f:
+                keys = f.read().split("\n")
+                keys = [k.strip() for k in keys if (k.strip() is not None and k != "")]
+            keys = [key.replace("/", os.sep) for key in keys]
+        elif self.io_backend == "lmdb":
+            keys = list(read_lmdb_meta(self.gt_folder))
+        else:
+            sub_dirs = glob(osp.join(self.gt_folder, "*/"))
+            keys = [sub_dir.split("/")[-2] for sub_dir in sub_dirs]
+        return keys
+
     def load_annotations(self):
         """Load sequences according to the annotation file.
 
@@ -144,51 +192,39 @@ class PairedVideoDataset(SRAnnotationDataset):
         See the image saving function in BasicVQERestorer for reasons.
 
         Returns:
-            list[dict]: Each dict records the information for a sub-sequence to
-                serve as a sample in training or testing.
+            SampleTable: Each item is a dict recording the information for a
+                sub-sequence to serve as a sample in training or testing.
         """
-        # Get sequence keys
-        if self.ann_file:
-            with open(self.ann_file, "r") as f:
-                keys = f.read().split("\n")
-                keys = [k.strip() for k in keys if (k.strip() is not None and k != "")]
-            keys = [key.replace("/", os.sep) for key in keys]
-        else:
-            sub_dirs = glob(osp.join(self.gt_folder, "*/"))
-            keys = [sub_dir.split("/")[-2] for sub_dir in sub_dirs]
-
-        # Collect sample paths according to the keys
-        data_infos = []
-        for key in keys:
-            # Get frame paths
-            gt_seq = osp.join(self.gt_folder, key)
-            lq_seq = osp.join(self.lq_folder, key)
-            gt_paths = self.scan_folder(gt_seq)
-            assert len(gt_paths) > 0, f'No images were found in "{gt_seq}".'
-            lq_paths = self.scan_folder(lq_seq)
-            assert len(gt_paths) == len(lq_paths), (
-                f'The GT and LQ sequences for key "{key}" should have'
-                " the same number of images;"
-                f" GT has {len(gt_paths)} images while"
-                f" LQ has {len(lq_paths)} images."
+        keys = self.load_keys()
+        if self.io_backend == "lmdb":
+            seq_index = load_lmdb_seq_index(
+                gt_folder=self.gt_folder, lq_folder=self.lq_folder, keys=keys
             )
-
-            # Sort frame paths
-            gt_names = [osp.basename(gt_path) for gt_path in gt_paths]
-            gt_names = sorted(
-                gt_names, key=lambda x: int("".join(filter(str.isdigit, x)))
+        else:
+            seq_index = load_seq_index(
+                gt_folder=self.gt_folder,
+                lq_folder=self.lq_folder,
+                keys=keys,
+                ann_file=self.ann_file,
+                cache_dir=self.index_cache,
+                nworkers=self.scan_workers,
             )
-            gt_paths = [osp.join(gt_seq, gt_name) for gt_name in gt_names]
 
-            # Check
-            for gt_name in gt_names:
-                lq_path = osp.join(lq_seq, gt_name)
-                assert lq_path in lq_paths, f'Cannot find "{lq_path}" in "{lq_seq}".'
+        # Collect samples according to the keys
+        data_infos = SampleTable(
+            gt_folder=self.gt_folder,
+            lq_folder=self.lq_folder,
+            flow_folder=self.flow_folder,
+        )
+        for key in keys:
+            gt_names = seq_index[key]
+            seq_idx = data_infos.add_seq(key, gt_names)
+            seq_len = len(gt_names)
 
-            samp_len = len(gt_paths) if self.samp_len == -1 else self.samp_len
-            assert samp_len <= len(gt_paths), (
+            samp_len = seq_len if self.samp_len == -1 else self.samp_len
+            assert samp_len <= seq_len, (
                 f"The sample length ({samp_len}) should not be"
-                f" larger than the sequence length ({len(gt_paths)})."
+                f" larger than the sequence length ({seq_len})."
             )
 
             if self.center_gt and (samp_len % 2 == 0):
@@ -198,8 +234,6 @@ class PairedVideoDataset(SRAnnotationDataset):
                 )
 
             # Record samples
-            seq_len = len(gt_paths)
-
             nfrms_left = samp_len // 2
             nfrms_right = 0 if samp_len == 1 else (samp_len - nfrms_left - 1)
             samp_start = 0 if self.padding else nfrms_left
@@ -219,15 +253,8 @@ class PairedVideoDataset(SRAnnotationDataset):
                     gt_idxs = [center_idx]
                 else:
                     gt_idxs = lq_idxs
-
-                samp_gt_paths = [gt_paths[idx] for idx in gt_idxs]
-                samp_lq_paths = [osp.join(lq_seq, gt_names[idx]) for idx in lq_idxs]
-
-                record_key = key + os.sep + ",".join([gt_names[idx] for idx in gt_idxs])
-                data_infos.append(
-                    dict(gt_path=samp_gt_paths, lq_path=samp_lq_paths, key=record_key)
-                )
-        return data_infos
+                data_infos.add_sample(seq_idx, lq_idxs=lq_idxs, gt_idxs=gt_idxs)
+        return data_infos.finalize()
 
 
 @DATASETS.register_module()
@@ -298,6 +325,18 @@ class PairedVideoKeyFramesDataset(PairedVideoDataset):
             "1" denotes key frames; "0" denotes non-key frames.
             Can be longer than the sequence.
             See the document for more details.
+        flow_folder (str | :obj:Path | None): Folder of pre-computed flows.
+            The flows of a sequence are stored in "{flow_folder}/{key}.npz".
+            See LoadFlowFromFile. Default: None.
+        index_cache (str | None): Folder of the persistent index of
+            sequences. The scan of folders is skipped if the index is valid.
+            See load_seq_index. None to scan every time. Default: None.
+        scan_workers (int): Number of threads for scanning folders.
+            Default: 8.
+        io_backend (str): "disk" or "lmdb". For "lmdb", lq_folder and
+            gt_folder are LMDB files made by tools/data/prepare_video_lmdb.py,
+            and sequences are read from their meta_info.txt instead of
+            scanning. Load frames by LoadFramesFromLmdb. Default: "disk".
     """
 
     def __init__(
@@ -313,10 +352,15 @@ class PairedVideoKeyFramesDataset(PairedVideoDataset):
         padding=False,
         center_gt=False,
         key_frames=None,
+        flow_folder=None,
+        index_cache=None,
+        scan_workers=8,
+        io_backend="disk",
     ):
         if key_frames is None:
             key_frames = [1, 0, 1, 0, 1, 0, 1]
-        self.key_frames = key_frames
+        self.key_frames = np.asarray(key_frames)
+        self._key_idxs = dict()
         super().__init__(
             lq_folder=lq_folder,
             gt_folder=gt_folder,
@@ -328,39 +372,53 @@ class PairedVideoKeyFramesDataset(PairedVideoDataset):
             stride=stride,
             padding=padding,
             center_gt=center_gt,
+            flow_folder=flow_folder,
+            index_cache=index_cache,
+            scan_workers=scan_workers,
+            io_backend=io_backend,
         )
 
+    def get_key_idxs(self, seq_len):
+        """Get the indexes of key frames in a sequence.
+
+        The indexes are computed once for each sequence length.
+
+        Args:
+            seq_len (int): Sequence length.
+
+        Returns:
+            ndarray: Sorted indexes of key frames.
+        """
+        if seq_len not in self._key_idxs:
+            assert len(self.key_frames) >= seq_len, (
+                "The length of the key-frame annotation"
+                f" ({len(self.key_frames)}) should be larger than that of the"
+                f" sequence ({seq_len})."
+            )
+            self._key_idxs[seq_len] = np.flatnonzero(self.key_frames[:seq_len])
+        return self._key_idxs[seq_len]
+
     def find_neighboring_frames(self, seq_len, center_idx, nfrms_left, nfrms_right):
-        # Check
-        assert len(self.key_frames) >= seq_len, (
-            f"The length of the key-frame annotation ({self.key_frames})"
-            " should be larger than that of the sequence"
-            f" ({len(seq_len)})."
-        )
-        key_frames = self.key_frames[:seq_len]
+        key_idxs = self.get_key_idxs(seq_len)
 
         # Find neighboring key frames
-        key_idxs = [idx for idx in range(len(key_frames)) if key_frames[idx]]
-
-        key_idxs_left = [idx for idx in key_idxs if idx < center_idx]
+        pos = np.searchsorted(key_idxs, center_idx, side="left")
+        key_idxs_left = key_idxs[max(pos - nfrms_left, 0) : pos].tolist()
         if len(key_idxs_left) == 0:  # if not found
             key_idxs_left = [center_idx - 1] * nfrms_left  # use neighbor
         elif len(key_idxs_left) < nfrms_left:
             key_idxs_left = [key_idxs_left[0]] * (
                 nfrms_left - len(key_idxs_left)
             ) + key_idxs_left
-        else:
-            key_idxs_left = key_idxs_left[-nfrms_left:]
 
-        key_idxs_right = [idx for idx in key_idxs if idx > center_idx]
+        pos = np.searchsorted(key_idxs, center_idx, side="right")
+        key_idxs_right = key_idxs[pos : pos + nfrms_right].tolist()
         if len(key_idxs_right) == 0:
             key_idxs_right = [center_idx + 1] * nfrms_right
         elif len(key_idxs_right) < nfrms_right:
             key_idxs_right = key_idxs_right + [key_idxs_right[-1]] * (
                 nfrms_right - len(key_idxs_right)
             )
-        else:
-            key_idxs_right = key_idxs_right[:nfrms_right]
 
         idxs = key_idxs_left + [center_idx] + key_idxs_right
         idxs = [max(min(x, seq_len - 1), 0) for x in idxs]  # clip
@@ -434,6 +492,18 @@ class PairedVideoKeyFramesAnnotationDataset(PairedVideoDataset):
             "1" denotes key frames; "0" denotes non-key frames.
             Can be longer than the sequence.
             See the document for more details.
+        flow_folder (str | :obj:Path | None): Folder of pre-computed flows.
+            The flows of a sequence are stored in "{flow_folder}/{key}.npz".
+            See LoadFlowFromFile. Default: None.
+        index_cache (str | None): Folder of the persistent index of
+            sequences. The scan of folders is skipped if the index is valid.
+            See load_seq_index. None to scan every time. Default: None.
+        scan_workers (int): Number of threads for scanning folders.
+            Default: 8.
+        io_backend (str): "disk" or "lmdb". For "lmdb", lq_folder and
+            gt_folder are LMDB files made by tools/data/prepare_video_lmdb.py,
+            and sequences are read from their meta_info.txt instead of
+            scanning. Load frames by LoadFramesFromLmdb. Default: "disk".
     """
 
     def __init__(
@@ -449,10 +519,14 @@ class PairedVideoKeyFramesAnnotationDataset(PairedVideoDataset):
         padding=False,
         center_gt=False,
         key_frames=None,
+        flow_folder=None,
+        index_cache=None,
+        scan_workers=8,
+        io_backend="disk",
     ):
         if key_frames is None:
             key_frames = [1, 0, 1, 0, 1, 0, 1]
-        self.key_frames = key_frames
+        self.key_frames = np.asarray(key_frames)
         super().__init__(
             lq_folder=lq_folder,
             gt_folder=gt_folder,
@@ -464,6 +538,10 @@ class PairedVideoKeyFramesAnnotationDataset(PairedVideoDataset):
             stride=stride,
             padding=padding,
             center_gt=center_gt,
+            flow_folder=flow_folder,
+            index_cache=index_cache,
+            scan_workers=scan_workers,
+            io_backend=io_backend,
         )
 
     def load_annotations(self):
@@ -493,93 +571,9 @@ class PairedVideoKeyFramesAnnotationDataset(PairedVideoDataset):
         See the image saving function in BasicVQERestorer for reasons.
 
         Returns:
-            list[dict]: Each dict records the information for a sub-sequence to
-                serve as a sample in training or testing.
+            SampleTable: Each item is a dict recording the information for a
+                sub-sequence to serve as a sample in training or testing.
         """
-        # Get sequence keys
-        if self.ann_file:
-            with open(self.ann_file, "r") as f:
-                keys = f.read().split("\n")
-                keys = [k.strip() for k in keys if (k.strip() is not None and k != "")]
-            keys = [key.replace("/", os.sep) for key in keys]
-        else:
-            sub_dirs = glob(osp.join(self.gt_folder, "*/"))
-            keys = [sub_dir.split("/")[-2] for sub_dir in sub_dirs]
-
-        # Collect sample paths according to the keys
-        data_infos = []
-        for key in keys:
-            # Get frame paths
-            gt_seq = osp.join(self.gt_folder, key)
-            lq_seq = osp.join(self.lq_folder, key)
-            gt_paths = self.scan_folder(gt_seq)
-            assert len(gt_paths) > 0, f'No images were found in "{gt_seq}".'
-            lq_paths = self.scan_folder(lq_seq)
-            assert len(gt_paths) == len(lq_paths), (
-                f'The GT and LQ sequences for key "{key}" should have'
-                " the same number of images;"
-                f" GT has {len(gt_paths)} images while"
-                f" LQ has {len(lq_paths)} images."
-            )
-
-            # Sort frame paths
-            gt_names = [osp.basename(gt_path) for gt_path in gt_paths]
-            gt_names = sorted(
-                gt_names, key=lambda x: int("".join(filter(str.isdigit, x)))
-            )
-            gt_paths = [osp.join(gt_seq, gt_name) for gt_name in gt_names]
-
-            # Check
-            for gt_name in gt_names:
-                lq_path = osp.join(lq_seq, gt_name)
-                assert lq_path in lq_paths, f'Cannot find "{lq_path}" in "{lq_seq}".'
-
-            samp_len = len(gt_paths) if self.samp_len == -1 else self.samp_len
-            assert samp_len <= len(gt_paths), (
-                f"The sample length ({samp_len}) should not be"
-                f" larger than the sequence length ({len(gt_paths)})."
-            )
-
-            if self.center_gt and (samp_len % 2 == 0):
-                raise ValueError(
-                    f"The sample length ({samp_len}) should be odd"
-                    " when requiring center GT."
-                )
-
-            # Record samples
-            seq_len = len(gt_paths)
-
-            nfrms_left = samp_len // 2
-            nfrms_right = 0 if samp_len == 1 else (samp_len - nfrms_left - 1)
-            samp_start = 0 if self.padding else nfrms_left
-            samp_end = seq_len if self.padding else (seq_len - nfrms_right)
-            center_idxs = list(range(samp_start, samp_end, self.stride))
-            if self.test_mode and (center_idxs[-1] + nfrms_right + 1) < seq_len:
-                center_idxs.append(seq_len - nfrms_right - 1)
-
-            for center_idx in center_idxs:
-                lq_idxs = self.find_neighboring_frames(
-                    center_idx=center_idx,
-                    seq_len=seq_len,
-                    nfrms_left=nfrms_left,
-                    nfrms_right=nfrms_right,
-                )
-                if self.center_gt:
-                    gt_idxs = [center_idx]
-                else:
-                    gt_idxs = lq_idxs
-
-                samp_gt_paths = [gt_paths[idx] for idx in gt_idxs]
-                samp_lq_paths = [osp.join(lq_seq, gt_names[idx]) for idx in lq_idxs]
-
-                record_key = key + os.sep + ",".join([gt_names[idx] for idx in gt_idxs])
-                key_frms = [self.key_frames[idx] for idx in lq_idxs]
-                data_infos.append(
-                    dict(
-                        gt_path=samp_gt_paths,
-                        lq_path=samp_lq_paths,
-                        key=record_key,
-                        key_frms=key_frms,
-                    )
-                )
+        data_infos = super().load_annotations()
+        data_infos.key_frames = self.key_frames
         return data_infos
@@ -0,0 +1,365 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import os.path as osp
+
+import mmcv
+import numpy as np
+from mmedit.datasets.pipelines import Flip, PairedRandomCrop, RandomTransposeHW
+
+from .image_shard import ImageShard
+from .registry import PIPELINES
+
+FLOW_MODES = ["recurrent", "center"]
+
+
+def get_flow_pairs(lq_paths, mode):
+    """Get the (reference, supporting) frame pairs of the flows of a sample.
+
+    Args:
+        lq_paths (list[str]): LQ paths of the sample.
+        mode (str): "recurrent" for the forward and backward flows between
+            neighboring frames, e.g., for ProVQE. "center" for the flows from
+            the center frame to the left and right PQFs, e.g., for MFQEv2.
+
+    Returns:
+        list[tuple[str]]: Frame pairs. For "recurrent", T-1 forward pairs are
+            followed by T-1 backward pairs, same as BasicVSRPlusPlus.
+    """
+    if mode not in FLOW_MODES:
+        raise ValueError(f'"mode" should be in "{FLOW_MODES}"; received "{mode}".')
+    if mode == "recurrent":
+        pairs_forward = list(zip(lq_paths[1:], lq_paths[:-1]))
+        pairs_backward = list(zip(lq_paths[:-1], lq_paths[1:]))
+        return pairs_forward + pairs_backward
+    if len(lq_paths) != 3:
+        raise ValueError(
+            f'Samples should have 3 frames for "center"; received {len(lq_paths)}.'
+        )
+    return [(lq_paths[1], lq_paths[0]), (lq_paths[1], lq_paths[2])]
+
+
+def get_flow_name(ref_path, supp_path):
+    """Get the name of a flow in the flow file of a sequence."""
+    ref_stem = osp.splitext(osp.basename(ref_path))[0]
+    supp_stem = osp.splitext(osp.basename(supp_path))[0]
+    return f"{ref_stem}-{supp_stem}"
+
+
+def flip_flow(flow, direction):
+    """Flip a flow with the shape of (H, W, 2) and negate the flipped axis."""
+    axis = 1 if direction == "horizontal" else 0
+    flow = np.flip(flow, axis=axis).copy()
+    flow[..., 1 - axis] *= -1  # (dx, dy)
+    return flow
+
+
+def transpose_flow(flow):
+    """Transpose a flow with the shape of (H, W, 2) and swap dx and dy."""
+    return flow.transpose(1, 0, 2)[..., ::-1].copy()
+
+
+@PIPELINES.register_module()
+class LoadFlowFromFile:
+    """Load pre-computed flows of a sample.
+
+    Flows of a sequence are stored in one NPZ file; see
+    tools/data/precompute_flows.py. The path is given by "flow_path" of the
+    dataset; see flow_folder of PairedVideoDataset. Each flow is loaded as an
+    array with the shape of (H, W, 2) in float32.
+
+    Args:
+        mode (str): "recurrent" or "center". See get_flow_pairs.
+            Default: "recurrent".
+        key (str): Key of the flows in results. Default: "flows".
+    """
+
+    def __init__(self, mode="recurrent", key="flows"):
+        if mode not in FLOW_MODES:
+            raise ValueError(f'"mode" should be in "{FLOW_MODES}"; received "{mode}".')
+        self.mode = mode
+        self.key = key
+
+    def __call__(self, results):
+        if "flow_path" not in results:
+            raise KeyError(
+                '"flow_path" is not found; set "flow_folder" of the dataset.'
+            )
+        pairs = get_flow_pairs(results["lq_path"], self.mode)
+        with np.load(results["flow_path"]) as flows:
+            results[self.key] = [
+                flows[get_flow_name(*pair)].astype(np.float32) for pair in pairs
+            ]
+        return results
+
+    def __repr__(self):
+        return self.__class__.__name__ + f"(mode={self.mode}, key={self.key})"
+
+
+@PIPELINES.register_module()
+class LoadFramesFromLmdb:
+    """Load the frames of a sample from a video LMDB file.
+
+    Differences to LoadImageFromFileList with the "lmdb" backend:
+        All frames of a sample are fetched in one read transaction, and each
+            distinct frame is read and decoded once.
+        Frames are stored with the keys "{sequence key}/{frame name}", i.e.,
+            the paths relative to the LMDB file. See io_backend of
+            PairedVideoDataset and tools/data/prepare_video_lmdb.py.
+
+    The LMDB environment is opened in each process at the first call.
+
+    Args:
+        db_path (str): Path to the LMDB file.
+        key (str): Key of frames in results. Frame paths are given by
+            "{key}_path". Default: "gt".
+        flag (str): Loading flag for images. Default: "color".
+        channel_order (str): Order of channel. Default: "bgr".
+    """
+
+    def __init__(self, db_path, key="gt", flag="color", channel_order="bgr"):
+        self.db_path = db_path
+        self.key = key
+        self.flag = flag
+        self.channel_order = channel_order
+        self._env = None
+        self._pid = None
+
+    def get_env(self):
+        # Do not share the environment with forked dataloader workers
+        if self._env is None or self._pid != os.getpid():
+            import lmdb
+
+            self._env = lmdb.open(
+                self.db_path, readonly=True, lock=False, readahead=False, meminit=False
+            )
+            self._pid = os.getpid()
+        return self._env
+
+    def __call__(self, results):
+        filepaths = results[f"{self.key}_path"]
+        lmdb_keys = [
+            osp.relpath(filepath, self.db_path).replace(os.sep, "/")
+            for filepath in filepaths
+        ]
+
+        imgs = dict()
+        with self.get_env().begin(write=False) as txn:
+            for filepath, lmdb_key in zip(filepaths, lmdb_keys):
+                if lmdb_key in imgs:
+                    continue
+                img_bytes = txn.get(lmdb_key.encode())
+                if img_bytes is None:
+                    raise KeyError(f'Cannot find "{lmdb_key}" in "{self.db_path}".')
+                img = mmcv.imfrombytes(
+                    img_bytes, flag=self.flag, channel_order=self.channel_order
+                )
+                if img.ndim == 2:
+                    img = np.expand_dims(img, axis=2)
+                imgs[lmdb_key] = img
+
+        results[self.key] = [imgs[lmdb_key] for lmdb_key in lmdb_keys]
+        results[f"{self.key}_ori_shape"] = [img.shape for img in results[self.key]]
+        return results
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_env"] = None
+        state["_pid"] = None
+        return state
+
+    def __repr__(self):
+        return (
+            self.__class__.__name__
+            + f"(db_path={self.db_path}, key={self.key}, flag={self.flag},"
+            f" channel_order={self.channel_order})"
+        )
+
+
+@PIPELINES.register_module()
+class LoadImageFromShard:
+    """Load an image from an image shard without decoding or copying.
+
+    The image is a read-only view of the memory-mapped shard; see ImageShard.
+    Put PairedRandomCrop right after loading so that only the rows of the
+    patch are read, and before any in-place transformation. The image path is
+    given by "{key}_path", i.e., "{shard_path}/{name}"; see
+    PairedImageShardDataset.
+
+    Args:
+        shard_path (str): Path to the shard.
+        key (str): Key of the image in results. Default: "gt".
+        channel_order (str): Order of channel. Images are stored in BGR;
+            "rgb" reverses the channels as a view. Default: "bgr".
+    """
+
+    def __init__(self, shard_path, key="gt", channel_order="bgr"):
+        if channel_order not in ["bgr", "rgb"]:
+            raise ValueError(
+                f'"channel_order" should be "bgr" or "rgb"; received "{channel_order}".'
+            )
+        self.shard = ImageShard(shard_path)
+        self.key = key
+        self.channel_order = channel_order
+
+    def __call__(self, results):
+        name = osp.relpath(results[f"{self.key}_path"], self.shard.shard_path)
+        img = self.shard.get(name)
+        if self.channel_order == "rgb":
+            img = img[..., ::-1]
+        results[self.key] = img
+        results[f"{self.key}_ori_shape"] = img.shape
+        return results
+
+    def __repr__(self):
+        return (
+            self.__class__.__name__
+            + f"(shard_path={self.shard.shard_path}, key={self.key},"
+            f" channel_order={self.channel_order})"
+        )
+
+
+@PIPELINES.register_module()
+class PairedRandomCropWithFlow(PairedRandomCrop):
+    """Paired random crop with pre-computed flows.
+
+    Differences to PairedRandomCrop:
+        Crop flows at the same position. Flows can be at a lower resolution
+            than LQ, e.g., 1/4 for ProVQE; the position is then aligned to
+            the grid of flows.
+        LQ and GT should be lists of frames.
+
+    Args:
+        gt_patch_size (int): Cropped GT patch size.
+        flow_keys (list[str]): Keys of flows. Default: ["flows"].
+    """
+
+    def __init__(self, gt_patch_size, flow_keys=None):
+        super().__init__(gt_patch_size=gt_patch_size)
+        self.flow_keys = ["flows"] if flow_keys is None else flow_keys
+
+    def __call__(self, results):
+        scale = results["scale"]
+        lq_patch_size = self.gt_patch_size // scale
+
+        h_lq, w_lq = results["lq"][0].shape[:2]
+        h_gt, w_gt = results["gt"][0].shape[:2]
+        if h_gt != h_lq * scale or w_gt != w_lq * scale:
+            raise ValueError(
+                f"Scale mismatches. GT ({h_gt}, {w_gt}) is not {scale}x"
+                f" multiplication of LQ ({h_lq}, {w_lq})."
+            )
+        if h_lq < lq_patch_size or w_lq < lq_patch_size:
+            raise ValueError(
+                f"LQ ({h_lq}, {w_lq}) is smaller than patch size"
+                f" ({lq_patch_size}, {lq_patch_size})."
+            )
+
+        h_flow, w_flow = results[self.flow_keys[0]][0].shape[:2]
+        ratio = w_lq // w_flow
+        if lq_patch_size % ratio != 0:
+            raise ValueError(
+                f"The LQ patch size ({lq_patch_size}) should be divisible by"
+                f" the downsampling ratio of flows ({ratio})."
+            )
+        flow_patch_size = lq_patch_size // ratio
+
+        # randomly choose the top and left on the grid of flows
+        top_flow = np.random.randint(h_flow - flow_patch_size + 1)
+        left_flow = np.random.randint(w_flow - flow_patch_size + 1)
+        top, left = top_flow * ratio, left_flow * ratio
+        top_gt, left_gt = top * scale, left * scale
+
+        results["lq"] = [
+            v[top : top + lq_patch_size, left : left + lq_patch_size, ...]
+            for v in results["lq"]
+        ]
+        results["gt"] = [
+            v[
+                top_gt : top_gt + self.gt_patch_size,
+                left_gt : left_gt + self.gt_patch_size,
+                ...,
+            ]
+            for v in results["gt"]
+        ]
+        for key in self.flow_keys:
+            results[key] = [
+                v[
+                    top_flow : top_flow + flow_patch_size,
+                    left_flow : left_flow + flow_patch_size,
+                    ...,
+                ]
+                for v in results[key]
+            ]
+        return results
+
+    def __repr__(self):
+        return (
+            self.__class__.__name__
+            + f"(gt_patch_size={self.gt_patch_size}, flow_keys={self.flow_keys})"
+        )
+
+
+@PIPELINES.register_module()
+class FlipWithFlow(Flip):
+    """Flip with pre-computed flows.
+
+    Differences to Flip:
+        Flip flows together with the images, and negate the flipped
+            component of flows.
+
+    Args:
+        keys (list[str]): Keys of images to be flipped.
+        flip_ratio (float): Probability of flipping. Default: 0.5.
+        direction (str): "horizontal" or "vertical". Default: "horizontal".
+        flow_keys (list[str]): Keys of flows. Default: ["flows"].
+    """
+
+    def __init__(self, keys, flip_ratio=0.5, direction="horizontal", flow_keys=None):
+        super().__init__(keys=keys, flip_ratio=flip_ratio, direction=direction)
+        self.flow_keys = ["flows"] if flow_keys is None else flow_keys
+
+    def __call__(self, results):
+        results = super().__call__(results)
+        if results["flip"]:
+            for key in self.flow_keys:
+                results[key] = [flip_flow(v, self.direction) for v in results[key]]
+        return results
+
+
+@PIPELINES.register_module()
+class RandomTransposeHWWithFlow(RandomTransposeHW):
+    """Random transpose of H and W with pre-computed flows.
+
+    Differences to RandomTransposeHW:
+        Transpose flows together with the images, and swap the components of
+            flows.
+
+    Args:
+        keys (list[str]): Keys of images to be transposed.
+        transpose_ratio (float): Probability of transposing. Default: 0.5.
+        flow_keys (list[str]): Keys of flows. Default: ["flows"].
+    """
+
+    def __init__(self, keys, transpose_ratio=0.5, flow_keys=None):
+        super().__init__(keys=keys, transpose_ratio=transpose_ratio)
+        self.flow_keys = ["flows"] if flow_keys is None else flow_keys
+
+    def __call__(self, results):
+        results = super().__call__(results)
+        if results["transpose"]:
+            for key in self.flow_keys:
+                results[key] = [transpose_flow(v) for v in results[key]]
+        return results
@@ -1,3 +1,5 @@
 from mmedit.datasets import DATASETS as MMEDIT_DATASETS
+from mmedit.datasets import PIPELINES as MMEDIT_PIPELINES
 
 DATASETS = MMEDIT_DATASETS
+PIPELINES = MMEDIT_PIPELINES
@@ -0,0 +1,149 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import os.path as osp
+from array import array
+
+import numpy as np
+
+
+class SampleTable:
+    """Compact table of video samples.
+
+    A list of dicts keeps Python strings of all frame paths of all samples.
+    Since reference counting touches these objects, they are copied into
+    every dataloader worker. Instead, this table records:
+
+    - names: Deduplicated frame names.
+    - keys: Sequence keys.
+    - seq_frms, seq_offsets: Name indexes of the frames of each sequence.
+    - samp_seqs: Sequence index of each sample.
+    - lq_idxs, lq_offsets: Frame indexes (in the sequence) of the LQ frames of
+        each sample. Same for gt_idxs and gt_offsets.
+
+    All indexes are stored in NumPy arrays. The dict of a sample, i.e.,
+    gt_path, lq_path, key, and optionally key_frms and flow_path, is
+    materialized on indexing.
+
+    Samples are added by add_seq and add_sample. Call finalize afterwards.
+
+    Args:
+        gt_folder (str): GT folder.
+        lq_folder (str): LQ folder.
+        flow_folder (str | None): Folder of pre-computed flows. If given,
+            record "{flow_folder}/{key}.npz" as flow_path. Default: None.
+        key_frames (ndarray | None): Key-frame annotation of a sequence. If
+            given, record the annotation of the LQ frames as key_frms.
+            Default: None.
+    """
+
+    def __init__(self, gt_folder, lq_folder, flow_folder=None, key_frames=None):
+        self.gt_folder = gt_folder
+        self.lq_folder = lq_folder
+        self.flow_folder = flow_folder
+        self.key_frames = key_frames
+
+        self.names = []
+        self.keys = []
+        self._name_idxs = dict()
+
+        # Buffers for building; converted to NumPy arrays by finalize
+        self.seq_frms = array("i")
+        self.seq_offsets = array("q", [0])
+        self.samp_seqs = array("i")
+        self.lq_idxs = array("i")
+        self.lq_offsets = array("q", [0])
+        self.gt_idxs = array("i")
+        self.gt_offsets = array("q", [0])
+
+    def add_seq(self, key, names):
+        """Add a sequence.
+
+        Args:
+            key (str): Sequence key.
+            names (list[str]): Frame names of the sequence.
+
+        Returns:
+            int: Sequence index.
+        """
+        for name in names:
+            if name not in self._name_idxs:
+                self._name_idxs[name] = len(self.names)
+                self.names.append(name)
+            self.seq_frms.append(self._name_idxs[name])
+        self.seq_offsets.append(len(self.seq_frms))
+        self.keys.append(key)
+        return len(self.keys) - 1
+
+    def add_sample(self, seq_idx, lq_idxs, gt_idxs):
+        """Add a sample.
+
+        Args:
+            seq_idx (int): Sequence index returned by add_seq.
+            lq_idxs (list[int]): Frame indexes of the LQ frames.
+            gt_idxs (list[int]): Frame indexes of the GT frames.
+        """
+        self.samp_seqs.append(seq_idx)
+        self.lq_idxs.extend(lq_idxs)
+        self.lq_offsets.append(len(self.lq_idxs))
+        self.gt_idxs.extend(gt_idxs)
+        self.gt_offsets.append(len(self.gt_idxs))
+
+    def finalize(self):
+        """Convert the buffers to NumPy arrays."""
+        for attr in [
+            "seq_frms",
+            "seq_offsets",
+            "samp_seqs",
+            "lq_idxs",
+            "lq_offsets",
+            "gt_idxs",
+            "gt_offsets",
+        ]:
+            setattr(self, attr, np.array(getattr(self, attr)))
+        self._name_idxs = dict()
+        return self
+
+    def __len__(self):
+        return len(self.samp_seqs)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Sample index {idx} is out of range.")
+
+        seq_idx = self.samp_seqs[idx]
+        key = self.keys[seq_idx]
+        frms = self.seq_frms[self.seq_offsets[seq_idx] : self.seq_offsets[seq_idx + 1]]
+        lq_idxs = self.lq_idxs[self.lq_offsets[idx] : self.lq_offsets[idx + 1]]
+        gt_idxs = self.gt_idxs[self.gt_offsets[idx] : self.gt_offsets[idx + 1]]
+        lq_names = [self.names[frm] for frm in frms[lq_idxs]]
+        gt_names = [self.names[frm] for frm in frms[gt_idxs]]
+
+        data_info = dict(
+            gt_path=[osp.join(self.gt_folder, key, name) for name in gt_names],
+            lq_path=[osp.join(self.lq_folder, key, name) for name in lq_names],
+            key=key + os.sep + ",".join(gt_names),
+        )
+        if self.key_frames is not None:
+            data_info["key_frms"] = self.key_frames[lq_idxs].tolist()
+        if self.flow_folder is not None:
+            data_info["flow_path"] = osp.join(self.flow_folder, key + ".npz")
+        return data_info
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
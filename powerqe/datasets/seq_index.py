@@ -0,0 +1,181 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from mmedit.datasets.base_sr_dataset import IMG_EXTENSIONS
+
+INDEX_VERSION = 1
+
+
+def sort_frm_names(names):
+    """Sort frame names by the digits in them, e.g., im2.png before im10.png."""
+    return sorted(names, key=lambda x: int("".join(filter(str.isdigit, x))))
+
+
+def scan_seq(gt_seq, lq_seq):
+    """Scan the GT and LQ folders of a sequence.
+
+    Args:
+        gt_seq (str): GT folder of the sequence.
+        lq_seq (str): LQ folder of the sequence.
+
+    Returns:
+        list[str]: Sorted frame names shared by GT and LQ.
+    """
+    gt_names = [
+        entry.name
+        for entry in os.scandir(gt_seq)
+        if entry.name.endswith(IMG_EXTENSIONS) and entry.is_file()
+    ]
+    assert len(gt_names) > 0, f'No images were found in "{gt_seq}".'
+    lq_names = set(
+        entry.name
+        for entry in os.scandir(lq_seq)
+        if entry.name.endswith(IMG_EXTENSIONS) and entry.is_file()
+    )
+    assert len(gt_names) == len(lq_names), (
+        f'The GT and LQ sequences "{gt_seq}" and "{lq_seq}" should have'
+        " the same number of images;"
+        f" GT has {len(gt_names)} images while"
+        f" LQ has {len(lq_names)} images."
+    )
+    missing = set(gt_names) - lq_names
+    assert not missing, f'Cannot find "{osp.join(lq_seq, missing.pop())}".'
+    return sort_frm_names(gt_names)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_seq_index(gt_folder, lq_folder, keys, ann_file="", cache_dir=None, nworkers=8):
+    """Load the frame names of sequences with a persistent cache.
+
+    Sequences are scanned by a thread pool. With cache_dir, the result is
+    saved to a file keyed by the folders and the annotation file. It is
+    reused as long as the mtimes of the annotation file (or the GT folder
+    without annotation) and all sequence folders are unchanged, i.e., no
+    frame is added, removed or renamed. Dataset parameters such as samp_len
+    do not affect the scan; samples are made from the names.
+
+    Args:
+        gt_folder (str): GT folder.
+        lq_folder (str): LQ folder.
+        keys (list[str]): Sequence keys, i.e., paths relative to the folders.
+        ann_file (str): Annotation file. Default: "".
+        cache_dir (str | None): Folder of the cache files. None to disable
+            the cache. Default: None.
+        nworkers (int): Number of threads for scanning and validation.
+            Default: 8.
+
+    Returns:
+        dict: Sorted frame names of each sequence key.
+    """
+    gt_seqs = [osp.join(gt_folder, key) for key in keys]
+    lq_seqs = [osp.join(lq_folder, key) for key in keys]
+
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        if cache_dir is None:
+            return dict(zip(keys, executor.map(scan_seq, gt_seqs, lq_seqs)))
+
+        # Stamps to validate the cache
+        stamps = dict(
+            ann=_stamp(ann_file if ann_file else gt_folder),
+            gt=list(executor.map(lambda x: os.stat(x).st_mtime_ns, gt_seqs)),
+            lq=list(executor.map(lambda x: os.stat(x).st_mtime_ns, lq_seqs)),
+        )
+
+        cache_key = json.dumps(
+            [
+                INDEX_VERSION,
+                osp.abspath(gt_folder),
+                osp.abspath(lq_folder),
+                osp.abspath(ann_file) if ann_file else "",
+            ]
+        )
+        cache_path = osp.join(
+            cache_dir, hashlib.sha1(cache_key.encode()).hexdigest() + ".pkl"
+        )
+        if osp.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                cache = pickle.load(f)
+            if cache["keys"] == keys and cache["stamps"] == stamps:
+                return cache["seqs"]
+
+        seqs = dict(zip(keys, executor.map(scan_seq, gt_seqs, lq_seqs)))
+
+    # Write to a temporary file first; other processes may read the cache
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=cache_dir)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(dict(keys=keys, stamps=stamps, seqs=seqs), f)
+    os.replace(tmp_path, cache_path)
+    return seqs
+
+
+def read_lmdb_meta(lmdb_path):
+    """Read the sequences recorded in a video LMDB file.
+
+    Each line of "{lmdb_path}/meta_info.txt" records a sequence key and the
+    sorted frame names, separated by a white space, e.g.,
+    `001/0001 im1.png,im2.png,im3.png`. Frames are stored with the keys
+    "{sequence key}/{frame name}". See tools/data/prepare_video_lmdb.py.
+
+    Args:
+        lmdb_path (str): Path to the LMDB file.
+
+    Returns:
+        dict: Sorted frame names of each sequence key.
+    """
+    seqs = dict()
+    with open(osp.join(lmdb_path, "meta_info.txt"), "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            key, names = line.rsplit(" ", 1)
+            seqs[key.replace("/", os.sep)] = names.split(",")
+    return seqs
+
+
+def load_lmdb_seq_index(gt_folder, lq_folder, keys):
+    """Load the frame names of sequences from GT and LQ LMDB files.
+
+    Args:
+        gt_folder (str): GT LMDB file.
+        lq_folder (str): LQ LMDB file.
+        keys (list[str]): Sequence keys.
+
+    Returns:
+        dict: Sorted frame names of each sequence key.
+    """
+    gt_seqs = read_lmdb_meta(gt_folder)
+    lq_seqs = read_lmdb_meta(lq_folder)
+
+    seqs = dict()
+    for key in keys:
+        assert key in gt_seqs, f'Cannot find "{key}" in "{gt_folder}".'
+        assert key in lq_seqs, f'Cannot find "{key}" in "{lq_folder}".'
+        missing = set(gt_seqs[key]) - set(lq_seqs[key])
+        assert not missing, f'Cannot find "{key}/{missing.pop()}" in "{lq_folder}".'
+        seqs[key] = gt_seqs[key]
+    return seqs
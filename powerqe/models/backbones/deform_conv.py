@@ -0,0 +1,253 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as nn_func
+from mmedit.models.backbones.sr_backbones.basicvsr_pp import (
+    SecondOrderDeformableAlignment,
+)
+from mmedit.models.backbones.sr_backbones.edvr_net import ModulatedDCNPack
+from torch.nn.modules.utils import _pair
+
+DEFORM_BACKENDS = ["mmcv", "torch"]
+
+
+def modulated_deform_conv2d(
+    x,
+    offset,
+    mask,
+    weight,
+    bias=None,
+    stride=1,
+    padding=0,
+    dilation=1,
+    groups=1,
+    deform_groups=1,
+):
+    """Modulated deformable convolution (DCNv2) in pure PyTorch.
+
+    Same as mmcv.ops.modulated_deform_conv2d. All kernel points of all
+    deformable groups are sampled by one grid_sample; the sampled columns are
+    then multiplied with the weight by one matmul. Thus, it runs on any device
+    supported by PyTorch.
+
+    Args:
+        x (Tensor): Input with the shape of (N, C, H, W).
+        offset (Tensor): Offsets with the shape of (N, G*2*KH*KW, H', W').
+            G is deform_groups. (dy, dx) are interleaved for each kernel
+            point as mmcv.
+        mask (Tensor): Modulation scalars with the shape of
+            (N, G*KH*KW, H', W').
+        weight (Tensor): Weight with the shape of (C', C/groups, KH, KW).
+        bias (Tensor | None): Bias with the shape of (C',). Default: None.
+        stride (int | tuple[int]): Default: 1.
+        padding (int | tuple[int]): Default: 0.
+        dilation (int | tuple[int]): Default: 1.
+        groups (int): Groups of the convolution. Default: 1.
+        deform_groups (int): Groups of offsets and masks. Default: 1.
+
+    Returns:
+        Tensor: Output with the shape of (N, C', H', W').
+    """
+    stride_h, stride_w = _pair(stride)
+    pad_h, pad_w = _pair(padding)
+    dil_h, dil_w = _pair(dilation)
+    n, c, h, w = x.shape
+    c_out, _, kh, kw = weight.shape
+    _, _, h_out, w_out = offset.shape
+    nks = kh * kw
+
+    # sampling positions: (kernel point, H', W')
+    base_h = torch.arange(h_out, device=x.device, dtype=x.dtype) * stride_h - pad_h
+    base_w = torch.arange(w_out, device=x.device, dtype=x.dtype) * stride_w - pad_w
+    ker_h = torch.arange(kh, device=x.device, dtype=x.dtype) * dil_h
+    ker_w = torch.arange(kw, device=x.device, dtype=x.dtype) * dil_w
+    ker_h, ker_w = torch.meshgrid(ker_h, ker_w, indexing="ij")
+    pos_h = ker_h.reshape(nks, 1, 1) + base_h.view(1, h_out, 1)
+    pos_w = ker_w.reshape(nks, 1, 1) + base_w.view(1, 1, w_out)
+
+    offset = offset.view(n, deform_groups, nks, 2, h_out, w_out)
+    pos_h = pos_h + offset[:, :, :, 0]  # (N, G, KH*KW, H', W')
+    pos_w = pos_w + offset[:, :, :, 1]
+
+    # normalize pixel centers for grid_sample with align_corners=False, which
+    # also holds for H or W being 1; corners outside the input are zeros, same
+    # as the bilinear interpolation of mmcv
+    grid_w = (2 * pos_w + 1) / w - 1
+    grid_h = (2 * pos_h + 1) / h - 1
+    grid = torch.stack([grid_w, grid_h], dim=-1).view(
+        n * deform_groups, nks * h_out, w_out, 2
+    )
+    cols = nn_func.grid_sample(
+        x.view(n * deform_groups, c // deform_groups, h, w),
+        grid,
+        mode="bilinear",
+        padding_mode="zeros",
+        align_corners=False,
+    )  # (N*G, C/G, KH*KW*H', W')
+    cols = cols.view(n, deform_groups, c // deform_groups, nks, h_out, w_out)
+    cols = cols * mask.view(n, deform_groups, 1, nks, h_out, w_out)
+
+    # (N, C, KH*KW, H'*W') -> (N, groups, C/groups*KH*KW, H'*W')
+    cols = cols.view(n, groups, c // groups * nks, h_out * w_out)
+    out = torch.matmul(weight.view(groups, c_out // groups, -1), cols)
+    out = out.view(n, c_out, h_out, w_out)
+    if bias is not None:
+        out = out + bias.view(1, -1, 1, 1)
+    return out
+
+
+class TorchModulatedDeformConv2d(nn.Module):
+    """Modulated deformable convolution in pure PyTorch.
+
+    Same arguments and parameters as mmcv.ops.ModulatedDeformConv2d, so that
+    the weights are interchangeable. See modulated_deform_conv2d.
+    """
+
+    def __init__(
+        self,
+        in_channels,
+        out_channels,
+        kernel_size,
+        stride=1,
+        padding=0,
+        dilation=1,
+        groups=1,
+        deform_groups=1,
+        bias=True,
+    ):
+        super().__init__()
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.kernel_size = _pair(kernel_size)
+        self.stride = _pair(stride)
+        self.padding = _pair(padding)
+        self.dilation = _pair(dilation)
+        self.groups = groups
+        self.deform_groups = deform_groups
+
+        self.weight = nn.Parameter(
+            torch.Tensor(out_channels, in_channels // groups, *self.kernel_size)
+        )
+        if bias:
+            self.bias = nn.Parameter(torch.Tensor(out_channels))
+        else:
+            self.register_parameter("bias", None)
+        self.init_weights()
+
+    def init_weights(self):
+        n = self.in_channels
+        for k in self.kernel_size:
+            n *= k
+        stdv = 1.0 / math.sqrt(n)
+        self.weight.data.uniform_(-stdv, stdv)
+        if self.bias is not None:
+            self.bias.data.zero_()
+
+    def forward(self, x, offset, mask):
+        return modulated_deform_conv2d(
+            x,
+            offset,
+            mask,
+            self.weight,
+            self.bias,
+            self.stride,
+            self.padding,
+            self.dilation,
+            self.groups,
+            self.deform_groups,
+        )
+
+
+class TorchModulatedDCNPack(ModulatedDCNPack):
+    """ModulatedDCNPack of EDVR with the PyTorch backend."""
+
+    def forward(self, x, extra_feat):
+        out = self.conv_offset(extra_feat)
+        o1, o2, mask = torch.chunk(out, 3, dim=1)
+        offset = torch.cat((o1, o2), dim=1)
+        mask = torch.sigmoid(mask)
+        return modulated_deform_conv2d(
+            x,
+            offset,
+            mask,
+            self.weight,
+            self.bias,
+            self.stride,
+            self.padding,
+            self.dilation,
+            self.groups,
+            self.deform_groups,
+        )
+
+
+class TorchSecondOrderDeformableAlignment(SecondOrderDeformableAlignment):
+    """SecondOrderDeformableAlignment of BasicVSR++ with the PyTorch backend."""
+
+    def forward(self, x, extra_feat, flow_1, flow_2):
+        extra_feat = torch.cat([extra_feat, flow_1, flow_2], dim=1)
+        out = self.conv_offset(extra_feat)
+        o1, o2, mask = torch.chunk(out, 3, dim=1)
+
+        # offset
+        offset = self.max_residue_magnitude * torch.tanh(torch.cat((o1, o2), dim=1))
+        offset_1, offset_2 = torch.chunk(offset, 2, dim=1)
+        offset_1 = offset_1 + flow_1.flip(1).repeat(1, offset_1.size(1) // 2, 1, 1)
+        offset_2 = offset_2 + flow_2.flip(1).repeat(1, offset_2.size(1) // 2, 1, 1)
+        offset = torch.cat([offset_1, offset_2], dim=1)
+
+        # mask
+        mask = torch.sigmoid(mask)
+
+        return modulated_deform_conv2d(
+            x,
+            offset,
+            mask,
+            self.weight,
+            self.bias,
+            self.stride,
+            self.padding,
+            self.dilation,
+            self.groups,
+            self.deform_groups,
+        )
+
+
+def set_deform_backend(module, backend):
+    """Set the backend of deformable convolutions in a module.
+
+    Deformable alignment modules of EDVR and BasicVSR++ from MMEditing are
+    switched in place between the mmcv op and the PyTorch implementation.
+    Parameters are kept, so that checkpoints are interchangeable.
+
+    Args:
+        module (nn.Module): Module, e.g., EDVRNetQE and ProVQE.
+        backend (str): "mmcv" or "torch".
+    """
+    if backend not in DEFORM_BACKENDS:
+        raise ValueError(
+            f'"backend" should be in "{DEFORM_BACKENDS}"; received "{backend}".'
+        )
+
+    classes = [
+        (ModulatedDCNPack, TorchModulatedDCNPack),
+        (SecondOrderDeformableAlignment, TorchSecondOrderDeformableAlignment),
+    ]
+    for submodule in module.modules():
+        for cls_mmcv, cls_torch in classes:
+            if type(submodule) in [cls_mmcv, cls_torch]:
+                submodule.__class__ = cls_torch if backend == "torch" else cls_mmcv
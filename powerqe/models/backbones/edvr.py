@@ -19,6 +19,7 @@ import torch.nn as nn
 from mmedit.models.backbones import EDVRNet
 
 from ..registry import BACKBONES
+from .deform_conv import set_deform_backend
 
 
 @BACKBONES.register_module()
@@ -39,6 +40,9 @@ class EDVRNetQE(EDVRNet):
         center_frame_idx (int): The index of center frame.
             Frame counting from 0.
         with_tsa (bool): Whether to use TSA module.
+        deform_backend (str): Backend of deformable convolutions. "mmcv" or
+            "torch". The latter runs on any device. See deform_conv.
+            Default: "mmcv".
     """
 
     def __init__(
@@ -51,6 +55,7 @@ class EDVRNetQE(EDVRNet):
         num_blocks_reconstruction=10,
         center_frame_idx=2,
         with_tsa=True,
+        deform_backend="mmcv",
     ):
         super().__init__(
             in_channels=io_channels,
@@ -73,42 +78,84 @@ class EDVRNetQE(EDVRNet):
         delattr(self, "upsample2")
         delattr(self, "img_upsample")
 
-    def forward(self, x):
-        n, t, c, h, w = x.size()
+        set_deform_backend(self, deform_backend)
+
+    def extract_frm_feat(self, x):
+        """Extract the feature pyramid of one frame.
+
+        Used for streaming inference, where each frame is processed only once
+        and shared by all windows. See forward_frm_feats.
+
+        Args:
+            x (Tensor): Input frame with the shape of (N, C, H, W).
+
+        Returns:
+            list[Tensor]: Input frame and L1, L2 and L3 features.
+        """
+        h, w = x.shape[2:]
         if h % 4 != 0 or w % 4 != 0:
             raise ValueError(f"Height ({h}) and width ({w}) should be divisible by 4.")
 
-        x_center = x[:, self.center_frame_idx, :, :, :].contiguous()
-
-        # extract LR features
-        # L1
-        l1_feat = self.lrelu(self.conv_first(x.view(-1, c, h, w)))
+        l1_feat = self.lrelu(self.conv_first(x))
         l1_feat = self.feature_extraction(l1_feat)
-        # L2
         l2_feat = self.feat_l2_conv2(self.feat_l2_conv1(l1_feat))
-        # L3
         l3_feat = self.feat_l3_conv2(self.feat_l3_conv1(l2_feat))
-
-        l1_feat = l1_feat.view(n, t, -1, h, w)
-        l2_feat = l2_feat.view(n, t, -1, h // 2, w // 2)
-        l3_feat = l3_feat.view(n, t, -1, h // 4, w // 4)
-
-        # pcd alignment
-        ref_feats = [  # reference feature list
-            l1_feat[:, self.center_frame_idx, :, :, :].clone(),
-            l2_feat[:, self.center_frame_idx, :, :, :].clone(),
-            l3_feat[:, self.center_frame_idx, :, :, :].clone(),
+        return [x, l1_feat, l2_feat, l3_feat]
+
+    def forward_frm_feats(self, frm_feats):
+        """Forward function with per-frame features.
+
+        Args:
+            frm_feats (list[list[Tensor]]): Per-frame features of a window.
+                See extract_frm_feat.
+
+        Returns:
+            Tensor: Output center frame with the shape of (N, C, H, W).
+        """
+        feats = [
+            torch.stack([feats[idx_level] for feats in frm_feats], dim=1)
+            for idx_level in range(1, 4)
+        ]  # L1, L2 and L3 features with the shape of (n, t, c, h, w)
+        aligned_feat = self.align_feats(feats)
+        return self.reconstruct(aligned_feat, frm_feats[self.center_frame_idx][0])
+
+    def align_feats(self, feats):
+        """Align all frames to the center frame with one PCD alignment.
+
+        The temporal dimension is folded into the batch dimension, and each
+        frame is aligned to the center frame broadcast along the time axis.
+
+        Args:
+            feats (list[Tensor]): L1, L2 and L3 features with the shape of
+                (N, T, C', H', W').
+
+        Returns:
+            Tensor: Aligned features with the shape of (N, T, C', H, W).
+        """
+        n, t = feats[0].shape[:2]
+        neighbor_feats = [feat.flatten(0, 1) for feat in feats]
+        ref_feats = [
+            feat[:, self.center_frame_idx : self.center_frame_idx + 1]
+            .expand_as(feat)
+            .flatten(0, 1)
+            for feat in feats
         ]
-        aligned_feat = []
-        for i in range(t):
-            neighbor_feats = [
-                l1_feat[:, i, :, :, :].clone(),
-                l2_feat[:, i, :, :, :].clone(),
-                l3_feat[:, i, :, :, :].clone(),
-            ]
-            aligned_feat.append(self.pcd_alignment(neighbor_feats, ref_feats))
-        aligned_feat = torch.stack(aligned_feat, dim=1)  # (n, t, c, h, w)
-
+        aligned_feat = self.pcd_alignment(neighbor_feats, ref_feats)
+        return aligned_feat.view(n, t, *aligned_feat.shape[1:])
+
+    def reconstruct(self, aligned_feat, x_center):
+        """Fuse the aligned features and reconstruct the center frame.
+
+        Args:
+            aligned_feat (Tensor): Aligned features with the shape of
+                (N, T, C', H, W).
+            x_center (Tensor): Input center frame with the shape of
+                (N, C, H, W).
+
+        Returns:
+            Tensor: Output center frame with the shape of (N, C, H, W).
+        """
+        n, _, _, h, w = aligned_feat.size()
         if self.with_tsa:
             feat = self.fusion(aligned_feat)
         else:
@@ -125,3 +172,27 @@ class EDVRNetQE(EDVRNet):
         # out += base
         out += x_center
         return out
+
+    def forward(self, x):
+        n, t, c, h, w = x.size()
+        if h % 4 != 0 or w % 4 != 0:
+            raise ValueError(f"Height ({h}) and width ({w}) should be divisible by 4.")
+
+        x_center = x[:, self.center_frame_idx, :, :, :].contiguous()
+
+        # extract LR features
+        # L1
+        l1_feat = self.lrelu(self.conv_first(x.view(-1, c, h, w)))
+        l1_feat = self.feature_extraction(l1_feat)
+        # L2
+        l2_feat = self.feat_l2_conv2(self.feat_l2_conv1(l1_feat))
+        # L3
+        l3_feat = self.feat_l3_conv2(self.feat_l3_conv1(l2_feat))
+
+        l1_feat = l1_feat.view(n, t, -1, h, w)
+        l2_feat = l2_feat.view(n, t, -1, h // 2, w // 2)
+        l3_feat = l3_feat.view(n, t, -1, h // 4, w // 4)
+
+        # pcd alignment
+        aligned_feat = self.align_feats([l1_feat, l2_feat, l3_feat])
+        return self.reconstruct(aligned_feat, x_center)
@@ -17,10 +17,37 @@ import torch.nn as nn
 from mmedit.models.backbones.sr_backbones.basicvsr_net import SPyNet
 from mmedit.models.common import flow_warp
 
+from ...utils.flow import check_flow_scale, estimate_flow
+from ...utils.streaming import TensorLRUCache
 from ..registry import BACKBONES
 from .base import BaseNet
 
 
+def fuse_feat_convs(state_dict, prefix=""):
+    """Convert MFQEv2 weights for the fused feature extraction.
+
+    For each kernel size, the three convolutions for the left PQF, the center
+    frame and the right PQF are stacked into one grouped convolution. See
+    MFQEv2.
+
+    Args:
+        state_dict (dict): State dict of MFQEv2. Modified in place.
+        prefix (str): Prefix of MFQEv2 keys, e.g., "generator.". Default: "".
+
+    Returns:
+        dict: Converted state dict.
+    """
+    for idx_ks, ks in enumerate([3, 5, 7]):
+        for param in ["weight", "bias"]:
+            keys = [f"{prefix}ks{ks}_conv_list.{idx}.{param}" for idx in range(3)]
+            if not all(key in state_dict for key in keys):
+                continue
+            state_dict[f"{prefix}feat_conv_list.{idx_ks}.{param}"] = torch.cat(
+                [state_dict.pop(key) for key in keys], dim=0
+            )
+    return state_dict
+
+
 @BACKBONES.register_module()
 class MFQEv2(BaseNet):
     """MFQEv2 network structure.
@@ -33,48 +60,91 @@ class MFQEv2(BaseNet):
     Args:
         io_channels (int): Number of I/O channels.
         nf (int): Channel number of intermediate features.
+        spynet_pretrained (str): Path for pretrained SPyNet. Default: None.
+        flow_cache_size (float): Memory cap (MiB) of the flow cache for
+            sequence inference. Flows are cached by frame keys and the
+            resolution. See get_flows. 0 disables the cache. Default: 0.
+        fused (bool): Whether to fuse the feature extraction. For each kernel
+            size, the three frames are packed into channels and processed by
+            one grouped convolution, i.e., 3 convolutions instead of 9 with
+            the same FLOPs. Checkpoints of the unfused model are converted
+            when loaded; see fuse_feat_convs. Default: False.
+        flow_scale (float): Scale of the resolution for SPyNet. 1, 0.5 or
+            0.25. Flows are upsampled to the input resolution. See
+            estimate_flow. Default: 1.
     """
 
-    def __init__(self, io_channels=3, nf=32, spynet_pretrained=None):
+    def __init__(
+        self,
+        io_channels=3,
+        nf=32,
+        spynet_pretrained=None,
+        flow_cache_size=0,
+        fused=False,
+        flow_scale=1,
+    ):
         super().__init__()
 
+        self.fused = fused
+        check_flow_scale(flow_scale)
+        self.flow_scale = flow_scale
+
         # for frame alignment
         self.spynet = SPyNet(pretrained=spynet_pretrained)
-
-        self.ks3_conv_list = nn.ModuleList(
-            [
-                nn.Conv2d(
-                    in_channels=io_channels,
-                    out_channels=nf,
-                    kernel_size=3,
-                    padding=3 // 2,
-                )
-                for _ in range(3)
-            ]
-        )
-        self.ks5_conv_list = nn.ModuleList(
-            [
-                nn.Conv2d(
-                    in_channels=io_channels,
-                    out_channels=nf,
-                    kernel_size=5,
-                    padding=5 // 2,
-                )
-                for _ in range(3)
-            ]
-        )
-        self.ks7_conv_list = nn.ModuleList(
-            [
-                nn.Conv2d(
-                    in_channels=io_channels,
-                    out_channels=nf,
-                    kernel_size=7,
-                    padding=7 // 2,
-                )
-                for _ in range(3)
-            ]
+        self.flow_cache = (
+            TensorLRUCache(int(flow_cache_size * 1024**2))
+            if flow_cache_size > 0
+            else None
         )
 
+        if fused:
+            self.feat_conv_list = nn.ModuleList(
+                [
+                    nn.Conv2d(
+                        in_channels=3 * io_channels,
+                        out_channels=3 * nf,
+                        kernel_size=ks,
+                        padding=ks // 2,
+                        groups=3,
+                    )
+                    for ks in [3, 5, 7]
+                ]
+            )
+        else:
+            self.ks3_conv_list = nn.ModuleList(
+                [
+                    nn.Conv2d(
+                        in_channels=io_channels,
+                        out_channels=nf,
+                        kernel_size=3,
+                        padding=3 // 2,
+                    )
+                    for _ in range(3)
+                ]
+            )
+            self.ks5_conv_list = nn.ModuleList(
+                [
+                    nn.Conv2d(
+                        in_channels=io_channels,
+                        out_channels=nf,
+                        kernel_size=5,
+                        padding=5 // 2,
+                    )
+                    for _ in range(3)
+                ]
+            )
+            self.ks7_conv_list = nn.ModuleList(
+                [
+                    nn.Conv2d(
+                        in_channels=io_channels,
+                        out_channels=nf,
+                        kernel_size=7,
+                        padding=7 // 2,
+                    )
+                    for _ in range(3)
+                ]
+            )
+
         self.rec_conv = nn.ModuleList(
             [
                 nn.Sequential(
@@ -133,39 +203,134 @@ class MFQEv2(BaseNet):
             ]
         )
 
-    def align_frm(self, inp_frm, ref_frm):
-        flow = self.spynet(ref_frm, inp_frm)  # n 2 h w
+    def align_frm(self, inp_frm, ref_frm, flow=None):
+        if flow is None:
+            flow = estimate_flow(
+                self.spynet, ref_frm, inp_frm, self.flow_scale
+            )  # n 2 h w
         aligned_frm = flow_warp(inp_frm, flow.permute(0, 2, 3, 1))  # n h w 2
         return aligned_frm
 
-    def forward(self, x):
-        """Forward function.
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        if self.fused:
+            fuse_feat_convs(state_dict, prefix=prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def train(self, mode=True):
+        # cached flows are outdated once SPyNet is trained
+        if mode and (self.flow_cache is not None):
+            self.flow_cache.clear()
+        return super().train(mode)
+
+    def get_flows(self, x, frm_keys=None):
+        """Compute optical flows from the center frame to the PQFs.
+
+        Flows of both PQFs are computed by one SPyNet forward.
+
+        In evaluation mode with the flow cache, flows are cached by
+        (center-frame key, PQF key, H, W, flow scale). Overlapping windows of a sequence
+        then share the flows between the same frames.
 
         Args:
             x (Tensor): Input tensor with the shape of (N, T=3, C, H, W).
+            frm_keys (list[list]): Keys of the frames of each sample, e.g.,
+                LQ paths. Default: None.
+
+        Returns:
+            Tensor: Flow of the left PQF with the shape of (N, 2, H, W).
+            Tensor: Flow of the right PQF with the shape of (N, 2, H, W).
+        """
+        n, _, _, h, w = x.shape
+        ref_frms = torch.cat([x[:, 1, ...], x[:, 1, ...]], dim=0)
+        inp_frms = torch.cat([x[:, 0, ...], x[:, 2, ...]], dim=0)
+
+        if (self.flow_cache is None) or self.training or (frm_keys is None):
+            flows = estimate_flow(self.spynet, ref_frms, inp_frms, self.flow_scale)
+            return flows[:n], flows[n:]
+
+        keys = [(kfs[1], kfs[0], h, w, self.flow_scale) for kfs in frm_keys] + [
+            (kfs[1], kfs[2], h, w, self.flow_scale) for kfs in frm_keys
+        ]
+        flows = [self.flow_cache.get(key) for key in keys]
+        idxs_miss = dict()  # key -> the first index; duplicated keys computed once
+        for idx, flow in enumerate(flows):
+            if flow is None:
+                idxs_miss.setdefault(keys[idx], idx)
+        if idxs_miss:
+            flows_miss = estimate_flow(
+                self.spynet,
+                ref_frms[list(idxs_miss.values())],
+                inp_frms[list(idxs_miss.values())],
+                self.flow_scale,
+            )
+            flows_miss = dict(zip(idxs_miss, flows_miss))
+            for key, flow in flows_miss.items():
+                self.flow_cache.put(key, flow)
+            flows = [
+                flows_miss[key] if flow is None else flow
+                for key, flow in zip(keys, flows)
+            ]
+        flows = torch.stack(flows, dim=0)
+        return flows[:n], flows[n:]
+
+    def extract_frm_feat(self, x):
+        """Per-frame work for streaming inference.
+
+        Features of the PQFs depend on the alignment to the center frame, so
+        only the frame itself is shared by all windows. See forward_frm_feats.
+
+        Args:
+            x (Tensor): Input frame with the shape of (N, C, H, W).
+
+        Returns:
+            Tensor: Input frame.
+        """
+        return x
+
+    def forward_frm_feats(self, frm_feats, frm_keys=None):
+        """Forward function with per-frame features.
+
+        Args:
+            frm_feats (list[Tensor]): Per-frame features of a window.
+                See extract_frm_feat.
+            frm_keys (list[list]): Keys of the frames of each sample for the
+                flow cache. See get_flows. Default: None.
 
         Returns:
             Tensor: Output center frame with the shape of (N, C, H, W).
         """
-        # alignment
-        center_frm = x[:, 1, ...]  # n c=3 h w
-        aligned_left_pqf = self.align_frm(inp_frm=x[:, 0, ...], ref_frm=center_frm)
-        aligned_right_pqf = self.align_frm(inp_frm=x[:, 2, ...], ref_frm=center_frm)
+        return self.forward(torch.stack(frm_feats, dim=1), frm_keys=frm_keys)
 
-        # feature extraction
-        ks3_feat_left_pqf = self.ks3_conv_list[0](aligned_left_pqf)
+    def extract_feats(self, left_pqf, center_frm, right_pqf):
+        """Extract multi-scale features of the aligned frames.
+
+        Args:
+            left_pqf (Tensor): Aligned left PQF with the shape of (N, C, H, W).
+            center_frm (Tensor): Center frame with the shape of (N, C, H, W).
+            right_pqf (Tensor): Aligned right PQF with the shape of
+                (N, C, H, W).
+
+        Returns:
+            Tensor: Features with the shape of (N, 9*nf, H, W). Features are
+                ordered by (kernel size, frame).
+        """
+        if self.fused:
+            frms = torch.cat((left_pqf, center_frm, right_pqf), dim=1)  # n c=3* h w
+            return torch.cat([conv(frms) for conv in self.feat_conv_list], dim=1)
+
+        ks3_feat_left_pqf = self.ks3_conv_list[0](left_pqf)
         ks3_feat_center_frm = self.ks3_conv_list[1](center_frm)
-        ks3_feat_right_pqf = self.ks3_conv_list[2](aligned_right_pqf)
+        ks3_feat_right_pqf = self.ks3_conv_list[2](right_pqf)
 
-        ks5_feat_left_pqf = self.ks5_conv_list[0](aligned_left_pqf)
+        ks5_feat_left_pqf = self.ks5_conv_list[0](left_pqf)
         ks5_feat_center_frm = self.ks5_conv_list[1](center_frm)
-        ks5_feat_right_pqf = self.ks5_conv_list[2](aligned_right_pqf)
+        ks5_feat_right_pqf = self.ks5_conv_list[2](right_pqf)
 
-        ks7_feat_left_pqf = self.ks7_conv_list[0](aligned_left_pqf)
+        ks7_feat_left_pqf = self.ks7_conv_list[0](left_pqf)
         ks7_feat_center_frm = self.ks7_conv_list[1](center_frm)
-        ks7_feat_right_pqf = self.ks7_conv_list[2](aligned_right_pqf)
+        ks7_feat_right_pqf = self.ks7_conv_list[2](right_pqf)
 
-        feat_ = torch.cat(
+        return torch.cat(
             (
                 ks3_feat_left_pqf,
                 ks3_feat_center_frm,
@@ -180,6 +345,39 @@ class MFQEv2(BaseNet):
             dim=1,
         )  # n c=9* h w
 
+    def forward(self, x, flows=None, frm_keys=None):
+        """Forward function.
+
+        Args:
+            x (Tensor): Input tensor with the shape of (N, T=3, C, H, W).
+            flows (tuple[Tensor] | Tensor): Pre-computed flows of the left
+                and right PQFs. See get_flows. A tensor with the shape of
+                (N, 2, 2, H, W) is split into the two, e.g., loaded by
+                LoadFlowFromFile. Default: None.
+            frm_keys (list[list]): Keys of the frames of each sample for the
+                flow cache. See get_flows. Default: None.
+
+        Returns:
+            Tensor: Output center frame with the shape of (N, C, H, W).
+        """
+        if flows is None:
+            flows = self.get_flows(x, frm_keys=frm_keys)
+        elif torch.is_tensor(flows):
+            flows = flows.unbind(1)
+        flow_left, flow_right = flows
+
+        # alignment
+        center_frm = x[:, 1, ...]  # n c=3 h w
+        aligned_left_pqf = self.align_frm(
+            inp_frm=x[:, 0, ...], ref_frm=center_frm, flow=flow_left
+        )
+        aligned_right_pqf = self.align_frm(
+            inp_frm=x[:, 2, ...], ref_frm=center_frm, flow=flow_right
+        )
+
+        # feature extraction
+        feat_ = self.extract_feats(aligned_left_pqf, center_frm, aligned_right_pqf)
+
         # image reconstruction
         out_list = list()
         out_list.append(self.rec_conv[0](feat_))  # c10 in the paper
@@ -16,7 +16,11 @@ import torch
 import torch.nn.functional as nn_func
 from mmedit.models.backbones import BasicVSRPlusPlus
 from mmedit.models.common import flow_warp
+
+from ...utils.feature_store import FeatureList, FeatureStore
+from ...utils.flow import check_flow_scale, resize_flow
 from ..registry import BACKBONES
+from .deform_conv import set_deform_backend
 
 
 @BACKBONES.register_module()
@@ -24,8 +28,29 @@ class ProVQE(BasicVSRPlusPlus):
     """ProVQE network structure.
 
     Support either x4 upsampling or same size output.
+
+    Args:
+        deform_backend (str): Backend of deformable convolutions. "mmcv" or
+            "torch". The latter runs on any device. See deform_conv.
+            Default: "mmcv".
+        feat_store (dict | None): Config of the feature store for per-frame
+            features, e.g., dict(backend="mmap"). See FeatureStore. It
+            replaces the CPU cache for long sequences, and bounds the host
+            memory. None for lists of features. Default: None.
+        flow_scale (float): Scale of the resolution for SPyNet relative to
+            the resolution of flows, i.e., 1/4 of the input unless the input
+            is low-res. 1, 0.5 or 0.25. See compute_flow. Default: 1.
+        kwargs (dict): Arguments of BasicVSRPlusPlus.
     """
 
+    def __init__(self, deform_backend="mmcv", feat_store=None, flow_scale=1, **kwargs):
+        super().__init__(**kwargs)
+        check_flow_scale(flow_scale)
+        self.flow_scale = flow_scale
+        set_deform_backend(self, deform_backend)
+        self.feat_store_cfg = feat_store
+        self._feat_store = None
+
     def propagate(self, feats, flows, module_name, key_frms):
         """Propagate the latent features throughout the sequence.
 
@@ -56,7 +81,22 @@ class ProVQE(BasicVSRPlusPlus):
         else:
             raise ValueError('"module_name" is invalid.')
 
+        # the latest key frame before the previous frame for each sample and
+        # each frame; the frame before the previous frame if no key frame
+        idxs_key = []
+        for kfs in key_frms:
+            _idxs_key = [None, None]  # no key frame for the first two frames
+            i_key = None
+            for i in range(2, nfrms):
+                if kfs[i - 2]:
+                    i_key = i - 2
+                _idxs_key.append(i - 2 if i_key is None else i_key)
+            idxs_key.append(_idxs_key)
+
         feat_prop = flows.new_zeros(n, self.mid_channels, h, w)
+        flow_key = None  # flow from the current frame to the key frame
+        flow_n1_prev = None
+        i_keys_prev = None
         for i, idx in enumerate(frame_idx):
             feat_current = feats["spatial"][idx]
             if self.cpu_cache:
@@ -81,39 +121,44 @@ class ProVQE(BasicVSRPlusPlus):
 
                 # key frame
                 if i > 1:  # has at least two previous frames
-                    for ib in range(
-                        n
-                    ):  # each sample may have different key-frame annotation
-                        if sum(key_frms[ib][: i - 1]) > 0:  # has at least one key frame
-                            i_key = max([j for j in range(i - 1) if key_frms[ib][j]])
-                        else:
-                            i_key = i - 2
-
-                        ngaps = i - i_key
-                        feat_n2_ib = feats[module_name][-ngaps][ib : ib + 1]
+                    i_keys = [_idxs_key[i] for _idxs_key in idxs_key]
+
+                    # compose the flow from i to the key frame incrementally:
+                    # continue the flow from i-1 if the key frame is unchanged;
+                    # otherwise, restart from the flow from i-1 to i-2
+                    if flow_key is None:
+                        flow_base = flow_n1_prev
+                    else:
+                        if_same_key = torch.tensor(
+                            [
+                                i_key == i_key_prev
+                                for i_key, i_key_prev in zip(i_keys, i_keys_prev)
+                            ],
+                            device=flow_n1.device,
+                        ).view(n, 1, 1, 1)
+                        flow_base = torch.where(if_same_key, flow_key, flow_n1_prev)
+                    flow_key = flow_n1 + flow_warp(
+                        flow_base, flow_n1.permute(0, 2, 3, 1)
+                    )
+                    i_keys_prev = i_keys
+
+                    if len(set(i_keys)) == 1:  # all samples share the key frame
+                        feat_n2 = feats[module_name][i_keys[0] - i]
                         if self.cpu_cache:
-                            feat_n2_ib = feat_n2_ib.cuda()
-
-                        flow_left = flows[ib : ib + 1, flow_idx[i_key + 1], :, :, :]
-                        if self.cpu_cache:
-                            flow_left = flow_left.cuda()
-                        for j in range(1, ngaps):
-                            flow_right = flows[
-                                ib : ib + 1, flow_idx[i_key + 1 + j], :, :, :
-                            ]
+                            feat_n2 = feat_n2.cuda()
+                    else:  # samples with the same key frame are indexed at once
+                        for i_key in set(i_keys):
+                            ibs = [ib for ib in range(n) if i_keys[ib] == i_key]
+                            feat_key = feats[module_name][i_key - i][ibs]
                             if self.cpu_cache:
-                                flow_right = flow_right.cuda()
-                            flow_left = flow_right + flow_warp(
-                                flow_left, flow_right.permute(0, 2, 3, 1)
-                            )
-                        flow_n2_ib = flow_left
-
-                        cond_n2[ib : ib + 1] = flow_warp(
-                            feat_n2_ib, flow_n2_ib.permute(0, 2, 3, 1)
-                        )  # warp key propagated feature from i_key to i
+                                feat_key = feat_key.cuda()
+                            feat_n2[ibs] = feat_key
 
-                        feat_n2[ib : ib + 1] = feat_n2_ib
-                        flow_n2[ib : ib + 1] = flow_n2_ib
+                    flow_n2 = flow_key
+                    cond_n2 = flow_warp(
+                        feat_n2, flow_n2.permute(0, 2, 3, 1)
+                    )  # warp key propagated feature from i_key to i
+                flow_n1_prev = flow_n1
 
                 # flow-guided deformable convolution
                 cond = torch.cat([cond_n1, feat_current, cond_n2], dim=1)
@@ -138,7 +183,12 @@ class ProVQE(BasicVSRPlusPlus):
             # residual blocks
             feat_prop = feat_prop + self.backbone[module_name](feat)
             feats[module_name].append(feat_prop)
-            if self.cpu_cache:
+            if self._feat_store is not None:
+                idxs_next = frame_idx[i + 1 : i + 1 + self._feat_store.prefetch_depth]
+                for k in feats:
+                    if k != module_name:
+                        feats[k].prefetch(idxs_next)
+            elif self.cpu_cache:
                 feats[module_name][-1] = feats[module_name][-1].cpu()
                 torch.cuda.empty_cache()
 
@@ -147,20 +197,54 @@ class ProVQE(BasicVSRPlusPlus):
 
         return feats
 
-    def forward(self, lqs, key_frms):
-        """Forward function for ProVQE.
+    def compute_flow(self, lqs):
+        """Compute optical flows at the scale of flow_scale.
+
+        Frames are downsampled before SPyNet, and the flows are upsampled and
+        rescaled. See BasicVSRPlusPlus.compute_flow.
+
+        Args:
+            lqs (tensor): Input sequence with shape (n, t, c, h, w).
+
+        Returns:
+            Tensor | None: Forward flows with shape (n, t - 1, 2, h, w).
+            Tensor: Backward flows with shape (n, t - 1, 2, h, w).
+        """
+        if self.flow_scale == 1:
+            return super().compute_flow(lqs)
+
+        n, t, c, h, w = lqs.size()
+        lqs_scaled = nn_func.interpolate(
+            lqs.view(-1, c, h, w),
+            scale_factor=self.flow_scale,
+            mode="bicubic",
+            align_corners=False,
+        )
+        flows = super().compute_flow(lqs_scaled.view(n, t, c, *lqs_scaled.shape[2:]))
+        return tuple(
+            (
+                None
+                if flow is None
+                else resize_flow(flow.flatten(0, 1), (h, w)).view(n, t - 1, 2, h, w)
+            )
+            for flow in flows
+        )
+
+    def get_flows(self, lqs):
+        """Compute optical flows using the low-res inputs.
 
         Args:
             lqs (tensor): Input low quality (LQ) sequence with
                 shape (n, t, c, h, w).
-            key_frms (list[list[int]]): Key-frame annotation of samples.
 
         Returns:
-            Tensor: Output HR sequence with shape (n, t, c, h, w) or (n, t, c, 4h, 4w).
+            Tensor | None: Forward flows with shape (n, t - 1, 2, h', w').
+                h' and w' are h // 4 and w // 4 unless the input is low-res.
+            Tensor: Backward flows with shape (n, t - 1, 2, h', w').
         """
         n, t, c, h, w = lqs.size()
 
-        # whether to cache the features in CPU (no effect if using CPU)
+        # whether to cache the flows in CPU (no effect if using CPU)
         if t > self.cpu_cache_length and lqs.is_cuda:
             self.cpu_cache = True
         else:
@@ -173,19 +257,71 @@ class ProVQE(BasicVSRPlusPlus):
                 lqs.view(-1, c, h, w), scale_factor=0.25, mode="bicubic"
             ).view(n, t, c, h // 4, w // 4)
 
-        # compute optical flow using the low-res inputs
         assert lqs_downsample.size(3) >= 64 and lqs_downsample.size(4) >= 64, (
             "The height and width of LR inputs must be at least 64, "
             f"but got {h} and {w}."
         )
-        flows_forward, flows_backward = self.compute_flow(lqs_downsample)
+        return self.compute_flow(lqs_downsample)
+
+    def forward(self, lqs, key_frms, flows=None):
+        """Forward function for ProVQE.
+
+        Args:
+            lqs (tensor): Input low quality (LQ) sequence with
+                shape (n, t, c, h, w).
+            key_frms (list[list[int]]): Key-frame annotation of samples.
+            flows (tuple[Tensor] | Tensor): Pre-computed forward and backward
+                flows. See get_flows. A tensor with shape
+                (n, 2 * (t - 1), 2, h', w') is split into the two, e.g.,
+                loaded by LoadFlowFromFile. Default: None.
+
+        Returns:
+            Tensor: Output HR sequence with shape (n, t, c, h, w) or (n, t, c, 4h, 4w).
+        """
+        n, t, c, h, w = lqs.size()
+
+        # whether to cache the features in CPU (no effect if using CPU)
+        if t > self.cpu_cache_length and lqs.is_cuda:
+            self.cpu_cache = True
+        else:
+            self.cpu_cache = False
+
+        # compute optical flow using the low-res inputs
+        if flows is None:
+            flows_forward, flows_backward = self.get_flows(lqs)
+        elif torch.is_tensor(flows):
+            flows_forward, flows_backward = flows.chunk(2, dim=1)
+        else:
+            flows_forward, flows_backward = flows
 
         # check whether the input is an extended sequence
         self.check_if_mirror_extended(lqs)
 
+        if self.feat_store_cfg is not None:
+            self._feat_store = FeatureStore(**self.feat_store_cfg)
+        try:
+            return self._forward(lqs, key_frms, flows_forward, flows_backward)
+        finally:
+            if self._feat_store is not None:
+                self._feat_store.close()
+                self._feat_store = None
+
+    def _forward(self, lqs, key_frms, flows_forward, flows_backward):
+        """Compute features, propagate and upsample. See forward."""
+        n, t, c, h, w = lqs.size()
+
+        def new_feat_list():
+            if self._feat_store is None:
+                return []
+            return FeatureList(self._feat_store)
+
         feats = {}
         # compute spatial features
-        if self.cpu_cache:
+        if self._feat_store is not None:
+            feats["spatial"] = new_feat_list()
+            for i in range(0, t):
+                feats["spatial"].append(self.feat_extract(lqs[:, i, :, :, :]))
+        elif self.cpu_cache:
             feats["spatial"] = []
             for i in range(0, t):
                 feat = self.feat_extract(lqs[:, i, :, :, :]).cpu()
@@ -204,7 +340,7 @@ class ProVQE(BasicVSRPlusPlus):
             for direction in ["backward", "forward"]:
                 module_name = f"{direction}_{iter_}"
 
-                feats[module_name] = []
+                feats[module_name] = new_feat_list()
 
                 if direction == "backward":
                     flows = flows_backward
@@ -14,6 +14,7 @@ limitations under the License.
 
 import math
 import numbers
+import time
 
 import torch
 import torch.nn as nn
@@ -150,12 +151,32 @@ class GaussianSmoothing(nn.Module):
             Tensor: Filtered output.
         """
         return self.conv(
-            x, weight=self.weight, groups=self.groups, padding=self.padding
+            x,
+            weight=self.weight.to(device=x.device, dtype=x.dtype),
+            groups=self.groups,
+            padding=self.padding,
         )
 
 
 class IQAM:
+    """IQA module for the early exit of RBQE.
+
+    IQAM has no trainable parameters. Tensors are kept on CPU and follow the
+    device and dtype of the input image. Thus, it works on both CPU and GPU.
+
+    Args:
+        comp_type (str): Compression type. "jpeg" | "hevc".
+            Default: "jpeg".
+    """
+
     def __init__(self, comp_type="jpeg"):
+        supported_comp_types = ["jpeg", "hevc"]
+        if comp_type not in supported_comp_types:
+            raise NotImplementedError(
+                f'Compression type should be in "{supported_comp_types}";'
+                f' received "{comp_type}".'
+            )
+
         if comp_type == "jpeg":
             self.patch_sz = 8
 
@@ -234,7 +255,7 @@ class IQAM:
                     ],
                 ],
                 dtype=torch.float32,
-            ).cuda()
+            )
 
             self.thr_out = 0.855
 
@@ -249,7 +270,7 @@ class IQAM:
                     [-0.2236, 0.6708, -0.6708, 0.2236],
                 ],
                 dtype=torch.float32,
-            ).cuda()
+            )
 
             self.thr_out = 0.900
 
@@ -262,122 +283,184 @@ class IQAM:
 
         self.gaussian_filter = GaussianSmoothing(
             channels=1, kernel_size=3, sigma=5, padding=3 // 2
-        ).cuda()
-
-    def cal_tchebichef_moments(self, x):
-        x = x.clone()
-        x /= torch.sqrt(
-            self.patch_sz * self.patch_sz * (x.reshape((-1,)).pow(2).mean())
         )
-        x -= x.reshape((-1,)).mean()
-        moments = torch.mm(torch.mm(self.tche_poly, x), self.tche_poly_transposed)
-        return moments
 
-    def forward(self, x):
-        """Forward.
+        # Tchebichef polynomials on the device and in the dtype of inputs
+        self._tche_polys = dict()
 
-        Only test one channel, e.g., red.
+    def get_tche_polys(self, x):
+        """Get Tchebichef polynomials on the device and in the dtype of x.
+
+        Polynomials are cached per (device, dtype) to avoid repeated copies.
 
         Args:
-            x (Tensor): Image with the shape of (B=1, C, H, W).
+            x (Tensor): Input tensor.
+
+        Returns:
+            Tensor: Tchebichef polynomials with the shape of (PS, PS).
+            Tensor: Transposed Tchebichef polynomials with the shape of
+                (PS, PS).
         """
-        h, w = x.shape[2:]
-        h_cut = h // self.patch_sz * self.patch_sz
-        w_cut = w // self.patch_sz * self.patch_sz
-        x = x[0, 0, :h_cut, :w_cut]  # (h_cut, w_cut)
+        key = (x.device, x.dtype)
+        if key not in self._tche_polys:
+            self._tche_polys[key] = (
+                self.tche_poly.to(device=x.device, dtype=x.dtype),
+                self.tche_poly_transposed.to(device=x.device, dtype=x.dtype),
+            )
+        return self._tche_polys[key]
 
-        num_smooth = 0.0
-        num_textured = 0.0
-        score_blocky_smooth = 0.0
-        score_blurred_textured = 0.0
+    def cal_tchebichef_moments(self, x):
+        """Calculate Tchebichef moments.
 
-        start_h = self.patch_sz // 2 - 1
-        while start_h + self.patch_sz <= h_cut:
-            start_w = self.patch_sz // 2 - 1
+        Args:
+            x (Tensor): Blocks with the shape of (..., PS, PS).
 
-            while start_w + self.patch_sz <= w_cut:
-                patch = x[
-                    start_h : (start_h + self.patch_sz),
-                    start_w : (start_w + self.patch_sz),
-                ]
+        Returns:
+            Tensor: Moments with the shape of (..., PS, PS).
+        """
+        x = x / torch.sqrt(
+            self.patch_sz * self.patch_sz * x.pow(2).mean(dim=(-2, -1), keepdim=True)
+        )
+        x = x - x.mean(dim=(-2, -1), keepdim=True)
+        tche_poly, tche_poly_transposed = self.get_tche_polys(x)
+        moments = torch.matmul(torch.matmul(tche_poly, x), tche_poly_transposed)
+        return moments
 
-                sum_patch = torch.sum(torch.abs(patch))
-                # will lead to NAN score of blocky smooth patch
-                if sum_patch == 0:
-                    num_smooth += 1
-                    score_blocky_smooth = score_blocky_smooth + 1.0
+    def extract_blocks(self, x):
+        """Extract all assessed blocks at once.
 
-                else:
-                    moments_patch = self.cal_tchebichef_moments(patch)
+        Blocks start from (PS // 2 - 1, PS // 2 - 1) and do not overlap.
 
-                    # smooth/textured patch
-                    ssm = torch.sum(moments_patch.pow(2)) - moments_patch[0, 0].pow(2)
-                    if ssm > self.thr_smooth:
-                        num_textured += 1
+        Args:
+            x (Tensor): Images with the shape of (N, H, W).
 
-                        patch_blurred = torch.squeeze(
-                            self.gaussian_filter(
-                                patch.clone().view(1, 1, self.patch_sz, self.patch_sz)
-                            )
-                        )
-                        moments_patch_blurred = self.cal_tchebichef_moments(
-                            patch_blurred
-                        )
-                        similarity_matrix = torch.div(
-                            (
-                                torch.mul(moments_patch, moments_patch_blurred) * 2.0
-                                + self.bigc
-                            ),
-                            (moments_patch.pow(2))
-                            + moments_patch_blurred.pow(2)
-                            + self.bigc,
-                        )
-                        score_blurred_textured += 1 - torch.mean(
-                            similarity_matrix.reshape((-1))
-                        )
+        Returns:
+            Tensor: Blocks with the shape of (N, NB, PS, PS), where NB is the
+                number of blocks per image.
+        """
+        n, h, w = x.shape
+        h_cut = h // self.patch_sz * self.patch_sz
+        w_cut = w // self.patch_sz * self.patch_sz
+        start = self.patch_sz // 2 - 1
+        nblocks_h = max((h_cut - start) // self.patch_sz, 0)
+        nblocks_w = max((w_cut - start) // self.patch_sz, 0)
+        x = x[
+            :,
+            start : (start + nblocks_h * self.patch_sz),
+            start : (start + nblocks_w * self.patch_sz),
+        ]
+        blocks = x.reshape(n, nblocks_h, self.patch_sz, nblocks_w, self.patch_sz)
+        blocks = blocks.permute(0, 1, 3, 2, 4).reshape(
+            n, nblocks_h * nblocks_w, self.patch_sz, self.patch_sz
+        )
+        return blocks
 
-                    else:
-                        num_smooth += 1
+    def cal_quality_scores(self, x):
+        """Calculate quality scores.
 
-                        sum_moments = torch.sum(torch.abs(moments_patch))
-                        strength_vertical = (
-                            torch.sum(torch.abs(moments_patch[self.patch_sz - 1, :]))
-                            / sum_moments
-                            - torch.abs(moments_patch[0, 0])
-                            + self.bigc
-                        )
-                        strength_horizontal = (
-                            torch.sum(torch.abs(moments_patch[:, self.patch_sz - 1]))
-                            / sum_moments
-                            - torch.abs(moments_patch[0, 0])
-                            + self.bigc
-                        )
+        Only test one channel, e.g., red.
 
-                        if strength_vertical > self.thr_jnd:
-                            strength_vertical = self.thr_jnd
-                        if strength_horizontal > self.thr_jnd:
-                            strength_horizontal = self.thr_jnd
-                        score_ = torch.log(
-                            1 - ((strength_vertical + strength_horizontal) / 2)
-                        ) / torch.log(1 - self.thr_jnd)
+        All blocks are processed by batched tensor operations. Smooth and
+        textured blocks are then scored by masked reductions.
 
-                        score_blocky_smooth = score_blocky_smooth + score_
+        Args:
+            x (Tensor): Images with the shape of (N, C, H, W).
 
-                start_w += self.patch_sz
-            start_h += self.patch_sz
+        Returns:
+            Tensor: Quality scores with the shape of (N,).
+        """
+        blocks = self.extract_blocks(x[:, 0, ...])  # (N, NB, PS, PS)
+        n, nblocks = blocks.shape[:2]
+
+        # blocks with zero sum will lead to NAN moments
+        # these blocks are regarded as blocky smooth blocks with the score of 1
+        is_zero = blocks.abs().sum(dim=(-2, -1)) == 0
+        blocks = torch.where(is_zero[..., None, None], torch.ones_like(blocks), blocks)
+        moments = self.cal_tchebichef_moments(blocks)
+
+        # smooth/textured blocks
+        ssm = moments.pow(2).sum(dim=(-2, -1)) - moments[..., 0, 0].pow(2)
+        is_textured = (~is_zero) & (ssm > float(self.thr_smooth))
+        is_smooth = ~is_textured
+
+        # blurred textured blocks
+        blocks_blurred = self.gaussian_filter(
+            blocks.reshape(n * nblocks, 1, self.patch_sz, self.patch_sz)
+        ).view(n, nblocks, self.patch_sz, self.patch_sz)
+        moments_blurred = self.cal_tchebichef_moments(blocks_blurred)
+        bigc = float(self.bigc)
+        similarity_matrix = (moments * moments_blurred * 2.0 + bigc) / (
+            moments.pow(2) + moments_blurred.pow(2) + bigc
+        )
+        scores_textured = 1 - similarity_matrix.mean(dim=(-2, -1))
+
+        # blocky smooth blocks
+        sum_moments = moments.abs().sum(dim=(-2, -1))
+        moment_dc = moments[..., 0, 0].abs()
+        thr_jnd = float(self.thr_jnd)
+        strength_vertical = (
+            moments[..., self.patch_sz - 1, :].abs().sum(dim=-1) / sum_moments
+            - moment_dc
+            + bigc
+        )
+        strength_horizontal = (
+            moments[..., :, self.patch_sz - 1].abs().sum(dim=-1) / sum_moments
+            - moment_dc
+            + bigc
+        )
+        strength_vertical = torch.where(
+            strength_vertical > thr_jnd,
+            torch.full_like(strength_vertical, thr_jnd),
+            strength_vertical,
+        )
+        strength_horizontal = torch.where(
+            strength_horizontal > thr_jnd,
+            torch.full_like(strength_horizontal, thr_jnd),
+            strength_horizontal,
+        )
+        scores_smooth = torch.log(
+            1 - ((strength_vertical + strength_horizontal) / 2)
+        ) / float(torch.log(1 - self.thr_jnd))
+        scores_smooth = torch.where(
+            is_zero, torch.ones_like(scores_smooth), scores_smooth
+        )
 
-        if num_textured != 0:
-            score_blurred_textured /= num_textured
-        else:
-            score_blurred_textured = torch.tensor(1.0, dtype=torch.float32)
-        if num_smooth != 0:
-            score_blocky_smooth /= num_smooth
-        else:
-            score_blocky_smooth = torch.tensor(1.0, dtype=torch.float32)
+        # average over blocks; the score is 1 if there is no such block
+        num_textured = is_textured.sum(dim=1)
+        num_smooth = is_smooth.sum(dim=1)
+        score_blurred_textured = torch.where(
+            is_textured, scores_textured, torch.zeros_like(scores_textured)
+        ).sum(dim=1) / num_textured.clamp(min=1)
+        score_blurred_textured = torch.where(
+            num_textured > 0,
+            score_blurred_textured,
+            torch.ones_like(score_blurred_textured),
+        )
+        score_blocky_smooth = torch.where(
+            is_smooth, scores_smooth, torch.zeros_like(scores_smooth)
+        ).sum(dim=1) / num_smooth.clamp(min=1)
+        score_blocky_smooth = torch.where(
+            num_smooth > 0, score_blocky_smooth, torch.ones_like(score_blocky_smooth)
+        )
 
         score_quality = (score_blocky_smooth.pow(self.alpha_block)) * (
             score_blurred_textured.pow(1 - self.alpha_block)
         )
+        return score_quality
+
+    def forward(self, x):
+        """Forward.
+
+        Only test one channel, e.g., red.
+
+        Args:
+            x (Tensor): Image with the shape of (B=1, C, H, W).
+
+        Returns:
+            bool: Whether the image quality is high enough to exit.
+        """
+        with torch.no_grad():
+            score_quality = self.cal_quality_scores(x[:1])[0]
         if score_quality >= self.thr_out:
             return True
         else:
@@ -698,13 +781,34 @@ class RBQE(BaseNet):
     def forward(self, x, idx_out=None):
         """Forward.
 
+        The network can run on either CPU or GPU. IQAM follows the device and
+        dtype of x; thus, the early exit (idx_out=-2) is also supported on
+        CPU-only hosts.
+
+        For the early exit, each sample exits on its own. Samples that pass
+        the IQAM threshold are retired from the batch after each U-Net; the
+        remaining samples go through the next U-Net as a compacted batch.
+        Outputs are scattered back in the original order.
+
+        For the early exit, the exit information of the last call is recorded
+        in self.exit_info, a dict of tensors with the shape of (N,):
+            idx_exit: Index of the chosen exit.
+            score: IQAM score at the chosen exit. NaN for the last exit, where
+                IQAM is skipped.
+            latency: Time in seconds spent before the sample exits.
+
         Args:
-            x (Tensor): Image with the shape of (B=1, C, H, W).
+            x (Tensor): Image with the shape of (N, C, H, W).
             idx_out (int):
-                -2: Determined by IQAM.
+                -2: Determined by IQAM per sample.
                 -1: Output all images from all outputs for training.
-                0 | 1 | ... | self.nlevel-1: Output from the assigned exit.
+                0 | 1 | ... | self.nlevel-1: Output from the assigned exit. The
+                    following U-Nets are skipped.
                 None: Output from the last exit.
+
+        Returns:
+            Tensor: Output images with the shape of (self.nlevel, N, C, H, W)
+                if idx_out is -1; otherwise (N, C, H, W).
         """
         if self.if_only_last_output:
             if idx_out is not None:
@@ -712,6 +816,8 @@ class RBQE(BaseNet):
                     "Exit cannot be indicated" " since there is only one exit."
                 )
             idx_out = self.nlevel - 1
+        elif idx_out is None:
+            idx_out = self.nlevel - 1
 
         feat = self.in_conv_seq(x)
         feat_level_unet = [[feat]]  # the first level feature of the first U-Net
@@ -719,6 +825,16 @@ class RBQE(BaseNet):
         if idx_out == -1:  # to record output images from all exits
             out_img_list = []
 
+        if idx_out == -2:  # to record output images of retired samples
+            out = torch.empty_like(x)
+            idxs_remain = torch.arange(x.shape[0], device=x.device)
+            self.exit_info = dict(
+                idx_exit=torch.full_like(idxs_remain, self.nlevel - 1),
+                score=x.new_full((x.shape[0],), float("nan")),
+                latency=x.new_zeros((x.shape[0],)),
+            )
+            tic = time.perf_counter()
+
         for idx_unet in range(self.nlevel):  # per U-Net
             down = getattr(self, f"down_{idx_unet}")
             feat = down(feat_level_unet[-1][0])  # the previous U-Net, the first level
@@ -748,18 +864,53 @@ class RBQE(BaseNet):
                     out_conv_seq = self.out_layers[idx_unet]
                 out_img = out_conv_seq(feat_up_list[-1]) + x
 
+                if idx_out == idx_unet:  # skip the following U-Nets
+                    break
+
                 if idx_out == -1:
                     out_img_list.append(out_img)
 
-                # if at the last level, no need to IQA
-                if (idx_out == -2) and (idx_unet < (self.nlevel - 1)):
-                    if_out = self.iqam.forward(out_img)
-                    if if_out:
+                if idx_out == -2:
+                    # if at the last level, no need to IQA
+                    if idx_unet == (self.nlevel - 1):
+                        out[idxs_remain] = out_img
+                        if x.is_cuda:
+                            torch.cuda.synchronize(x.device)
+                        self.exit_info["latency"][idxs_remain] = (
+                            time.perf_counter() - tic
+                        )
+                        break
+
+                    with torch.no_grad():
+                        scores = self.iqam.cal_quality_scores(out_img)
+                    if_out = scores >= self.iqam.thr_out
+                    out[idxs_remain[if_out]] = out_img[if_out]
+
+                    # record exit information
+                    idxs_out = idxs_remain[if_out]
+                    self.exit_info["idx_exit"][idxs_out] = idx_unet
+                    self.exit_info["score"][idxs_out] = scores[if_out]
+
+                    # retire samples from the batch
+                    if_remain = ~if_out
+                    if_any_remain = bool(if_remain.any())  # synchronize
+                    self.exit_info["latency"][idxs_out] = time.perf_counter() - tic
+                    if not if_any_remain:
                         break
+                    if not if_remain.all():
+                        x = x[if_remain]
+                        idxs_remain = idxs_remain[if_remain]
+                        feat_up_list = [f[if_remain] for f in feat_up_list]
+                        feat_level_unet = [
+                            [f[if_remain] for f in feat_level]
+                            for feat_level in feat_level_unet
+                        ]
 
             feat_level_unet.append(feat_up_list)
 
         if idx_out == -1:
             return torch.stack(out_img_list, dim=0)  # (self.nlevel, N, C, H, W)
+        elif idx_out == -2:
+            return out  # (N, C, H, W)
         else:
-            return out_img  # (B=1, C, H, W)
+            return out_img  # (N, C, H, W)
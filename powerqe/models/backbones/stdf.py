@@ -18,6 +18,7 @@ from mmcv.ops import ModulatedDeformConv2d
 
 from ..registry import BACKBONES
 from .base import BaseNet
+from .deform_conv import DEFORM_BACKENDS, TorchModulatedDeformConv2d
 
 
 class STDF(nn.Module):
@@ -29,11 +30,28 @@ class STDF(nn.Module):
         nf (int): Num of channels (filters) of each conv layer.
         nb (int): Num of conv layers.
         deform_ks (int): Size of the deformable kernel.
+        deform_backend (str): Backend of the deformable convolution.
+            "mmcv" or "torch". See deform_conv. Default: "mmcv".
     """
 
-    def __init__(self, in_nc=3, out_nc=64, nf=32, nb=3, base_ks=3, deform_ks=3):
+    def __init__(
+        self,
+        in_nc=3,
+        out_nc=64,
+        nf=32,
+        nb=3,
+        base_ks=3,
+        deform_ks=3,
+        deform_backend="mmcv",
+    ):
         super().__init__()
 
+        if deform_backend not in DEFORM_BACKENDS:
+            raise ValueError(
+                f'"deform_backend" should be in "{DEFORM_BACKENDS}";'
+                f' received "{deform_backend}".'
+            )
+
         self.in_nc = in_nc
         self.nb = nb
         self.deform_ks = deform_ks
@@ -86,7 +104,12 @@ class STDF(nn.Module):
 
         # deformable conv
         # notice group=in_nc, i.e., each map use individual offset and mask
-        self.deform_conv = ModulatedDeformConv2d(
+        deform_conv_cls = (
+            ModulatedDeformConv2d
+            if deform_backend == "mmcv"
+            else TorchModulatedDeformConv2d
+        )
+        self.deform_conv = deform_conv_cls(
             in_channels=in_nc,
             out_channels=out_nc,
             kernel_size=deform_ks,
@@ -167,6 +190,8 @@ class STDFNet(BaseNet):
         nf_qe (int): Channel number of intermediate features of QE module.
         nb_qe (int): Block number of QE module.
         deform_ks (int): Kernel size of deformable convolutions.
+        deform_backend (str): Backend of deformable convolutions. "mmcv" or
+            "torch". The latter runs on any device. Default: "mmcv".
     """
 
     def __init__(
@@ -179,6 +204,7 @@ class STDFNet(BaseNet):
         deform_ks=3,
         nf_qe=48,
         nb_qe=6,
+        deform_backend="mmcv",
     ):
         super().__init__()
 
@@ -192,9 +218,36 @@ class STDFNet(BaseNet):
             nf=nf_stdf,
             nb=nb_stdf,
             deform_ks=deform_ks,
+            deform_backend=deform_backend,
         )
         self.qe_net = QENet(in_nc=nf_stdf_out, nf=nf_qe, nb=nb_qe, out_nc=io_channels)
 
+    def extract_frm_feat(self, x):
+        """Per-frame work for streaming inference.
+
+        The frames are stacked as the network input, so only the frame itself
+        is shared by all windows. See forward_frm_feats.
+
+        Args:
+            x (Tensor): Input frame with the shape of (N, C, H, W).
+
+        Returns:
+            Tensor: Input frame.
+        """
+        return x
+
+    def forward_frm_feats(self, frm_feats):
+        """Forward function with per-frame features.
+
+        Args:
+            frm_feats (list[Tensor]): Per-frame features of a window.
+                See extract_frm_feat.
+
+        Returns:
+            Tensor: Output center frame with the shape of (N, C, H, W).
+        """
+        return self.forward(torch.stack(frm_feats, dim=1))
+
     def forward(self, x):
         """Forward.
 
@@ -14,19 +14,23 @@ limitations under the License.
 
 import numbers
 import os.path as osp
+import time
 
 import mmcv
 import numpy as np
 import torch
+from mmcv.runner import auto_fp16
 from mmedit.core import tensor2img
 from mmedit.models import BasicRestorer
+from mmedit.utils import get_root_logger
 
+from ...utils.hm_log import HM_INDEX_NAME, get_frame_info
 from ...utils.unfolding import (
-    combine_patches,
     crop_img,
+    estimate_receptive_field,
+    measure_peak_memory,
     pad_img_min_sz,
-    pad_img_sz_mul,
-    unfold_img,
+    tiled_forward,
 )
 from ..registry import MODELS
 
@@ -59,6 +63,158 @@ class BasicQERestorer(BasicRestorer):
             pretrained=pretrained,
         )
 
+        self._receptive_field = None  # cache of the auto halo size
+        self._unfolding_plans = dict()  # cache of the auto unfolding per shape
+
+    def get_unfolding_overlap(self, lq, patch_sz):
+        """Get the halo size of unfolding patches.
+
+        If the overlap in test_cfg.unfolding is "auto", the halo size is the
+        receptive-field radius of the generator, which is estimated once and
+        capped at half of the patch size.
+
+        Args:
+            lq (Tensor): LQ image with the shape of (N=1, C, H, W).
+            patch_sz (int): Patch size.
+
+        Returns:
+            int: Halo size.
+        """
+        _cfg = self.test_cfg["unfolding"]
+        overlap = _cfg.get("overlap", 0)
+        if overlap != "auto":
+            return overlap
+
+        if self._receptive_field is None:
+            self._receptive_field = estimate_receptive_field(
+                self.generator, nc=lq.shape[1], probe_sz=patch_sz, device=lq.device
+            )
+        return min(self._receptive_field, patch_sz // 2)
+
+    def get_unfolding_plan(self, lq):
+        """Get the patch size, tile batch and halo size of unfolding.
+
+        If the patchsize in test_cfg.unfolding is "auto", the unfolding dict
+        should contain:
+            memory (float): Memory budget (MiB) for processing one group of
+                tiles. The padded input and output images are not counted.
+            latency (float, optional): Latency target (ms) per image.
+                If given, the plan with the smallest memory that meets the
+                target is selected; otherwise, the fastest plan is selected.
+            patchsizes (list[int], optional): Candidate patch sizes.
+                Default: [64, 128, 256, 512].
+
+        For each candidate patch size, the generator is probed with one and
+        two tiles to extrapolate the largest tile batch within the memory
+        budget. The latency of this tile batch is then measured. The plan is
+        cached per input shape, so later images of the same shape skip the
+        probing.
+
+        The "auto" mode requires CUDA, where the peak memory is measured by
+        the allocator. On other devices, the memory can only be underestimated
+        (see measure_peak_memory), so the budget cannot be guaranteed.
+
+        Args:
+            lq (Tensor): LQ image with the shape of (N=1, C, H, W).
+
+        Returns:
+            int: Patch size.
+            int: Tile batch, i.e., number of tiles per forward.
+            int: Halo size.
+        """
+        _cfg = self.test_cfg["unfolding"]
+        h, w = lq.shape[2:]
+
+        if _cfg["patchsize"] != "auto":
+            patch_sz = _cfg["patchsize"]
+            npatches = int(np.ceil(h / patch_sz)) * int(np.ceil(w / patch_sz))
+            splits = min(_cfg["splits"], npatches)
+            overlap = self.get_unfolding_overlap(lq, patch_sz)
+            return patch_sz, npatches // splits, overlap
+
+        if lq.device.type != "cuda":
+            raise ValueError(
+                'Unfolding with "patchsize" being "auto" requires CUDA to measure'
+                f' the memory; received "{lq.device}". Set "patchsize" and'
+                ' "splits" instead.'
+            )
+
+        key = (tuple(lq.shape), str(lq.dtype), str(lq.device))
+        if key in self._unfolding_plans:
+            return self._unfolding_plans[key]
+
+        patch_szs = [
+            patch_sz
+            for patch_sz in _cfg.get("patchsizes", [64, 128, 256, 512])
+            if patch_sz <= min(h, w)
+        ]
+        if not patch_szs:
+            raise ValueError(
+                f"Height ({h}) and width ({w}) should not be smaller"
+                " than the smallest candidate patch size."
+            )
+        memory = _cfg["memory"] * 1024**2
+        device = lq.device
+
+        # Estimate the receptive field (if needed) with the largest probe
+        self.get_unfolding_overlap(lq, max(patch_szs))
+
+        plans = []
+        for patch_sz in patch_szs:
+            overlap = self.get_unfolding_overlap(lq, patch_sz)
+            tile_sz = patch_sz + 2 * overlap
+            npatches = int(np.ceil(h / patch_sz)) * int(np.ceil(w / patch_sz))
+
+            tiles = lq.new_empty(2, lq.shape[1], tile_sz, tile_sz).uniform_()
+            memory_one = measure_peak_memory(self.generator, tiles[:1])
+            if memory_one > memory:
+                continue
+            memory_per_tile = max(
+                measure_peak_memory(self.generator, tiles) - memory_one, 1
+            )
+            tile_batch = min(
+                npatches, 1 + int((memory - memory_one) // memory_per_tile)
+            )
+
+            tiles = lq.new_empty(tile_batch, lq.shape[1], tile_sz, tile_sz).uniform_()
+            self.generator(tiles)  # warm up
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            tic = time.perf_counter()
+            self.generator(tiles)
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            latency = (time.perf_counter() - tic) * int(np.ceil(npatches / tile_batch))
+            del tiles
+
+            plans.append(
+                dict(
+                    patch_sz=patch_sz,
+                    tile_batch=tile_batch,
+                    overlap=overlap,
+                    memory=memory_one + memory_per_tile * (tile_batch - 1),
+                    latency=latency * 1000,
+                )
+            )
+
+        if not plans:
+            raise ValueError(
+                f"No candidate patch size in {patch_szs} fits the memory budget"
+                f" ({_cfg['memory']} MiB)."
+            )
+        plan = min(plans, key=lambda plan: plan["latency"])  # the fastest
+        if _cfg.get("latency") is not None:
+            plans_valid = [p for p in plans if p["latency"] <= _cfg["latency"]]
+            if plans_valid:
+                plan = min(plans_valid, key=lambda plan: plan["memory"])
+
+        self._unfolding_plans[key] = (
+            plan["patch_sz"],
+            plan["tile_batch"],
+            plan["overlap"],
+        )
+        return self._unfolding_plans[key]
+
     def forward_test(
         self,
         lq,
@@ -72,9 +228,18 @@ class BasicQERestorer(BasicRestorer):
         """Test forward.
 
         To save memory, image can be cut (or unfolded) into patches.
-        Those patches can be tested separately.
+        Those patches are tested group by group. See tiled_forward.
         test_cfg must contain unfolding, which is a dict contains
         patchsize (patch size) and splits (number of testing splits).
+        patchsize can also be "auto" to tune the patch size and the tile batch
+        under a memory budget. See get_unfolding_plan.
+
+        To avoid seams between patches, each patch can be extended by a halo.
+        The unfolding dict can further contain:
+            overlap (int | str): Halo size. "auto" for the receptive-field
+                radius of the generator. See get_unfolding_overlap. Default: 0.
+            blending (str): "crop" or "feather". See tiled_forward.
+                Default: "crop".
 
         For image saving, meta_keys of Collect transform should contain
         lq_path.
@@ -116,26 +281,15 @@ class BasicQERestorer(BasicRestorer):
 
         if "unfolding" in self.test_cfg:
             _cfg = self.test_cfg["unfolding"]
-            lq_pad, pad_info_unfold = pad_img_sz_mul(lq, _cfg["patchsize"])
-            lq_patches, unfold_shape = unfold_img(lq_pad, _cfg["patchsize"])
-
-            splits = _cfg["splits"]
-            npatches = lq_patches.shape[0]
-            if splits > npatches:
-                splits = npatches
-            b_split = npatches // splits
-
-            output_patches = []
-            for split in range(splits):
-                output_patches.append(
-                    self.generator(lq_patches[split * b_split : (split + 1) * b_split])
-                )
-            if splits * b_split < npatches:
-                output_patches.append(self.generator(lq_patches[splits * b_split :]))
-            output_patches = torch.cat(output_patches, dim=0)
-
-            output = combine_patches(output_patches, unfold_shape)
-            output = crop_img(output, pad_info_unfold)
+            patch_sz, tile_batch, overlap = self.get_unfolding_plan(lq)
+            output = tiled_forward(
+                self.generator,
+                lq,
+                patch_sz,
+                overlap=overlap,
+                blending=_cfg.get("blending", "crop"),
+                tile_batch=tile_batch,
+            )
         else:
             output = self.generator(lq)
 
@@ -194,6 +348,8 @@ class BasicVQERestorer(BasicRestorer):
         Support padding testing. See forward_test.
         Support sequence LQ and sequence/center GT. See forward_test.
         Support parameter fix for some iters. See train_step.
+        Support pre-computed flows for training. See forward_train.
+        Support QP-aware skipping of center frames. See get_qp_action.
 
     Args:
         generator (dict): Config for the generator structure.
@@ -230,6 +386,16 @@ class BasicVQERestorer(BasicRestorer):
         self.fix_module = train_cfg.get("fix_module", []) if train_cfg else []
         self.is_weight_fixed = False
 
+        # Pre-computed flows can replace SPyNet only if SPyNet is fixed
+        spynet_params = [
+            k for k, _ in self.generator.named_parameters() if "spynet" in k
+        ]
+        self.is_spynet_fixed = (self.fix_iter > 0) and all(
+            any(fix_module in k for fix_module in self.fix_module)
+            for k in spynet_params
+        )
+        self.is_flow_discard_logged = False
+
         # Count training steps
         self.register_buffer("step_counter", torch.zeros(1))
 
@@ -262,6 +428,85 @@ class BasicVQERestorer(BasicRestorer):
 
         return outputs
 
+    @auto_fp16(apply_to=("lq"))
+    def forward(self, lq, gt=None, test_mode=False, flows=None, **kwargs):
+        """Forward function.
+
+        Args:
+            lq (Tensor): Input lq images.
+            gt (Tensor): Ground-truth image. Default: None.
+            test_mode (bool): Whether in test mode or not. Default: False.
+            flows (Tensor): Pre-computed flows for training. Default: None.
+            kwargs (dict): Other arguments.
+        """
+        if test_mode:
+            return self.forward_test(lq, gt, **kwargs)
+
+        return self.forward_train(lq, gt, flows=flows)
+
+    def use_precomputed_flows(self, flows):
+        """Whether to feed pre-computed flows to the generator.
+
+        Flows replace SPyNet only for the first fix_iter iters, during which
+        SPyNet should be fixed; otherwise SPyNet would silently get no
+        gradient. Afterwards, the flows are discarded.
+
+        Args:
+            flows (Tensor | None): Pre-computed flows.
+
+        Returns:
+            bool: Whether to use the flows.
+        """
+        if flows is None:
+            return False
+        if self.step_counter >= self.fix_iter:
+            if not self.is_flow_discard_logged:
+                self.is_flow_discard_logged = True
+                get_root_logger().warning(
+                    "Pre-computed flows are loaded but discarded after"
+                    f" {self.fix_iter} iters; remove the flow transforms from"
+                    " the pipeline to save the IO."
+                )
+            return False
+        if not self.is_spynet_fixed:
+            raise ValueError(
+                "Pre-computed flows replace SPyNet for the first"
+                f" {self.fix_iter} iters; SPyNet should be in fix_module"
+                f" ({self.fix_module})."
+            )
+        return True
+
+    def forward_train(self, lq, gt, flows=None):
+        """Training forward function.
+
+        Pre-computed flows, e.g., loaded by LoadFlowFromFile, are used only
+        when SPyNet is fixed, i.e., for the first fix_iter iters with SPyNet in
+        fix_module. SPyNet is then skipped. Afterwards, flows are computed by
+        the generator, so that SPyNet is trained. See use_precomputed_flows.
+
+        Args:
+            lq (Tensor): LQ Tensor with shape (n, t, c, h, w).
+            gt (Tensor): GT Tensor with shape (n, t, c, h, w) or (n, c, h, w).
+            flows (Tensor): Pre-computed flows. The generator should accept
+                flows in forward. Default: None.
+
+        Returns:
+            Tensor: Output tensor.
+        """
+        losses = dict()
+        if self.use_precomputed_flows(flows):
+            output = self.generator(lq, flows=flows)
+        else:
+            output = self.generator(lq)
+        loss_pix = self.pixel_loss(output, gt)
+        losses["loss_pix"] = loss_pix
+        outputs = dict(
+            losses=losses,
+            num_samples=len(gt.data),
+            results=dict(lq=lq.cpu(), gt=gt.cpu(), output=output.cpu()),
+        )
+        return outputs
+
     def evaluate(self, metrics, output, gt):
         """Evaluation.
 
@@ -308,6 +553,167 @@ class BasicVQERestorer(BasicRestorer):
 
         return eval_result
 
+    def forward_generator(self, lq, **kwargs):
+        """Test forward of the generator.
+
+        To save memory for long sequences, the sequence can be cut into
+        temporal chunks. Each chunk is extended by warm-up frames at both
+        sides, so that the recurrent propagation of each kept frame sees
+        enough context. Outputs of warm-up frames are discarded. Thus, the
+        memory is bounded by the chunk length rather than the sequence
+        length. test_cfg.chunking is a dict contains:
+            length (int): Number of kept frames per chunk.
+            overlap (int): Number of warm-up frames at each side. Default: 0.
+
+        Chunking requires one output frame per input frame, i.e.,
+        center_gt should be False.
+
+        Args:
+            lq (Tensor): LQ images with the shape of (N=1, T, C, H, W).
+            kwargs (dict): Other arguments of the generator. Each value should
+                be a list of per-sample items. For chunking, each per-sample
+                item should be a list of per-frame items, e.g., key_frms.
+
+        Returns:
+            Tensor: Output images with the shape of (N=1, T, C, H, W)
+                or (N=1, C, H, W).
+        """
+        nfrms = lq.shape[1]
+        if "chunking" not in self.test_cfg:
+            return self.forward_unfolding(lq, **kwargs)
+
+        if self.center_gt:
+            raise ValueError('Chunking is not supported when "center_gt" is True.')
+
+        _cfg = self.test_cfg["chunking"]
+        chunk_len = _cfg["length"]
+        overlap = _cfg.get("overlap", 0)
+        if nfrms <= chunk_len:
+            return self.forward_unfolding(lq, **kwargs)
+
+        output = None
+        for start in range(0, nfrms, chunk_len):
+            end = min(start + chunk_len, nfrms)
+            start_ext = max(start - overlap, 0)
+            end_ext = min(end + overlap, nfrms)
+
+            _kwargs = {
+                k: [item[start_ext:end_ext] for item in v] for k, v in kwargs.items()
+            }
+            output_chunk = self.forward_unfolding(lq[:, start_ext:end_ext], **_kwargs)
+
+            if output is None:  # shape of the output is known now
+                output = output_chunk.new_empty(
+                    output_chunk.shape[0], nfrms, *output_chunk.shape[2:]
+                )
+            output[:, start:end] = output_chunk[
+                :, (start - start_ext) : (end - start_ext)
+            ]
+            del output_chunk
+        return output
+
+    def forward_unfolding(self, lq, **kwargs):
+        """Test forward of the generator with optional unfolding.
+
+        To save memory, frames can be cut (or unfolded) into patches spatially.
+        Each patch covers all frames and is tested separately. See
+        tiled_forward. test_cfg.unfolding is a dict contains:
+            patchsize (int): Patch size.
+            splits (int): Number of testing splits.
+            overlap (int): Halo size. Default: 0.
+            blending (str): "crop" or "feather". Default: "crop".
+            precompute_flow (bool): Whether to compute optical flows once on
+                the whole frames and crop them per patch. The generator should
+                implement get_flows(lq) and accept flows in forward.
+                Default: False.
+
+        Args:
+            lq (Tensor): LQ images with the shape of (N=1, T, C, H, W).
+            kwargs (dict): Other arguments of the generator. Each value should
+                be a list of per-sample items.
+
+        Returns:
+            Tensor: Output images with the shape of (N=1, T, C, H, W)
+                or (N=1, C, H, W).
+        """
+        if "unfolding" not in self.test_cfg:
+            return self.generator(lq, **kwargs)
+
+        kwargs.pop("frm_keys", None)  # flows differ among patches; no caching
+
+        _cfg = self.test_cfg["unfolding"]
+        patch_sz = _cfg["patchsize"]
+        h, w = lq.shape[-2:]
+        npatches = int(np.ceil(h / patch_sz)) * int(np.ceil(w / patch_sz))
+        splits = min(_cfg["splits"], npatches)
+
+        aux_func = None
+        if _cfg.get("precompute_flow", False):
+            if not hasattr(self.generator, "get_flows"):
+                raise NotImplementedError(
+                    f'"{type(self.generator).__name__}" does not support'
+                    " pre-computed flows."
+                )
+            aux_func = self.generator.get_flows
+
+        def _forward(tiles, *flows):
+            ntimes = len(tiles) // len(lq)  # repeat per-sample arguments
+            _kwargs = {k: v * ntimes for k, v in kwargs.items()}
+            if flows:
+                _kwargs["flows"] = flows
+            return self.generator(tiles, **_kwargs)
+
+        return tiled_forward(
+            _forward,
+            lq,
+            patch_sz,
+            overlap=_cfg.get("overlap", 0),
+            blending=_cfg.get("blending", "crop"),
+            tile_batch=npatches // splits,
+            aux_func=aux_func,
+        )
+
+    def get_qp_action(self, meta):
+        """Decide how to enhance the center frame by its QP.
+
+        High-quality frames, i.e., with low QPs, can be skipped or enhanced
+        cheaply, while full compute is spent on low-quality frames. QPs are
+        read from the HM index of each LQ sequence; see build_hm_index.
+        test_cfg.qp_policy is a dict contains:
+            skip_qp (int): Center frames with QP <= skip_qp are not enhanced,
+                i.e., the LQ center frame is output. Default: None.
+            light_qp (int): Center frames with QP <= light_qp are enhanced
+                with light_cfg. Default: None.
+            light_cfg (dict): Attributes of the generator for a cheaper
+                forward, e.g., dict(flow_scale=0.25). Default: None.
+            index_name (str): File name of the HM index in each LQ sequence
+                folder. Default: "hm_index.json".
+
+        The policy requires center_gt to be True and lq_path in meta_keys of
+        the Collect transform.
+
+        Args:
+            meta (list): Meta information of samples.
+
+        Returns:
+            str: "skip", "light" or "full".
+        """
+        if "qp_policy" not in self.test_cfg:
+            return "full"
+        if not self.center_gt:
+            raise ValueError('"qp_policy" requires "center_gt" to be True.')
+
+        _cfg = self.test_cfg["qp_policy"]
+        lq_paths = meta[0]["lq_path"]
+        qp = get_frame_info(
+            lq_paths[len(lq_paths) // 2], _cfg.get("index_name", HM_INDEX_NAME)
+        )["qp"]
+        if (_cfg.get("skip_qp") is not None) and qp <= _cfg["skip_qp"]:
+            return "skip"
+        if (_cfg.get("light_qp") is not None) and qp <= _cfg["light_qp"]:
+            return "light"
+        return "full"
+
     def forward_test(
         self,
         lq,
@@ -323,6 +729,11 @@ class BasicVQERestorer(BasicRestorer):
         For image saving, meta_keys of Collect transform should contains
         key.
 
+        Chunking and unfolding are supported. See forward_generator.
+
+        Center frames can be skipped or enhanced cheaply by their QPs. See
+        get_qp_action.
+
         Args:
             lq (Tensor): LQ images with the shape of (N=1, T, C, H, W)
             gt (Tensor): GT images with the shape of (N=1, T!=1, C, H, W)
@@ -355,11 +766,6 @@ class BasicVQERestorer(BasicRestorer):
             " (2) evaluate image metrics."
         )
 
-        if "unfolding" in self.test_cfg:
-            raise NotImplementedError(
-                "Unfolding is not supported yet for video tensor."
-            )
-
         nfrms = lq.shape[1]
         if self.center_gt and (nfrms % 2 == 0):
             raise ValueError(
@@ -370,26 +776,49 @@ class BasicVQERestorer(BasicRestorer):
             "metrics" in self.test_cfg
         ), 'metrics should be provided in "test_cfg" for evaluation.'
 
-        # Inference
-        if "padding" in self.test_cfg:
-            _cfg = self.test_cfg["padding"]
-            _tensors = []
-            _pad_info = ()
-            for it in range(nfrms):
-                _lq_it, pad_info = pad_img_min_sz(lq[:, it, ...], _cfg["minSize"])
-                _tensors.append(_lq_it)
-                if _pad_info:
-                    assert pad_info == _pad_info
-                else:
-                    _pad_info = pad_info
-            _lq = torch.stack(_tensors, dim=1)
-            output = self.generator(_lq)
-            _tensors = []
-            for it in range(nfrms):
-                _tensors.append(crop_img(output[:, it, ...], pad_info))
-            output = torch.stack(_tensors, dim=1)
-        else:
-            output = self.generator(lq)
+        # Frame keys for the flow cache of the generator (if any)
+        kwargs = dict()
+        if (getattr(self.generator, "flow_cache", None) is not None) and all(
+            "lq_path" in m for m in (meta or [dict()])
+        ):
+            kwargs["frm_keys"] = [m["lq_path"] for m in meta]
+
+        # Switch the generator to the cheaper setting if required
+        # Restore the setting even if the inference fails
+        action = self.get_qp_action(meta)
+        attrs_full = dict()
+        try:
+            if action == "light":
+                light_cfg = self.test_cfg["qp_policy"].get("light_cfg") or dict()
+                for k, v in light_cfg.items():
+                    attrs_full[k] = getattr(self.generator, k)
+                    setattr(self.generator, k, v)
+
+            # Inference
+            if action == "skip":
+                output = lq[:, nfrms // 2, ...]  # (N=1, C, H, W)
+            elif "padding" in self.test_cfg:
+                _cfg = self.test_cfg["padding"]
+                _tensors = []
+                _pad_info = ()
+                for it in range(nfrms):
+                    _lq_it, pad_info = pad_img_min_sz(lq[:, it, ...], _cfg["minSize"])
+                    _tensors.append(_lq_it)
+                    if _pad_info:
+                        assert pad_info == _pad_info
+                    else:
+                        _pad_info = pad_info
+                _lq = torch.stack(_tensors, dim=1)
+                output = self.forward_generator(_lq, **kwargs)
+                _tensors = []
+                for it in range(nfrms):
+                    _tensors.append(crop_img(output[:, it, ...], pad_info))
+                output = torch.stack(_tensors, dim=1)
+            else:
+                output = self.forward_generator(lq, **kwargs)
+        finally:
+            for k, v in attrs_full.items():
+                setattr(self.generator, k, v)
 
         # Squeeze dim B
         gt = gt.squeeze(0)  # (T, C, H, W) or (C, H, W)
@@ -43,13 +43,14 @@ class ProVQERestorer(BasicVQERestorer):
     """
 
     @auto_fp16(apply_to=("lq"))
-    def forward(self, lq, gt=None, test_mode=False, meta=None, **kwargs):
+    def forward(self, lq, gt=None, test_mode=False, meta=None, flows=None, **kwargs):
         """Forward function.
 
         Args:
             lq (Tensor): Input lq images.
             gt (Tensor): Ground-truth image. Default: None.
             test_mode (bool): Whether in test mode or not. Default: False.
+            flows (Tensor): Pre-computed flows for training. Default: None.
             kwargs (dict): Other arguments.
         """
         key_frms = [m["key_frms"] for m in meta]
@@ -59,21 +60,28 @@ class ProVQERestorer(BasicVQERestorer):
                 lq=lq, gt=gt, key_frms=key_frms, meta=meta, **kwargs
             )
 
-        return self.forward_train(lq=lq, gt=gt, key_frms=key_frms)
+        return self.forward_train(lq=lq, gt=gt, key_frms=key_frms, flows=flows)
 
-    def forward_train(self, lq, gt, key_frms):
+    def forward_train(self, lq, gt, key_frms, flows=None):
         """Training forward function.
 
+        Pre-computed flows are used only when SPyNet is fixed. See
+        BasicVQERestorer.use_precomputed_flows.
+
         Args:
             lq (Tensor): LQ Tensor with shape (n, c, h, w).
             gt (Tensor): GT Tensor with shape (n, c, h, w).
             key_frms (list[list[int]]): Key-frame annotation of samples.
+            flows (Tensor): Pre-computed flows. Default: None.
 
         Returns:
             Tensor: Output tensor.
         """
         losses = dict()
-        output = self.generator(lq, key_frms)
+        if self.use_precomputed_flows(flows):
+            output = self.generator(lq, key_frms, flows=flows)
+        else:
+            output = self.generator(lq, key_frms)
         loss_pix = self.pixel_loss(output, gt)
         losses["loss_pix"] = loss_pix
         outputs = dict(
@@ -99,6 +107,8 @@ class ProVQERestorer(BasicVQERestorer):
         For image saving, meta_keys of the transform Collect should contains
         key.
 
+        Chunking and unfolding are supported. See forward_generator.
+
         Args:
             lq (Tensor): LQ images with the shape of (N=1, T, C, H, W)
             gt (Tensor): GT images with the shape of (N=1, T!=1, C, H, W)
@@ -132,11 +142,6 @@ class ProVQERestorer(BasicVQERestorer):
             " (2) evaluate image metrics."
         )
 
-        if "unfolding" in self.test_cfg:
-            raise NotImplementedError(
-                "Unfolding is not supported yet for video tensor."
-            )
-
         nfrms = lq.shape[1]
         if self.center_gt and (nfrms % 2 == 0):
             raise ValueError(
@@ -160,13 +165,13 @@ class ProVQERestorer(BasicVQERestorer):
                 else:
                     _pad_info = pad_info
             _lq = torch.stack(_tensors, dim=1)
-            output = self.generator(_lq, key_frms)
+            output = self.forward_generator(_lq, key_frms=key_frms)
             _tensors = []
             for it in range(nfrms):
                 _tensors.append(crop_img(output[:, it, ...], pad_info))
             output = torch.stack(_tensors, dim=1)
         else:
-            output = self.generator(lq, key_frms)
+            output = self.forward_generator(lq, key_frms=key_frms)
 
         # Squeeze dim B
         gt = gt.squeeze(0)  # (T, C, H, W) or (C, H, W)
@@ -0,0 +1,224 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+class FeatureStore:
+    """Store of per-frame features for recurrent propagation.
+
+    Features are put once and got by keys. Three backends are supported:
+        memory: Features are kept as they are, e.g., in GPU memory.
+        host: Features are kept in host RAM. Once max_host_size is reached,
+            the rest are spilled to a memory-mapped file.
+        mmap: Features are kept in a memory-mapped file on the local disk.
+
+    For host and mmap, features are detached and loaded back to the device
+    where they were put, i.e., for inference. A background thread can load
+    features before they are needed. See prefetch.
+
+    All features in the memory-mapped file should have the same size.
+
+    Args:
+        backend (str): "memory", "host" or "mmap". Default: "memory".
+        max_host_size (float | None): Cap (MiB) of host RAM for the host
+            backend. None for no cap. Default: None.
+        mmap_dir (str | None): Folder of the memory-mapped file. None for the
+            default temporary folder. Default: None.
+        prefetch_depth (int): Number of steps to prefetch ahead of use.
+            Default: 2.
+    """
+
+    BACKENDS = ["memory", "host", "mmap"]
+
+    def __init__(
+        self, backend="memory", max_host_size=None, mmap_dir=None, prefetch_depth=2
+    ):
+        if backend not in self.BACKENDS:
+            raise ValueError(
+                f'"backend" should be in "{self.BACKENDS}"; received "{backend}".'
+            )
+        self.backend = backend
+        if backend == "mmap":
+            self.max_host_bytes = 0
+        elif max_host_size is None:
+            self.max_host_bytes = float("inf")
+        else:
+            self.max_host_bytes = int(max_host_size * 1024**2)
+        self.mmap_dir = mmap_dir
+        self.prefetch_depth = prefetch_depth
+
+        self.host_bytes = 0
+        self._items = dict()  # key -> (place, payload, device, dtype, shape)
+        self._next_key = 0
+        self._futures = dict()
+        self._executor = None
+
+        self._mmap = None
+        self._mmap_path = None
+        self._slot_bytes = None
+        self._free_slots = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, tensor):
+        """Put a feature and return its key."""
+        key = self._next_key
+        self._next_key += 1
+        nbytes = tensor.numel() * tensor.element_size()
+
+        if self.backend == "memory":
+            place, payload = "memory", tensor
+        elif self.host_bytes + nbytes <= self.max_host_bytes:
+            payload = torch.empty(
+                tensor.shape,
+                dtype=tensor.dtype,
+                pin_memory=tensor.is_cuda,  # for asynchronous loading
+            )
+            payload.copy_(tensor.detach())
+            place = "host"
+            self.host_bytes += nbytes
+        else:
+            place, payload = "disk", self._write_slot(tensor)
+
+        self._items[key] = (place, payload, tensor.device, tensor.dtype, tensor.shape)
+        return key
+
+    def get(self, key):
+        """Get a feature on the device where it was put."""
+        if key in self._futures:
+            return self._futures.pop(key).result()
+        return self._load(key)
+
+    def prefetch(self, keys):
+        """Load features in the background thread ahead of use."""
+        for key in keys:
+            if (key in self._futures) or (self._items[key][0] == "memory"):
+                continue
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._futures[key] = self._executor.submit(self._load, key)
+
+    def delete(self, key):
+        """Delete a feature."""
+        self._futures.pop(key, None)
+        place, payload = self._items.pop(key)[:2]
+        if place == "host":
+            self.host_bytes -= payload.numel() * payload.element_size()
+        elif place == "disk":
+            self._free_slots.append(payload)
+
+    def close(self):
+        """Delete all features and the memory-mapped file."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._futures.clear()
+        self._items.clear()
+        self.host_bytes = 0
+        if self._mmap is not None:
+            del self._mmap
+            self._mmap = None
+            os.remove(self._mmap_path)
+        self._slot_bytes = None
+        self._free_slots = []
+
+    def _load(self, key):
+        place, payload, device, dtype, shape = self._items[key]
+        if place == "memory":
+            return payload
+        if place == "disk":
+            payload = torch.from_numpy(np.array(self._mmap[payload]))
+            payload = payload.view(dtype).view(shape)
+            if device.type == "cuda":
+                payload = payload.pin_memory()
+        return payload.to(device, non_blocking=True)
+
+    def _write_slot(self, tensor):
+        data = tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+        if self._slot_bytes is None:
+            self._slot_bytes = data.size
+            fd, self._mmap_path = tempfile.mkstemp(suffix=".mmap", dir=self.mmap_dir)
+            os.close(fd)
+            self._grow(16)
+        elif data.size != self._slot_bytes:
+            raise ValueError(
+                "Features in the memory-mapped file should have the same size;"
+                f' received "{data.size}" and "{self._slot_bytes}" bytes.'
+            )
+        if not self._free_slots:
+            self._grow(2 * len(self._mmap))
+        slot = self._free_slots.pop()
+        self._mmap[slot] = data
+        return slot
+
+    def _grow(self, nslots):
+        nslots_old = 0 if self._mmap is None else len(self._mmap)
+        if self._mmap is not None:
+            self._mmap.flush()
+        with open(self._mmap_path, "r+b") as f:
+            f.truncate(nslots * self._slot_bytes)
+        self._mmap = np.memmap(
+            self._mmap_path, dtype=np.uint8, mode="r+", shape=(nslots, self._slot_bytes)
+        )
+        self._free_slots.extend(range(nslots - 1, nslots_old - 1, -1))
+
+
+class FeatureList:
+    """List-like view of features in a FeatureStore.
+
+    Support indexing, slicing, len, append and pop, as used by the propagation
+    and the upsampling of BasicVSR++.
+
+    Args:
+        store (FeatureStore): Feature store.
+        keys (list[int]): Keys of the features. Default: None.
+    """
+
+    def __init__(self, store, keys=None):
+        self.store = store
+        self.keys = [] if keys is None else keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return FeatureList(self.store, self.keys[idx])
+        return self.store.get(self.keys[idx])
+
+    def __iter__(self):
+        for key in self.keys:
+            yield self.store.get(key)
+
+    def append(self, tensor):
+        self.keys.append(self.store.put(tensor))
+
+    def pop(self, idx=-1):
+        key = self.keys.pop(idx)
+        tensor = self.store.get(key)
+        self.store.delete(key)
+        if idx == 0:  # consumed in order, e.g., by upsampling
+            self.store.prefetch(self.keys[: self.store.prefetch_depth])
+        return tensor
+
+    def prefetch(self, idxs):
+        """Load features of the indexes in the background."""
+        self.store.prefetch([self.keys[idx] for idx in idxs])
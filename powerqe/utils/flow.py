@@ -0,0 +1,71 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import torch.nn.functional as nn_func
+
+FLOW_SCALES = [1, 0.5, 0.25]
+
+
+def check_flow_scale(flow_scale):
+    """Check whether the flow scale is supported."""
+    if flow_scale not in FLOW_SCALES:
+        raise ValueError(
+            f'"flow_scale" should be in "{FLOW_SCALES}"; received "{flow_scale}".'
+        )
+
+
+def resize_flow(flow, size):
+    """Resize optical flows and rescale their values accordingly.
+
+    Args:
+        flow (Tensor): Flows with the shape of (N, 2, H, W). Channels are
+            (dx, dy).
+        size (tuple[int]): Target (H', W').
+
+    Returns:
+        Tensor: Flows with the shape of (N, 2, H', W').
+    """
+    h, w = flow.shape[2:]
+    if (h, w) == tuple(size):
+        return flow
+    flow = nn_func.interpolate(flow, size=size, mode="bilinear", align_corners=False)
+    return flow * flow.new_tensor([size[1] / w, size[0] / h]).view(1, 2, 1, 1)
+
+
+def estimate_flow(spynet, ref, supp, flow_scale=1):
+    """Estimate optical flows at a reduced resolution.
+
+    The frames are downsampled by bicubic interpolation before SPyNet; the
+    flows are then upsampled to the input resolution and rescaled.
+
+    Args:
+        spynet (nn.Module): SPyNet.
+        ref (Tensor): Reference frames with the shape of (N, C, H, W).
+        supp (Tensor): Supporting frames with the shape of (N, C, H, W).
+        flow_scale (float): Scale of the resolution for SPyNet. 1, 0.5 or
+            0.25. Default: 1.
+
+    Returns:
+        Tensor: Flows from ref to supp with the shape of (N, 2, H, W).
+    """
+    if flow_scale == 1:
+        return spynet(ref, supp)
+    h, w = ref.shape[2:]
+    ref, supp = [
+        nn_func.interpolate(
+            frm, scale_factor=flow_scale, mode="bicubic", align_corners=False
+        )
+        for frm in [ref, supp]
+    ]
+    return resize_flow(spynet(ref, supp), (h, w))
@@ -0,0 +1,139 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import os.path as osp
+import re
+from functools import lru_cache
+
+HM_INDEX_NAME = "hm_index.json"
+IMG_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# e.g., "POC    0 LId:  0 TId: 0 ( I-SLICE, nQP 36 QP 36 )     288016 bits
+# [Y 40.3262 dB    U 42.7466 dB    V 43.7826 dB] ..."
+_FRAME_PATTERN = re.compile(
+    r"^POC\s+(\d+)\b.*?\(\s*([IPB])-SLICE,\s*nQP\s+-?\d+\s+QP\s+(-?\d+)\s*\)"
+    r"\s+(\d+)\s+bits(?:\s+\[Y\s+([\d.]+)\s+dB)?"
+)
+
+
+def parse_hm_log(log_path):
+    """Parse per-frame information from a log of the HM encoder.
+
+    Frames are logged in the coding order and sorted by POC here.
+
+    Args:
+        log_path (str): Path to the log, e.g., written by
+            tools/data/compress_video.py.
+
+    Returns:
+        list[dict]: Information of each frame, sorted by POC. Each dict
+            contains poc, slice_type ("I", "P" or "B"), qp, bits and psnr_y
+            (None if not logged).
+    """
+    frames = []
+    with open(log_path, "r") as f:
+        for line in f:
+            match = _FRAME_PATTERN.match(line.strip())
+            if match is None:
+                continue
+            poc, slice_type, qp, bits, psnr_y = match.groups()
+            frames.append(
+                dict(
+                    poc=int(poc),
+                    slice_type=slice_type,
+                    qp=int(qp),
+                    bits=int(bits),
+                    psnr_y=None if psnr_y is None else float(psnr_y),
+                )
+            )
+    if not frames:
+        raise ValueError(f'No frame is found in "{log_path}".')
+    return sorted(frames, key=lambda x: x["poc"])
+
+
+def find_key_frames(qps):
+    """Find key frames, i.e., frames with the lowest QP locally.
+
+    A frame is a key frame if its QP is not higher than those of its
+    neighboring frames. See "What are key frames" in the document.
+
+    Args:
+        qps (list[int]): QPs of frames.
+
+    Returns:
+        list[int]: Key-frame annotation. 1 for key frames; 0 otherwise.
+    """
+    key_frames = []
+    for idx, qp in enumerate(qps):
+        neighbors = qps[max(idx - 1, 0) : idx] + qps[idx + 1 : idx + 2]
+        key_frames.append(int(all(qp <= x for x in neighbors)))
+    return key_frames
+
+
+def build_hm_index(log_path, seq_dir, index_name=HM_INDEX_NAME):
+    """Build the quality index of a sequence from its HM log.
+
+    The index maps each frame name of the sequence to its information (see
+    parse_hm_log) and key_frame (see find_key_frames). Frames are sorted by
+    the digits in their names, same as PairedVideoDataset. The index is saved
+    as a JSON file in the sequence folder.
+
+    Args:
+        log_path (str): Path to the HM log.
+        seq_dir (str): Folder of the frames of the sequence.
+        index_name (str): File name of the index.
+            Default: "hm_index.json".
+
+    Returns:
+        dict: Index of the sequence.
+    """
+    frames = parse_hm_log(log_path)
+    names = [name for name in os.listdir(seq_dir) if name.endswith(IMG_EXTENSIONS)]
+    names = sorted(names, key=lambda x: int("".join(filter(str.isdigit, x))))
+    if len(names) != len(frames):
+        raise ValueError(
+            f'"{log_path}" has {len(frames)} frames while "{seq_dir}" has'
+            f" {len(names)} images."
+        )
+
+    key_frames = find_key_frames([frame["qp"] for frame in frames])
+    index = {
+        name: dict(frame, key_frame=key_frame)
+        for name, frame, key_frame in zip(names, frames, key_frames)
+    }
+    with open(osp.join(seq_dir, index_name), "w") as f:
+        json.dump(index, f)
+    return index
+
+
+@lru_cache(maxsize=1024)
+def load_hm_index(index_path):
+    """Load the quality index of a sequence. See build_hm_index.
+
+    Indexes are cached, so that each index is read once at run time.
+    """
+    if not osp.exists(index_path):
+        raise FileNotFoundError(
+            f'"{index_path}" is not found; build it by tools/data/build_hm_index.py.'
+        )
+    with open(index_path, "r") as f:
+        return json.load(f)
+
+
+def get_frame_info(frm_path, index_name=HM_INDEX_NAME):
+    """Get the information of a frame from the index of its sequence."""
+    index = load_hm_index(osp.join(osp.dirname(frm_path), index_name))
+    return index[osp.basename(frm_path)]
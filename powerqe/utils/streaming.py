@@ -0,0 +1,346 @@
+"""Copyright 2023 RyanXingQL.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict, deque
+
+import torch
+import torch.nn.functional as nn_func
+from mmedit.models.common import flow_warp
+
+from .flow import estimate_flow
+
+
+def stream_windows(windows, load_func, window_func):
+    """Sliding-window inference that walks a sequence once.
+
+    Per-frame work (e.g., image loading and feature extraction) is done once
+    per frame when the frame enters the first window that needs it.
+    The result is kept in a buffer and evicted after the last window that
+    needs it. Thus, the buffer holds only the frames spanned by the current
+    window.
+
+    Args:
+        windows (list[list[int]]): Frame indexes of each window in the order of
+            inference.
+        load_func (callable): Per-frame work. Take a frame index and return
+            the per-frame entry.
+        window_func (callable): Per-window work. Take a list of per-frame
+            entries and return the window output.
+
+    Yields:
+        Output of each window.
+    """
+    idxs_last_win = dict()  # frame index -> index of the last window
+    for idx_win, idxs in enumerate(windows):
+        for idx in idxs:
+            idxs_last_win[idx] = idx_win
+
+    buffer = dict()  # frame index -> per-frame entry
+    for idx_win, idxs in enumerate(windows):
+        for idx in idxs:
+            if idx not in buffer:
+                buffer[idx] = load_func(idx)
+
+        yield window_func([buffer[idx] for idx in idxs])
+
+        for idx in set(idxs):
+            if idxs_last_win[idx] == idx_win:
+                del buffer[idx]
+
+
+class TensorLRUCache:
+    """LRU cache of tensors with a memory cap.
+
+    The least recently used tensors are evicted once the total size exceeds
+    the cap. Tensors are detached and copied, so that they do not keep the
+    graph or the storage of a larger batch alive.
+
+    Args:
+        max_bytes (int): Memory cap in bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.nhits = 0
+        self.nmisses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """Get a tensor. Return None if not cached."""
+        if key not in self._items:
+            self.nmisses += 1
+            return None
+        self.nhits += 1
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, tensor):
+        """Cache a tensor."""
+        if key in self._items:
+            self.nbytes -= self._nbytes(self._items.pop(key))
+        tensor = tensor.detach().clone()
+        nbytes = self._nbytes(tensor)
+        if nbytes > self.max_bytes:
+            return
+        self._items[key] = tensor
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, _tensor = self._items.popitem(last=False)
+            self.nbytes -= self._nbytes(_tensor)
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+    @staticmethod
+    def _nbytes(tensor):
+        return tensor.numel() * tensor.element_size()
+
+
+class StreamingSession:
+    """Causal streaming inference of BasicVSR++-family models.
+
+    Frames are pushed one at a time, and frame t is output once frame
+    t + delay is pushed, i.e., with a fixed delay of "delay" frames.
+
+    Backward branches run over the look-ahead window [t, t + delay] from zero
+    states, i.e., the backward propagation is truncated after "delay" future
+    frames. Forward branches carry their states across calls. Thus, the
+    memory and the per-frame cost are bounded by the delay rather than the
+    clip length. The output equals the offline one if the delay is at least
+    the clip length minus one.
+
+    Key frames of ProVQE are given per frame. BasicVSR++ takes every frame as
+    a key frame, which reduces to its second-order propagation.
+
+    Args:
+        generator (nn.Module): BasicVSRPlusPlus or ProVQE. Mirror extension is
+            not supported.
+        delay (int): Number of look-ahead frames.
+    """
+
+    BRANCHES = ["backward_1", "forward_1", "backward_2", "forward_2"]
+
+    def __init__(self, generator, delay):
+        if delay < 0:
+            raise ValueError(f'"delay" should be non-negative; received "{delay}".')
+        self.generator = generator
+        self.delay = delay
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        self.entries = deque()  # pushed frames not yet output
+        self.states = {
+            module_name: self._init_state()
+            for module_name in self.BRANCHES
+            if "forward" in module_name
+        }
+        self._lq_down_last = None
+
+    def push(self, lq, is_key=True):
+        """Push a frame.
+
+        Args:
+            lq (Tensor): LQ frame with the shape of (N, C, H, W).
+            is_key (bool): Whether the frame is a key frame. Default: True.
+
+        Returns:
+            Tensor | None: Output of the frame pushed "delay" frames ago with
+                the shape of (N, C, H', W'). None if there is no such frame.
+        """
+        generator = self.generator
+        generator.cpu_cache = False
+
+        n, _, h, w = lq.shape
+        if generator.is_low_res_input:
+            lq_down = lq
+        else:
+            lq_down = nn_func.interpolate(lq, scale_factor=0.25, mode="bicubic")
+        if lq_down.size(2) < 64 or lq_down.size(3) < 64:
+            raise ValueError(
+                "The height and width of LR inputs must be at least 64;"
+                f' received "{h}" and "{w}".'
+            )
+
+        entry = dict(
+            lq=lq,
+            feat=generator.feat_extract(lq),
+            is_key=is_key,
+            flow_forward=None,  # flow from this frame to the last frame
+            flow_backward=None,  # flow from this frame to the next frame
+        )
+        flow_scale = getattr(generator, "flow_scale", 1)
+        if self._lq_down_last is not None:
+            if self.entries:  # the last frame is waiting for backward branches
+                flows = estimate_flow(
+                    generator.spynet,
+                    torch.cat([lq_down, self._lq_down_last], dim=0),
+                    torch.cat([self._lq_down_last, lq_down], dim=0),
+                    flow_scale,
+                )
+                entry["flow_forward"] = flows[:n]
+                self.entries[-1]["flow_backward"] = flows[n:]
+            else:
+                entry["flow_forward"] = estimate_flow(
+                    generator.spynet, lq_down, self._lq_down_last, flow_scale
+                )
+        self._lq_down_last = lq_down
+        self.entries.append(entry)
+
+        if len(self.entries) > self.delay:
+            return self._output()
+        return None
+
+    def flush(self):
+        """Output the remaining frames at the end of the stream.
+
+        The session is reset for a new stream afterwards.
+
+        Returns:
+            list[Tensor]: Outputs of the remaining frames.
+        """
+        outputs = []
+        while self.entries:
+            outputs.append(self._output())
+        self.reset()
+        return outputs
+
+    def _output(self):
+        """Output the first frame of the look-ahead window."""
+        window = list(self.entries)
+        feats = dict(spatial=[entry["feat"] for entry in window])
+        for module_name in self.BRANCHES:
+            if "backward" in module_name:
+                idxs = range(len(window) - 1, -1, -1)
+                flow_name = "flow_backward"
+                state = self._init_state()
+            else:
+                # forward_2 of the first frame is all needed
+                idxs = range(len(window) if module_name == "forward_1" else 1)
+                flow_name = "flow_forward"
+                state = self.states[module_name]
+
+            feats_branch = dict()
+            for idx in idxs:
+                state = self._step(
+                    module_name,
+                    [feats[k][idx] for k in feats],
+                    window[idx][flow_name],
+                    window[idx]["is_key"],
+                    state,
+                )
+                feats_branch[idx] = state["feat_prop"]
+                if idx == 0 and "forward" in module_name:
+                    self.states[module_name] = state  # carried to the next call
+            feats[module_name] = [feats_branch[idx] for idx in sorted(feats_branch)]
+
+        output = self.generator.upsample(
+            window[0]["lq"].unsqueeze(1), {k: [v[0]] for k, v in feats.items()}
+        )
+        self.entries.popleft()
+        return output[:, 0]
+
+    @staticmethod
+    def _init_state():
+        return dict(
+            npos=0,  # number of propagated frames
+            feat_prop=None,  # feature of the last frame
+            feat_prev=None,  # feature of the frame before the last frame
+            is_key_prop=False,
+            is_key_prev=False,
+            flow_prev=None,  # flow from the last frame to its previous frame
+            feat_key=None,
+            pos_key=None,  # the latest key frame before the last frame
+            flow_key=None,  # flow from the last frame to its key frame
+            pos_key_last=None,
+        )
+
+    def _step(self, module_name, feats_current, flow_n1, is_key, state):
+        """Propagate one frame. See ProVQE.propagate.
+
+        Args:
+            module_name (str): Name of the propagation branch.
+            feats_current (list[Tensor]): Spatial feature and features of the
+                previous branches of the current frame.
+            flow_n1 (Tensor | None): Flow from the current frame to the last
+                frame. None for the first frame.
+            is_key (bool): Whether the current frame is a key frame.
+            state (dict): State after the last frame.
+
+        Returns:
+            dict: State after the current frame.
+        """
+        generator = self.generator
+        state = dict(state)
+        npos = state["npos"]
+        feat_prop = state["feat_prop"]
+
+        if npos == 0:
+            feat_current = feats_current[0]
+            feat_prop = feat_current.new_zeros(
+                feat_current.size(0), generator.mid_channels, *feat_current.shape[2:]
+            )
+        else:
+            cond_n1 = flow_warp(feat_prop, flow_n1.permute(0, 2, 3, 1))
+
+            # initialize second-order features
+            # being zeros if not replaced
+            feat_n2 = torch.zeros_like(feat_prop)
+            flow_n2 = torch.zeros_like(flow_n1)
+            cond_n2 = torch.zeros_like(cond_n1)
+
+            if npos > 1:  # has at least two previous frames
+                if state["is_key_prev"]:
+                    state["feat_key"] = state["feat_prev"]
+                    state["pos_key"] = npos - 2
+                if state["pos_key"] is None:  # no key frame
+                    pos_key = npos - 2
+                    feat_n2 = state["feat_prev"]
+                else:
+                    pos_key = state["pos_key"]
+                    feat_n2 = state["feat_key"]
+
+                if (state["flow_key"] is not None) and (
+                    pos_key == state["pos_key_last"]
+                ):
+                    flow_base = state["flow_key"]
+                else:
+                    flow_base = state["flow_prev"]
+                flow_n2 = flow_n1 + flow_warp(flow_base, flow_n1.permute(0, 2, 3, 1))
+                state["flow_key"] = flow_n2
+                state["pos_key_last"] = pos_key
+                cond_n2 = flow_warp(feat_n2, flow_n2.permute(0, 2, 3, 1))
+            state["flow_prev"] = flow_n1
+
+            # flow-guided deformable convolution
+            cond = torch.cat([cond_n1, feats_current[0], cond_n2], dim=1)
+            feat_prop = torch.cat([feat_prop, feat_n2], dim=1)
+            feat_prop = generator.deform_align[module_name](
+                feat_prop, cond, flow_n1, flow_n2
+            )
+
+        feat = torch.cat(feats_current + [feat_prop], dim=1)
+        feat_prop = feat_prop + generator.backbone[module_name](feat)
+
+        state["feat_prev"] = state["feat_prop"]
+        state["is_key_prev"] = state["is_key_prop"]
+        state["feat_prop"] = feat_prop
+        state["is_key_prop"] = is_key
+        state["npos"] = npos + 1
+        return state
@@ -12,7 +12,10 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import weakref
+
 import numpy as np
+import torch
 import torch.nn.functional as nn_func
 
 
@@ -133,6 +136,272 @@ def combine_patches(patches, unfold_shape):
     return img
 
 
+def get_feather_weight(tile_sz, overlap, device=None, dtype=None):
+    """Feathering weight of an overlapping patch.
+
+    The weight ramps up linearly across the overlapping region (2*OL) at each
+    side. Weights of two neighboring patches sum up to one in their
+    overlapping region.
+
+    Args:
+        tile_sz (int): Patch size with halo, i.e., PS+2*OL.
+        overlap (int): Halo size.
+        device (torch.device): Device of the weight. Default: None.
+        dtype (torch.dtype): Dtype of the weight. Default: None.
+
+    Returns:
+        Tensor: Weight with the shape of (PS+2*OL, PS+2*OL).
+    """
+    idxs = torch.arange(tile_sz, device=device, dtype=dtype) + 0.5
+    weight = torch.minimum(idxs, tile_sz - idxs) / (2 * overlap)
+    weight = weight.clamp(max=1)
+    return weight[:, None] * weight[None, :]
+
+
+def tiled_forward(
+    net, img, patch_sz, overlap=0, blending="crop", tile_batch=1, aux_func=None
+):
+    """Patch-based inference with a streaming tile scheduler.
+
+    The image is padded to be divisible by the patch size. Each patch of the
+    size PS is extended by a halo of the size OL on all sides; image borders
+    are extended by reflection. Tiles are gathered lazily in groups, processed
+    by the network group by group, and written directly into a preallocated
+    output canvas. Thus, the peak memory is bounded by one group of tiles
+    instead of all patches of the image.
+
+    Video is tiled only spatially, i.e., each tile covers all frames.
+
+    Args:
+        net (nn.Module | callable): Network with the input and output of the
+            same size.
+        img (Tensor): Image with the shape of (N, C, H, W) or video with the
+            shape of (N, T, C, H, W).
+        patch_sz (int): Patch size (without halo).
+        overlap (int): Halo size. Default: 0.
+        blending (str): How to reassemble the overlapping tiles.
+            "crop": Keep only the center PS*PS region of each tile.
+                The result is seamless if the halo is no smaller than the
+                receptive-field radius of the network.
+            "feather": Blend neighboring tiles with linear weights in their
+                overlapping region. Seams are hidden when the halo is smaller
+                than the receptive-field radius.
+            Default: "crop".
+        tile_batch (int): Number of tiles per forward. Default: 1.
+        aux_func (callable): Function that computes auxiliary tensors, e.g.,
+            optical flows, from the padded image once. The auxiliary tensors
+            are cropped per tile and fed to the network after the tiles.
+            Their spatial size can be the image size divided by an integer
+            factor, which should also divide PS and OL.
+            Default: None.
+
+    Returns:
+        Tensor: Output image with the shape of (N, C', H, W) or output video
+            with the shape of (N, T', C', H, W).
+    """
+    supported_blendings = ["crop", "feather"]
+    if blending not in supported_blendings:
+        raise NotImplementedError(
+            f'Blending should be in "{supported_blendings}"; received "{blending}".'
+        )
+    if_feather = blending == "feather" and overlap > 0
+
+    # Padding supports only (N, C, H, W) tensors
+    img_pad, pad_info = pad_img_sz_mul(img.reshape(-1, *img.shape[-3:]), patch_sz)
+    h_pad, w_pad = img_pad.shape[-2:]
+    if overlap > 0:
+        mode = "reflect" if overlap < min(h_pad, w_pad) else "replicate"
+        img_pad = nn_func.pad(img_pad, (overlap, overlap, overlap, overlap), mode=mode)
+    img_pad = img_pad.view(*img.shape[:-2], *img_pad.shape[-2:])
+
+    auxs = aux_func(img_pad) if aux_func is not None else ()
+    aux_scales = []
+    for aux in auxs:
+        if aux is None:
+            aux_scales.append(None)
+            continue
+        scale = img_pad.shape[-1] // aux.shape[-1]
+        if (
+            (aux.shape[-2] * scale != img_pad.shape[-2])
+            or (aux.shape[-1] * scale != img_pad.shape[-1])
+            or (patch_sz % scale != 0)
+            or (overlap % scale != 0)
+        ):
+            raise ValueError(
+                f"The auxiliary tensor ({aux.shape[-2]}x{aux.shape[-1]}) cannot"
+                f" be tiled with the patch size ({patch_sz}) and the halo size"
+                f" ({overlap})."
+            )
+        aux_scales.append(scale)
+
+    b = img.shape[0]
+    tile_sz = patch_sz + 2 * overlap
+    starts = [
+        (start_h, start_w)
+        for start_h in range(0, h_pad, patch_sz)
+        for start_w in range(0, w_pad, patch_sz)
+    ]  # in the halo-padded image
+
+    canvas = None
+    if if_feather:
+        weight = get_feather_weight(
+            tile_sz, overlap, device=img.device, dtype=img.dtype
+        )
+        weight_sum = img.new_zeros(1, 1, h_pad + 2 * overlap, w_pad + 2 * overlap)
+    for idx in range(0, len(starts), tile_batch):
+        starts_group = starts[idx : (idx + tile_batch)]
+        tiles = torch.cat(
+            [
+                img_pad[
+                    ..., start_h : (start_h + tile_sz), start_w : (start_w + tile_sz)
+                ]
+                for start_h, start_w in starts_group
+            ],
+            dim=0,
+        )  # (ntiles*B, (T,) C, PS+2*OL, PS+2*OL)
+        aux_tiles = [
+            (
+                None
+                if aux is None
+                else torch.cat(
+                    [
+                        aux[
+                            ...,
+                            (start_h // scale) : ((start_h + tile_sz) // scale),
+                            (start_w // scale) : ((start_w + tile_sz) // scale),
+                        ]
+                        for start_h, start_w in starts_group
+                    ],
+                    dim=0,
+                )
+            )
+            for aux, scale in zip(auxs, aux_scales)
+        ]
+        outs = net(tiles, *aux_tiles)
+        outs = outs.reshape(len(starts_group), b, *outs.shape[1:])
+
+        if canvas is None:  # channels of the output are known now
+            if if_feather:
+                canvas = outs.new_zeros(
+                    b, *outs.shape[2:-2], h_pad + 2 * overlap, w_pad + 2 * overlap
+                )
+            else:
+                canvas = outs.new_zeros(b, *outs.shape[2:-2], h_pad, w_pad)
+
+        for (start_h, start_w), out in zip(starts_group, outs):
+            if if_feather:
+                canvas[
+                    ..., start_h : (start_h + tile_sz), start_w : (start_w + tile_sz)
+                ] += (out * weight)
+                weight_sum[
+                    ..., start_h : (start_h + tile_sz), start_w : (start_w + tile_sz)
+                ] += weight
+            else:
+                canvas[
+                    ..., start_h : (start_h + patch_sz), start_w : (start_w + patch_sz)
+                ] = out[
+                    ..., overlap : (overlap + patch_sz), overlap : (overlap + patch_sz)
+                ]
+        del tiles, aux_tiles, outs
+
+    if if_feather:
+        canvas.div_(weight_sum)
+        canvas = canvas[..., overlap:-overlap, overlap:-overlap]
+    return crop_img(canvas, pad_info)
+
+
+def estimate_receptive_field(net, nc, probe_sz=128, device=None):
+    """Estimate the receptive-field radius of a network.
+
+    The gradient of the center output pixel w.r.t. a random input is computed.
+    The radius is the largest distance from the center to an input pixel with
+    a non-zero gradient.
+
+    Args:
+        net (nn.Module): Network with the input and output of the same size.
+        nc (int): Number of input channels.
+        probe_sz (int): Height and width of the probing input.
+            The radius is at most probe_sz // 2. Default: 128.
+        device (torch.device): Device of the probing input. Default: None.
+
+    Returns:
+        int: Receptive-field radius.
+    """
+    center = probe_sz // 2
+    with torch.enable_grad():
+        x = torch.rand(1, nc, probe_sz, probe_sz, device=device, requires_grad=True)
+        out = net(x)
+        (grad,) = torch.autograd.grad(out[..., center, center].sum(), x)
+    grad = grad.abs().sum(dim=(0, 1))
+    idxs_h = torch.nonzero(grad.sum(dim=1)).flatten()
+    idxs_w = torch.nonzero(grad.sum(dim=0)).flatten()
+    if len(idxs_h) == 0:  # e.g., constant output
+        return 0
+    radius = max(
+        center - int(idxs_h[0]),
+        int(idxs_h[-1]) - center,
+        center - int(idxs_w[0]),
+        int(idxs_w[-1]) - center,
+    )
+    return radius
+
+
+def measure_peak_memory(net, x):
+    """Measure the peak memory of a forward pass in bytes.
+
+    On CUDA, the peak memory is measured by the caching allocator.
+    On other devices, it is estimated by tracking the outputs of leaf modules
+    that are still alive. Intermediate buffers inside functional calls and
+    the overhead of the allocator are ignored, so the estimate is only a lower
+    bound and should not be used as a memory budget.
+
+    The input is counted; the parameters are not.
+
+    Args:
+        net (nn.Module): Network.
+        x (Tensor): Input of the network.
+
+    Returns:
+        int: Peak memory in bytes.
+    """
+    nbytes_in = x.numel() * x.element_size()
+
+    if x.device.type == "cuda":
+        torch.cuda.synchronize(x.device)
+        torch.cuda.reset_peak_memory_stats(x.device)
+        nbytes_base = torch.cuda.memory_allocated(x.device)
+        net(x)
+        torch.cuda.synchronize(x.device)
+        return torch.cuda.max_memory_allocated(x.device) - nbytes_base + nbytes_in
+
+    alive = dict()  # data pointer -> (weak reference, bytes)
+    peak = [0]
+
+    def hook(module, inputs, output):
+        outs = output if isinstance(output, (tuple, list)) else [output]
+        for out in outs:
+            if torch.is_tensor(out):
+                alive[out.data_ptr()] = (
+                    weakref.ref(out),
+                    out.numel() * out.element_size(),
+                )
+        for key in [key for key, (ref, _) in alive.items() if ref() is None]:
+            alive.pop(key)
+        peak[0] = max(peak[0], sum(nbytes for _, nbytes in alive.values()))
+
+    handles = [
+        module.register_forward_hook(hook)
+        for module in net.modules()
+        if len(list(module.children())) == 0
+    ]
+    try:
+        net(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return peak[0] + nbytes_in
+
+
 def crop_img(img, pad_info):
     """Image cropping.
 
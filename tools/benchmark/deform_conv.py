@@ -0,0 +1,109 @@
+"""Benchmark the backends of modulated deformable convolutions.
+
+The mmcv op is compared with the PyTorch implementation in
+powerqe/models/backbones/deform_conv.py. For each kernel size and number of
+deformable groups, the latency of both backends and the maximum absolute
+difference of their outputs are reported. The mmcv op is skipped if it is not
+available on the device.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import time
+
+import torch
+
+from powerqe.models.backbones.deform_conv import modulated_deform_conv2d
+
+
+def measure(func, nrepeats, device):
+    """Measure the average latency of func() in millisecond."""
+    out = func()  # warm up
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(nrepeats):
+        out = func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / nrepeats * 1000, out
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the backends of modulated deformable convolutions.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--size", type=str, default="128x128", help="HxW")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--in-channels", type=int, default=64)
+    parser.add_argument("--out-channels", type=int, default=64)
+    parser.add_argument("--kernel-sizes", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--deform-groups", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument(
+        "--max-offset", type=float, default=4.0, help="offsets are in [-max, max]"
+    )
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--nrepeats", type=int, default=10)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+    h, w = [int(s) for s in args.size.split("x")]
+
+    try:
+        from mmcv.ops import modulated_deform_conv2d as mmcv_deform_conv2d
+    except ImportError:
+        mmcv_deform_conv2d = None
+
+    print(f"{'ks':>3} {'dg':>4} {'mmcv (ms)':>10} {'torch (ms)':>11} {'max diff':>10}")
+    with torch.no_grad():
+        for ks in args.kernel_sizes:
+            for dg in args.deform_groups:
+                x = torch.rand(args.batch_size, args.in_channels, h, w, device=device)
+                offset = (
+                    torch.rand(args.batch_size, dg * 2 * ks**2, h, w, device=device) * 2
+                    - 1
+                ) * args.max_offset
+                mask = torch.rand(args.batch_size, dg * ks**2, h, w, device=device)
+                weight = torch.randn(
+                    args.out_channels, args.in_channels, ks, ks, device=device
+                )
+                bias = torch.randn(args.out_channels, device=device)
+                conv_args = (weight, bias, 1, ks // 2, 1, 1, dg)
+
+                t_torch, out_torch = measure(
+                    lambda: modulated_deform_conv2d(x, offset, mask, *conv_args),
+                    args.nrepeats,
+                    device,
+                )
+
+                t_mmcv, diff = "-", "-"
+                if mmcv_deform_conv2d is not None:
+                    try:
+                        t_mmcv, out_mmcv = measure(
+                            lambda: mmcv_deform_conv2d(x, offset, mask, *conv_args),
+                            args.nrepeats,
+                            device,
+                        )
+                        t_mmcv = f"{t_mmcv:.2f}"
+                        diff = f"{(out_mmcv - out_torch).abs().max().item():.2e}"
+                    except RuntimeError:  # not compiled for the device
+                        pass
+
+                print(f"{ks:>3} {dg:>4} {t_mmcv:>10} {t_torch:>11.2f} {diff:>10}")
@@ -0,0 +1,109 @@
+"""Benchmark the flow scale of flow-guided video models.
+
+For each flow scale, the model is tested on the dataset, e.g., the MFQEv2 test
+set. The average latency per sample and the metric are reported, together
+with the metric delta to the full-resolution flows (flow scale 1).
+
+The generator should support flow_scale, e.g., MFQEv2 and ProVQE.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import time
+
+import mmcv
+import numpy as np
+import torch
+from mmcv import Config
+from mmcv.runner import load_checkpoint
+
+from powerqe.datasets import build_dataset
+from powerqe.models import build_model
+from powerqe.utils.flow import FLOW_SCALES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the flow scale of flow-guided video models.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("config", help="config file path")
+    parser.add_argument("checkpoint", help="checkpoint file")
+    parser.add_argument(
+        "--split", type=str, default="test", choices=["val", "test"], help="dataset"
+    )
+    parser.add_argument("--metric", type=str, default="PSNR")
+    parser.add_argument(
+        "--scales", type=float, nargs="+", default=FLOW_SCALES, choices=FLOW_SCALES
+    )
+    parser.add_argument("--max-samples", type=int, default=None)
+    parser.add_argument(
+        "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+
+    cfg = Config.fromfile(args.config)
+    model = build_model(cfg.model, train_cfg=None, test_cfg=cfg.test_cfg)
+    load_checkpoint(model, args.checkpoint, map_location="cpu")
+    model.to(device).eval()
+    generator = model.generator
+    if not hasattr(generator, "flow_scale"):
+        raise NotImplementedError(
+            f'"{type(generator).__name__}" does not support "flow_scale".'
+        )
+
+    dataset = build_dataset(cfg.data[args.split])
+    nsamples = len(dataset)
+    if args.max_samples is not None:
+        nsamples = min(nsamples, args.max_samples)
+
+    records = []
+    for scale in args.scales:
+        generator.flow_scale = scale
+        results = []
+        latencies = []
+        prog_bar = mmcv.ProgressBar(nsamples)
+        with torch.no_grad():
+            for idx in range(nsamples):
+                data = dataset[idx]
+                lq = data["lq"].unsqueeze(0).to(device)
+                gt = data["gt"].unsqueeze(0).to(device)
+                meta = [data["meta"].data]
+
+                if device.type == "cuda":
+                    torch.cuda.synchronize(device)
+                tic = time.perf_counter()
+                eval_result = model(lq=lq, gt=gt, meta=meta, test_mode=True)
+                if device.type == "cuda":
+                    torch.cuda.synchronize(device)
+                latencies.append((time.perf_counter() - tic) * 1000)
+                results.append(eval_result["eval_result"][args.metric])
+                prog_bar.update()
+        print("")
+        records.append(
+            dict(scale=scale, latency=np.mean(latencies), result=np.mean(results))
+        )
+
+    result_ref = {r["scale"]: r["result"] for r in records}.get(1)
+    print(f"{'scale':>6} {'latency (ms)':>13} {args.metric:>8} {'delta':>8}")
+    for r in records:
+        delta = "-" if result_ref is None else f"{r['result'] - result_ref:+.3f}"
+        print(f"{r['scale']:>6} {r['latency']:>13.2f} {r['result']:>8.3f} {delta:>8}")
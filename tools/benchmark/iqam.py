@@ -0,0 +1,176 @@
+"""Benchmark the exit decision of the IQA module (IQAM) in RBQE.
+
+The batched IQAM is compared with the block-by-block reference. For each image
+size, the latency of one exit decision and the agreement of the decisions are
+reported.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import time
+
+import torch
+import torch.nn.functional as nn_func
+
+from powerqe.models.backbones.rbqe import IQAM
+
+
+def iqam_reference(iqam, x):
+    """Block-by-block IQAM with Python loops.
+
+    Args:
+        iqam (IQAM): IQA module.
+        x (Tensor): Image with the shape of (B=1, C, H, W).
+
+    Returns:
+        bool: Whether the image quality is high enough to exit.
+    """
+    patch_sz = iqam.patch_sz
+    h, w = x.shape[2:]
+    h_cut = h // patch_sz * patch_sz
+    w_cut = w // patch_sz * patch_sz
+    x = x[0, 0, :h_cut, :w_cut]
+
+    scores_smooth = []
+    scores_textured = []
+    start_h = patch_sz // 2 - 1
+    while start_h + patch_sz <= h_cut:
+        start_w = patch_sz // 2 - 1
+        while start_w + patch_sz <= w_cut:
+            patch = x[start_h : (start_h + patch_sz), start_w : (start_w + patch_sz)]
+            start_w += patch_sz
+
+            if torch.sum(torch.abs(patch)) == 0:
+                scores_smooth.append(1.0)
+                continue
+
+            moments = iqam.cal_tchebichef_moments(patch)
+            ssm = torch.sum(moments.pow(2)) - moments[0, 0].pow(2)
+            if ssm > iqam.thr_smooth:
+                patch_blurred = iqam.gaussian_filter(
+                    patch.view(1, 1, patch_sz, patch_sz)
+                ).squeeze()
+                moments_blurred = iqam.cal_tchebichef_moments(patch_blurred)
+                similarity_matrix = (moments * moments_blurred * 2.0 + iqam.bigc) / (
+                    moments.pow(2) + moments_blurred.pow(2) + iqam.bigc
+                )
+                scores_textured.append(1 - torch.mean(similarity_matrix))
+            else:
+                sum_moments = torch.sum(torch.abs(moments))
+                strength_vertical = (
+                    torch.sum(torch.abs(moments[patch_sz - 1, :])) / sum_moments
+                    - torch.abs(moments[0, 0])
+                    + iqam.bigc
+                )
+                strength_horizontal = (
+                    torch.sum(torch.abs(moments[:, patch_sz - 1])) / sum_moments
+                    - torch.abs(moments[0, 0])
+                    + iqam.bigc
+                )
+                strength_vertical = min(strength_vertical, iqam.thr_jnd)
+                strength_horizontal = min(strength_horizontal, iqam.thr_jnd)
+                scores_smooth.append(
+                    torch.log(1 - ((strength_vertical + strength_horizontal) / 2))
+                    / torch.log(1 - iqam.thr_jnd)
+                )
+        start_h += patch_sz
+
+    score_blocky_smooth = (
+        float(sum(scores_smooth) / len(scores_smooth)) if scores_smooth else 1.0
+    )
+    score_blurred_textured = (
+        float(sum(scores_textured) / len(scores_textured)) if scores_textured else 1.0
+    )
+    score_quality = (score_blocky_smooth**iqam.alpha_block) * (
+        score_blurred_textured ** (1 - iqam.alpha_block)
+    )
+    return score_quality >= iqam.thr_out
+
+
+def make_image(h, w, device):
+    """Make a blocky image that contains both smooth and textured blocks."""
+    x = torch.rand(1, 3, h // 8 + 1, w // 8 + 1, device=device)
+    x = nn_func.interpolate(x, size=(h, w), mode="nearest")
+    x[..., : h // 2, :] += 0.05 * torch.rand(1, 3, h // 2, w, device=device)
+    return x
+
+
+def measure(func, x, nrepeats, device):
+    """Measure the average latency of func(x) in millisecond."""
+    func(x)  # warm up
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(nrepeats):
+        out = func(x)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / nrepeats * 1000, out
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the exit decision of IQAM in RBQE.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--comp-type", type=str, default="hevc", choices=["jpeg", "hevc"]
+    )
+    parser.add_argument(
+        "--sizes",
+        type=str,
+        nargs="+",
+        default=["128x128", "256x256", "512x512", "720x1280", "1080x1920"],
+        help="image sizes in the format of HxW",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda" if torch.cuda.is_available() else "cpu",
+        help="IQAM follows the device of the input image",
+    )
+    parser.add_argument("--nrepeats", type=int, default=10)
+    parser.add_argument(
+        "--max-ref-pixels",
+        type=int,
+        default=512 * 512,
+        help="skip the slow reference for images larger than this",
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+    iqam = IQAM(comp_type=args.comp_type)
+
+    print(f"{'size':>10} {'batched (ms)':>14} {'reference (ms)':>16} {'same exit':>10}")
+    with torch.no_grad():
+        for size in args.sizes:
+            h, w = [int(s) for s in size.split("x")]
+            x = make_image(h, w, device)
+            t_batched, if_out = measure(iqam.forward, x, args.nrepeats, device)
+
+            if h * w <= args.max_ref_pixels:
+                t_ref, if_out_ref = measure(
+                    lambda x: iqam_reference(iqam, x), x, 1, device
+                )
+                t_ref = f"{t_ref:.2f}"
+                same = str(bool(if_out) == bool(if_out_ref))
+            else:
+                t_ref, same = "-", "-"
+
+            print(f"{size:>10} {t_batched:>14.2f} {t_ref:>16} {same:>10}")
@@ -0,0 +1,264 @@
+"""Calibrate the early-exit threshold of a blind RBQE model.
+
+For each validation image, outputs of all exits, their metric values and IQAM
+scores are computed once. The exit for a threshold is then the first exit whose
+IQAM score reaches the threshold, or the last exit. Thus, a whole sweep of
+thresholds costs only one pass over the validation set.
+
+The cost of exiting at exit k is measured once per image shape:
+    latency: Forward to exit k plus the IQAM decisions made before the exit.
+    FLOPs: Forward to exit k counted by MMCV. IQAM is not counted.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import time
+
+import mmcv
+import numpy as np
+import torch
+from mmcv import Config
+from mmcv.cnn import get_model_complexity_info
+from mmcv.runner import load_checkpoint
+
+from powerqe.datasets import build_dataset
+from powerqe.models import build_model
+
+
+def measure_latency(func, device, nrepeats):
+    """Measure the average latency of func() in millisecond."""
+    func()  # warm up
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(nrepeats):
+        func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / nrepeats * 1000
+
+
+def measure_exit_costs(generator, lq, nrepeats):
+    """Measure the latency (ms) and FLOPs (G) of exiting at each exit.
+
+    Args:
+        generator (nn.Module): Blind RBQE network.
+        lq (Tensor): LQ image with the shape of (N=1, C, H, W).
+        nrepeats (int): Number of repeats for latency measurement.
+
+    Returns:
+        list[float]: Latency of each exit.
+        list[float]: FLOPs of each exit.
+    """
+    device = lq.device
+    nlevel = generator.nlevel
+
+    t_iqam = measure_latency(lambda: generator.iqam.forward(lq), device, nrepeats)
+
+    latencies = []
+    flops = []
+    for idx_exit in range(nlevel):
+        t_net = measure_latency(
+            lambda: generator(lq, idx_out=idx_exit), device, nrepeats
+        )
+        niqams = min(idx_exit + 1, nlevel - 1)  # no IQA at the last exit
+        latencies.append(t_net + niqams * t_iqam)
+
+        flops_exit, _ = get_model_complexity_info(
+            generator,
+            input_shape=tuple(lq.shape[1:]),
+            input_constructor=lambda _: dict(x=lq, idx_out=idx_exit),
+            print_per_layer_stat=False,
+            as_strings=False,
+        )
+        flops.append(flops_exit / 1e9)
+
+    # Exiting earlier should skip the following U-Nets
+    assert all(
+        a < b for a, b in zip(flops, flops[1:])
+    ), f"FLOPs should increase with the exit index; received {flops}."
+    if not all(a < b for a, b in zip(latencies, latencies[1:])):
+        print(
+            "Latency does not increase with the exit index; increase --nrepeats"
+            f" for stable results. Received {latencies}."
+        )
+    return latencies, flops
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Calibrate the early-exit threshold of a blind RBQE model.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("config", help="config file path")
+    parser.add_argument("checkpoint", help="checkpoint file")
+    parser.add_argument(
+        "--split", type=str, default="val", choices=["val", "test"], help="dataset"
+    )
+    parser.add_argument("--metric", type=str, default="PSNR")
+    parser.add_argument(
+        "--thrs",
+        type=float,
+        nargs=3,
+        default=[0.80, 1.00, 0.005],
+        metavar=("START", "STOP", "STEP"),
+        help="thresholds to sweep",
+    )
+    parser.add_argument(
+        "--latency-budget",
+        type=float,
+        default=None,
+        help="average latency budget (ms) for recommending a threshold",
+    )
+    parser.add_argument("--max-samples", type=int, default=None)
+    parser.add_argument("--nrepeats", type=int, default=5)
+    parser.add_argument(
+        "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--out", type=str, default=None, help="output CSV path")
+    parser.add_argument(
+        "--plot", type=str, default=None, help="output figure path; requires matplotlib"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+
+    cfg = Config.fromfile(args.config)
+    model = build_model(cfg.model, train_cfg=None, test_cfg=cfg.test_cfg)
+    load_checkpoint(model, args.checkpoint, map_location="cpu")
+    model.to(device).eval()
+    generator = model.generator
+    if generator.if_only_last_output:
+        raise ValueError("The RBQE model should have multiple exits.")
+    nlevel = generator.nlevel
+
+    dataset = build_dataset(cfg.data[args.split])
+    nsamples = len(dataset)
+    if args.max_samples is not None:
+        nsamples = min(nsamples, args.max_samples)
+
+    # Collect metric values, IQAM scores and costs of all exits
+    results = np.zeros((nsamples, nlevel))
+    scores = np.zeros((nsamples, nlevel - 1))
+    latencies = np.zeros((nsamples, nlevel))
+    flops = np.zeros((nsamples, nlevel))
+    exit_costs = dict()  # costs per image shape
+
+    prog_bar = mmcv.ProgressBar(nsamples)
+    with torch.no_grad():
+        for idx in range(nsamples):
+            data = dataset[idx]
+            lq = data["lq"].unsqueeze(0).to(device)
+            gt = data["gt"].unsqueeze(0).to(device)
+
+            outputs = generator(lq, idx_out=-1)  # (nlevel, N=1, C, H, W)
+            for idx_exit in range(nlevel - 1):
+                scores[idx, idx_exit] = float(
+                    generator.iqam.cal_quality_scores(outputs[idx_exit])[0]
+                )
+
+            if "denormalize" in model.test_cfg:
+                mean = torch.tensor(model.test_cfg["denormalize"]["mean"])
+                mean = mean.view(1, -1, 1, 1).to(device)
+                std = torch.tensor(model.test_cfg["denormalize"]["std"])
+                std = std.view(1, -1, 1, 1).to(device)
+                outputs = outputs * std + mean
+                gt = gt * std + mean
+            for idx_exit in range(nlevel):
+                results[idx, idx_exit] = model.evaluate(
+                    output=outputs[idx_exit], gt=gt
+                )[args.metric]
+
+            shape = tuple(lq.shape)
+            if shape not in exit_costs:
+                exit_costs[shape] = measure_exit_costs(generator, lq, args.nrepeats)
+            latencies[idx], flops[idx] = exit_costs[shape]
+
+            prog_bar.update()
+    print("")
+
+    # Sweep thresholds
+    thrs = np.arange(args.thrs[0], args.thrs[1] + args.thrs[2] / 2, args.thrs[2])
+    if not np.isclose(thrs, generator.iqam.thr_out).any():  # the default one
+        thrs = np.sort(np.append(thrs, generator.iqam.thr_out))
+    records = []
+    for thr in thrs:
+        if_out = np.concatenate(
+            [scores >= thr, np.ones((nsamples, 1), dtype=bool)], axis=1
+        )
+        idxs_exit = np.argmax(if_out, axis=1)  # the first exit that passes
+        samples = np.arange(nsamples)
+        records.append(
+            dict(
+                thr=thr,
+                result=results[samples, idxs_exit].mean(),
+                latency=latencies[samples, idxs_exit].mean(),
+                flops=flops[samples, idxs_exit].mean(),
+                exits=np.bincount(idxs_exit, minlength=nlevel),
+            )
+        )
+
+    header = f"{'thr':>6} {args.metric:>8} {'latency (ms)':>13} {'GFLOPs':>8}  exits"
+    lines = [
+        f"{r['thr']:>6.3f} {r['result']:>8.3f} {r['latency']:>13.2f}"
+        f" {r['flops']:>8.2f}  {','.join(str(n) for n in r['exits'])}"
+        for r in records
+    ]
+    print(header)
+    print("\n".join(lines))
+    print(
+        f"Upper bound (last exit): {args.metric} {results[:, -1].mean():.3f},"
+        f" latency {latencies[:, -1].mean():.2f} ms."
+    )
+
+    if args.latency_budget is not None:
+        records_valid = [r for r in records if r["latency"] <= args.latency_budget]
+        if records_valid:
+            best = max(records_valid, key=lambda r: r["result"])
+            print(
+                f"Recommended threshold under {args.latency_budget} ms:"
+                f" {best['thr']:.3f} ({args.metric} {best['result']:.3f},"
+                f" latency {best['latency']:.2f} ms)."
+            )
+        else:
+            print(f"No threshold meets the latency budget {args.latency_budget} ms.")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(
+                f"thr,{args.metric},latency_ms,gflops,"
+                + ",".join(f"exit{idx_exit}" for idx_exit in range(nlevel))
+                + "\n"
+            )
+            for r in records:
+                f.write(
+                    f"{r['thr']:.3f},{r['result']:.4f},{r['latency']:.4f},"
+                    f"{r['flops']:.4f}," + ",".join(str(n) for n in r["exits"]) + "\n"
+                )
+        print(f"Results are saved to {args.out}.")
+
+    if args.plot:
+        import matplotlib.pyplot as plt  # optional; only for plotting
+
+        plt.plot([r["latency"] for r in records], [r["result"] for r in records], "o-")
+        plt.xlabel("Average latency (ms)")
+        plt.ylabel(args.metric)
+        plt.grid()
+        plt.savefig(args.plot)
+        print(f"Figure is saved to {args.plot}.")
@@ -0,0 +1,61 @@
+"""Build the quality index of each sequence from HM logs.
+
+Each log "{log-dir}/{key}.log" is parsed, and the index of per-frame POC,
+slice type, QP, bits, Y-PSNR and key-frame flag is saved as
+"{lq-dir}/{key}/hm_index.json". See powerqe/utils/hm_log.py.
+
+Logs are written by tools/data/compress_video.py, which also builds the
+indexes after compression. This tool is for existing datasets.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import os.path as osp
+from glob import glob
+
+from powerqe.utils.hm_log import build_hm_index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build the quality index of each sequence from HM logs.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("log_dir", help="e.g., tmp/vimeo_septuplet_bit/hm18.0/ldp/qp37")
+    parser.add_argument("lq_dir", help="e.g., data/vimeo_septuplet_lq/hm18.0/ldp/qp37")
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    log_paths = sorted(glob(osp.join(args.log_dir, "**", "*.log"), recursive=True))
+    nfailed = 0
+    for log_path in log_paths:
+        key = osp.splitext(osp.relpath(log_path, args.log_dir))[0]
+        seq_dir = osp.join(args.lq_dir, key)
+        if not osp.isdir(seq_dir):
+            print(f'Skip "{log_path}"; "{seq_dir}" is not found.')
+            nfailed += 1
+            continue
+        try:
+            build_hm_index(log_path, seq_dir)
+        except ValueError as err:
+            print(f'Skip "{log_path}"; {err}')
+            nfailed += 1
+    print(
+        f"Indexes of {len(log_paths) - nfailed}/{len(log_paths)} sequences are built."
+    )
@@ -21,6 +21,8 @@ from glob import glob
 import cv2
 import numpy as np
 
+from powerqe.utils.hm_log import build_hm_index
+
 
 def write_planar(img, planar_path):
     """Write planar.
@@ -168,6 +170,15 @@ def planar2img(vids):
     pool.join()
 
 
+def build_indexes(vids):
+    """Build the quality index of each LQ sequence from its HM log.
+
+    See powerqe/utils/hm_log.py.
+    """
+    for vid in vids:
+        build_hm_index(vid["log_path"], osp.dirname(vid["tar_paths"][0]))
+
+
 def planar2img_mfqev2(vids):
     pool = mp.Pool(processes=args.max_nprocs)
 
@@ -427,6 +438,9 @@ if __name__ == "__main__":
     # Planar -> Img
     planar2img(vids)
 
+    # HM logs -> Quality indexes
+    build_indexes(vids)
+
     # Planar -> Img for GT
     if args.dataset == "mfqev2" and (not skip_gt):
         planar2img_mfqev2(vids)
@@ -0,0 +1,140 @@
+"""Pre-compute optical flows of a dataset for training.
+
+Flows are computed by SPyNet of the generator, e.g., ProVQE and MFQEv2, and
+stored in float16. Flows of a sequence are stored in one NPZ file:
+"{flow_folder}/{key}.npz". Each flow is an array with the shape of (H, W, 2),
+named by the stems of the reference and supporting frames, e.g., "im2-im1".
+
+Two modes are supported; see get_flow_pairs in powerqe/datasets/pipelines.py:
+    recurrent: Forward and backward flows between neighboring frames, e.g.,
+        for ProVQE. Flows are at the resolution of get_flows, i.e., 1/4 of
+        the input unless the input is low-res.
+    center: Flows from the center frame to the left and right PQFs, e.g., for
+        MFQEv2. Flows are at the resolution of the input.
+
+The flow scale of the generator is followed. Only the frame pairs used by the
+samples of the dataset are computed. Existing files are skipped unless
+--overwrite is set.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import os.path as osp
+
+import mmcv
+import numpy as np
+import torch
+import torch.nn.functional as nn_func
+from mmcv import Config
+from mmcv.runner import load_checkpoint
+
+from powerqe.datasets import build_dataset
+from powerqe.datasets.pipelines import FLOW_MODES, get_flow_name, get_flow_pairs
+from powerqe.models import build_model
+from powerqe.utils.flow import estimate_flow
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pre-compute optical flows of a dataset for training.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("config", help="config file path")
+    parser.add_argument("flow_folder", help="folder to save flows")
+    parser.add_argument(
+        "--checkpoint", type=str, default=None, help="checkpoint file of SPyNet"
+    )
+    parser.add_argument("--mode", type=str, default="recurrent", choices=FLOW_MODES)
+    parser.add_argument(
+        "--split",
+        type=str,
+        default="train",
+        choices=["train", "val", "test"],
+        help="dataset",
+    )
+    parser.add_argument("--batch-size", type=int, default=8, help="pairs per batch")
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument(
+        "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+    return args
+
+
+def read_frm(path, downsample, device):
+    """Read a frame as a tensor with the shape of (1, C, H, W) in [0, 1]."""
+    img = mmcv.imread(path, channel_order="rgb").astype(np.float32) / 255.0
+    frm = torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0).to(device)
+    if downsample:  # same as get_flows of ProVQE
+        frm = nn_func.interpolate(frm, scale_factor=0.25, mode="bicubic")
+    return frm
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+
+    cfg = Config.fromfile(args.config)
+    model = build_model(cfg.model, train_cfg=None, test_cfg=cfg.test_cfg)
+    if args.checkpoint is not None:
+        load_checkpoint(model, args.checkpoint, map_location="cpu")
+    model.to(device).eval()
+    generator = model.generator
+    flow_scale = getattr(generator, "flow_scale", 1)
+    downsample = (args.mode == "recurrent") and not getattr(
+        generator, "is_low_res_input", False
+    )
+
+    dataset_cfg = cfg.data[args.split]
+    while dataset_cfg["type"] == "RepeatDataset":
+        dataset_cfg = dataset_cfg["dataset"]
+    dataset_cfg = dataset_cfg.copy()
+    dataset_cfg["pipeline"] = []  # only data_infos are used
+    dataset_cfg.pop("flow_folder", None)
+    dataset = build_dataset(dataset_cfg)
+
+    # Collect frame pairs of each sequence
+    seq_pairs = dict()
+    for data_info in dataset.data_infos:
+        seq_key = osp.dirname(data_info["key"])
+        pairs = get_flow_pairs(data_info["lq_path"], args.mode)
+        seq_pairs.setdefault(seq_key, set()).update(pairs)
+
+    prog_bar = mmcv.ProgressBar(len(seq_pairs))
+    with torch.no_grad():
+        for seq_key, pairs in seq_pairs.items():
+            flow_path = osp.join(args.flow_folder, seq_key + ".npz")
+            if osp.exists(flow_path) and not args.overwrite:
+                prog_bar.update()
+                continue
+
+            pairs = sorted(pairs)
+            frm_paths = sorted(set(path for pair in pairs for path in pair))
+            frms = {path: read_frm(path, downsample, device) for path in frm_paths}
+
+            flows = dict()
+            for start in range(0, len(pairs), args.batch_size):
+                batch_pairs = pairs[start : start + args.batch_size]
+                ref = torch.cat([frms[pair[0]] for pair in batch_pairs], dim=0)
+                supp = torch.cat([frms[pair[1]] for pair in batch_pairs], dim=0)
+                batch_flows = estimate_flow(generator.spynet, ref, supp, flow_scale)
+                batch_flows = batch_flows.permute(0, 2, 3, 1).cpu().numpy()
+                for pair, flow in zip(batch_pairs, batch_flows):
+                    flows[get_flow_name(*pair)] = flow.astype(np.float16)
+
+            mmcv.mkdir_or_exist(osp.dirname(flow_path))
+            np.savez(flow_path, **flows)
+            prog_bar.update()
+    print(f"\nFlows are saved to {args.flow_folder}.")
@@ -0,0 +1,89 @@
+"""Make an image shard for memory-mapped loading.
+
+Images are decoded once and stored in "{shard_path}/data.bin" contiguously as
+uint8 arrays in HWC and BGR order. Each line of "{shard_path}/meta_info.txt"
+records the image name, the shape and the byte offset, e.g.,
+`0001_s001.png (480,480,3) 0`. See powerqe/datasets/image_shard.py.
+
+Make one shard for GT and one for LQ, e.g., from the sub-images of
+tools/data/prepare_dataset.py (run with --no-lmdb). Then use
+PairedImageShardDataset and LoadImageFromShard. See
+configs/_base_/div2k_shard.py.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import os
+import os.path as osp
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import mmcv
+import numpy as np
+
+
+def read_img(path):
+    img = mmcv.imread(path, flag="color")
+    return np.ascontiguousarray(img)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Make an image shard for memory-mapped loading.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("src_dir", help="e.g., tmp/patches/div2k/train")
+    parser.add_argument("shard_path", help="e.g., data/shard/div2k/train.shard")
+    parser.add_argument(
+        "--suffix", type=str, default="png", help="image suffix for reading images"
+    )
+    parser.add_argument(
+        "--n-thread", type=int, default=8, help="number of threads for decoding"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if not args.shard_path.endswith(".shard"):
+        raise ValueError('"shard_path" must end with ".shard".')
+    if osp.exists(args.shard_path):
+        print(f"Folder {args.shard_path} already exists. Exit.")
+        sys.exit(1)
+
+    names = sorted(mmcv.scandir(args.src_dir, suffix=args.suffix, recursive=False))
+    print(f"Create shard for {args.src_dir}, save to {args.shard_path}...")
+    print(f"Total images: {len(names)}")
+
+    os.makedirs(args.shard_path)
+    prog_bar = mmcv.ProgressBar(len(names))
+    offset = 0
+    with open(osp.join(args.shard_path, "data.bin"), "wb") as data_file, open(
+        osp.join(args.shard_path, "meta_info.txt"), "w"
+    ) as meta_file, ThreadPoolExecutor(max_workers=args.n_thread) as executor:
+        # Decode in chunks to bound the memory of decoded images
+        chunk_size = args.n_thread * 4
+        for idx in range(0, len(names), chunk_size):
+            chunk = names[idx : idx + chunk_size]
+            paths = [osp.join(args.src_dir, name) for name in chunk]
+            for name, img in zip(chunk, executor.map(read_img, paths)):
+                h, w, c = img.shape
+                data_file.write(img.tobytes())
+                meta_file.write(f"{name} ({h},{w},{c}) {offset}\n")
+                offset += img.nbytes
+                prog_bar.update()
+    print("\nFinish writing shard.")
@@ -0,0 +1,129 @@
+"""Make an LMDB file for a video dataset.
+
+Frames are stored with the keys "{sequence key}/{frame name}", e.g.,
+"00001/0001/im1.png". The file bytes are stored as they are, i.e., without
+re-encoding. Each line of meta_info.txt records a sequence key and the sorted
+frame names, e.g., `00001/0001 im1.png,im2.png,...,im7.png`.
+
+Make one LMDB file for GT and one for LQ, and then set io_backend="lmdb" of
+PairedVideoDataset with the LMDB files as gt_folder and lq_folder. Load frames
+with LoadFramesFromLmdb. See configs/_base_/vimeo90k_septuplet_lmdb.py.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import os
+import os.path as osp
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+import lmdb
+import mmcv
+from mmedit.datasets.base_sr_dataset import IMG_EXTENSIONS
+
+from powerqe.datasets.seq_index import sort_frm_names
+
+
+def scan_seq(seq_dir):
+    """Scan the sorted frame names and the total size of a sequence."""
+    names = []
+    size = 0
+    for entry in os.scandir(seq_dir):
+        if entry.name.endswith(IMG_EXTENSIONS) and entry.is_file():
+            names.append(entry.name)
+            size += entry.stat().st_size
+    assert len(names) > 0, f'No images were found in "{seq_dir}".'
+    return sort_frm_names(names), size
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Make an LMDB file for a video dataset.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("src_dir", help="e.g., data/vimeo_septuplet/sequences")
+    parser.add_argument(
+        "lmdb_path", help="e.g., data/lmdb/vimeo_septuplet/sequences.lmdb"
+    )
+    parser.add_argument(
+        "--ann-file",
+        default="",
+        help="annotation file of sequence keys; all sub-folders if empty",
+    )
+    parser.add_argument(
+        "--batch", type=int, default=5000, help="number of frames per commit"
+    )
+    parser.add_argument(
+        "--n-thread", type=int, default=8, help="number of threads for reading"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if not args.lmdb_path.endswith(".lmdb"):
+        raise ValueError('"lmdb_path" must end with ".lmdb".')
+    if osp.exists(args.lmdb_path):
+        print(f"Folder {args.lmdb_path} already exists. Exit.")
+        sys.exit(1)
+
+    # Get sequence keys
+    if args.ann_file:
+        with open(args.ann_file, "r") as f:
+            keys = [k.strip() for k in f.read().split("\n") if k.strip()]
+    else:
+        keys = sorted(
+            osp.basename(osp.normpath(d)) for d in glob(osp.join(args.src_dir, "*/"))
+        )
+
+    with ThreadPoolExecutor(max_workers=args.n_thread) as executor:
+        seqs = list(
+            executor.map(scan_seq, [osp.join(args.src_dir, key) for key in keys])
+        )
+    nfrms = sum(len(names) for names, _ in seqs)
+    data_size = sum(size for _, size in seqs)
+    print(f"Create lmdb for {args.src_dir}, save to {args.lmdb_path}...")
+    print(f"Total sequences: {len(keys)}; total frames: {nfrms}")
+
+    os.makedirs(args.lmdb_path)
+    env = lmdb.open(args.lmdb_path, map_size=data_size * 2 + (1 << 30))
+
+    prog_bar = mmcv.ProgressBar(len(keys))
+    txn = env.begin(write=True)
+    nput = 0
+    with open(
+        osp.join(args.lmdb_path, "meta_info.txt"), "w"
+    ) as meta_file, ThreadPoolExecutor(max_workers=args.n_thread) as executor:
+        for key, (names, _) in zip(keys, seqs):
+            paths = [osp.join(args.src_dir, key, name) for name in names]
+            for name, frm_bytes in zip(names, executor.map(read_bytes, paths)):
+                txn.put(f"{key}/{name}".encode(), frm_bytes)
+                nput += 1
+                if nput % args.batch == 0:
+                    txn.commit()
+                    txn = env.begin(write=True)
+            meta_file.write(f"{key} {','.join(names)}\n")
+            prog_bar.update()
+    txn.commit()
+    env.close()
+    print("\nFinish writing lmdb.")
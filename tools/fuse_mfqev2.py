@@ -0,0 +1,60 @@
+"""Convert an MFQEv2 checkpoint for the fused feature extraction.
+
+For each kernel size, weights of the three convolutions (left PQF, center frame
+and right PQF) are stacked into one grouped convolution. The converted
+checkpoint should be used with "fused=True" of MFQEv2.
+
+Note that MFQEv2 with "fused=True" also converts unfused checkpoints when
+loading them. This tool is for saving the converted weights once.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+
+import torch
+
+from powerqe.models.backbones.mfqev2 import fuse_feat_convs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert an MFQEv2 checkpoint for the fused feature extraction.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("src", help="source checkpoint")
+    parser.add_argument("dst", help="converted checkpoint")
+    parser.add_argument(
+        "--prefix",
+        type=str,
+        default="generator.",
+        help="prefix of MFQEv2 keys in the state dict",
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    ckpt = torch.load(args.src, map_location="cpu")
+    state_dict = ckpt["state_dict"] if "state_dict" in ckpt else ckpt
+    if f"{args.prefix}ks3_conv_list.0.weight" not in state_dict:
+        raise KeyError(
+            f'"{args.prefix}ks3_conv_list.0.weight" is not found;'
+            " the checkpoint is not an unfused MFQEv2 one."
+        )
+    fuse_feat_convs(state_dict, prefix=args.prefix)
+    torch.save(ckpt, args.dst)
+    print(f"Converted checkpoint is saved to {args.dst}.")
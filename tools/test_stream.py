@@ -0,0 +1,187 @@
+"""Test a sliding-window video model by walking each sequence once.
+
+With center_gt=True and stride=1, the video dataset yields one window per
+frame. tools/test.py then loads and processes each frame in every window that
+contains it. Here, each frame is loaded and its per-frame features are
+extracted only once; windows share them through a buffer. See stream_windows.
+
+The generator should implement extract_frm_feat and forward_frm_feats,
+e.g., EDVRNetQE, STDFNet and MFQEv2.
+
+Copyright 2023 RyanXingQL
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may not use
+this file except in compliance with the License. You may obtain a copy of the
+License at
+https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import os.path as osp
+
+import mmcv
+import numpy as np
+import torch
+from mmcv import Config
+from mmcv.runner import load_checkpoint
+from mmedit.core import tensor2img
+
+from powerqe.datasets import build_dataset
+from powerqe.models import build_model
+from powerqe.utils.streaming import stream_windows
+from powerqe.utils.unfolding import crop_img, pad_img_min_sz
+
+
+def group_windows(dataset):
+    """Group the samples of a video dataset by sequence.
+
+    Args:
+        dataset (PairedVideoDataset): Video dataset with center GT.
+
+    Returns:
+        dict: Sequence folder -> dict of
+            lq_paths (list[str]): LQ frame paths.
+            windows (list[list[int]]): Frame indexes of each sample.
+            idxs_samp (list[int]): Sample indexes in the dataset.
+    """
+    seqs = dict()
+    for idx_samp, data_info in enumerate(dataset.data_infos):
+        seq = osp.dirname(data_info["lq_path"][0])
+        if seq not in seqs:
+            seqs[seq] = dict(lq_paths=[], idxs_frm=dict(), windows=[], idxs_samp=[])
+        _seq = seqs[seq]
+
+        window = []
+        for lq_path in data_info["lq_path"]:
+            if lq_path not in _seq["idxs_frm"]:
+                _seq["idxs_frm"][lq_path] = len(_seq["lq_paths"])
+                _seq["lq_paths"].append(lq_path)
+            window.append(_seq["idxs_frm"][lq_path])
+        _seq["windows"].append(window)
+        _seq["idxs_samp"].append(idx_samp)
+
+    for _seq in seqs.values():
+        _seq.pop("idxs_frm")
+    return seqs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Test a sliding-window video model by streaming.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("config", help="config file path")
+    parser.add_argument("checkpoint", help="checkpoint file")
+    parser.add_argument(
+        "--split", type=str, default="test", choices=["val", "test"], help="dataset"
+    )
+    parser.add_argument(
+        "--save-path",
+        type=str,
+        default=None,
+        help="path to store images and if not given, will not save image",
+    )
+    parser.add_argument(
+        "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+
+    cfg = Config.fromfile(args.config)
+    model = build_model(cfg.model, train_cfg=None, test_cfg=cfg.test_cfg)
+    load_checkpoint(model, args.checkpoint, map_location="cpu")
+    model.to(device).eval()
+    generator = model.generator
+    test_cfg = model.test_cfg
+
+    if not model.center_gt:
+        raise ValueError('Streaming requires "center_gt" to be True.')
+    for func in ["extract_frm_feat", "forward_frm_feats"]:
+        if not hasattr(generator, func):
+            raise NotImplementedError(
+                f'"{type(generator).__name__}" does not implement "{func}".'
+            )
+    if "unfolding" in test_cfg or "chunking" in test_cfg:
+        raise NotImplementedError("Unfolding and chunking are not supported.")
+
+    if "denormalize" in test_cfg:
+        mean = torch.tensor(test_cfg["denormalize"]["mean"]).view(-1, 1, 1).to(device)
+        std = torch.tensor(test_cfg["denormalize"]["std"]).view(-1, 1, 1).to(device)
+
+    dataset = build_dataset(cfg.data[args.split])
+    seqs = group_windows(dataset)
+
+    def load_frm(lq_path):
+        gt_path = osp.join(
+            dataset.gt_folder, osp.relpath(lq_path, dataset.lq_folder)
+        )  # GT and LQ frames share the name
+        data = dataset.pipeline(
+            dict(lq_path=[lq_path], gt_path=[gt_path], scale=dataset.scale)
+        )
+        lq = data["lq"].to(device)  # (T=1, C, H, W) as (N=1, C, H, W)
+        gt = data["gt"][0].to(device)  # (C, H, W)
+
+        pad_info = None
+        if "padding" in test_cfg:
+            lq, pad_info = pad_img_min_sz(lq, test_cfg["padding"]["minSize"])
+        return dict(
+            feat=generator.extract_frm_feat(lq),
+            gt=gt,
+            pad_info=pad_info,
+            lq_path=lq_path,
+        )
+
+    def forward_window(entries):
+        kwargs = dict()
+        if getattr(generator, "flow_cache", None) is not None:
+            kwargs["frm_keys"] = [[entry["lq_path"] for entry in entries]]
+        output = generator.forward_frm_feats(
+            [entry["feat"] for entry in entries], **kwargs
+        )
+        entry_center = entries[len(entries) // 2]
+        if entry_center["pad_info"] is not None:
+            output = crop_img(output, entry_center["pad_info"])
+        return output[0], entry_center["gt"]
+
+    eval_results = []
+    prog_bar = mmcv.ProgressBar(len(dataset))
+    with torch.no_grad():
+        for _seq in seqs.values():
+            lq_paths = _seq["lq_paths"]
+            outputs = stream_windows(
+                _seq["windows"],
+                load_func=lambda idx: load_frm(lq_paths[idx]),
+                window_func=forward_window,
+            )
+            for idx_samp, (output, gt) in zip(_seq["idxs_samp"], outputs):
+                if "denormalize" in test_cfg:
+                    output = output * std + mean
+                    gt = gt * std + mean
+
+                if args.save_path:
+                    key = dataset.data_infos[idx_samp]["key"]
+                    save_subpath = osp.splitext(key)[0] + ".png"
+                    mmcv.imwrite(
+                        tensor2img(output), osp.join(args.save_path, save_subpath)
+                    )
+
+                eval_results.append(
+                    model.evaluate(metrics=test_cfg["metrics"], output=output, gt=gt)
+                )
+                prog_bar.update()
+    print("")
+
+    for metric in test_cfg["metrics"]:
+        result = np.mean([eval_result[metric] for eval_result in eval_results])
+        print(f"{metric}: {result:.4f}")